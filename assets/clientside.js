@@ -0,0 +1,75 @@
+// Callbacks that only rearrange data the browser already has, run in the browser rather than on the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        // Swaps the distribution options between the histogram and map layouts (see `update_dist_view`)
+        update_dist_view: function (n_clicks, children, layouts) {
+            if (!layouts) {
+                return window.dash_clientside.no_update;
+            }
+            if (n_clicks > 0 && children !== 'Show Histogram') {
+                return layouts.map;
+            }
+            return layouts.hist;
+        },
+
+        // Sets subspecies options in dropdown based on user-selected species
+        set_subspecies_options: function (selected_species, jsonified_data) {
+            var all_species = JSON.parse(jsonified_data).all_species;
+            return (all_species[selected_species] || []).map(function (value) {
+                return {label: value, value: value};
+            });
+        },
+
+        // Collect selected subspecies to display in multi-select dropdown
+        set_subspecies_value: function (available_options) {
+            return available_options[0].value;
+        },
+
+        // Moves the image gallery's cursor to the previous or next page (staying within its images)
+        change_image_page: function (prev_clicks, next_clicks, gallery) {
+            var no_update = window.dash_clientside.no_update;
+            if (!gallery || gallery.message !== undefined) {
+                return no_update;
+            }
+            var triggered = window.dash_clientside.callback_context.triggered_id;
+            var step = triggered === 'next-images' ? 1 : -1;
+            var cursor = gallery.cursor + step * gallery.page_size;
+            if (cursor < 0 || cursor >= gallery.total) {
+                return no_update;
+            }
+            return Object.assign({}, gallery, {cursor: cursor});
+        },
+
+        // Adds the value of a clicked histogram bar (of the x variable) or pie slice (of its variable) to the cross-filter,
+        // or removes it if it is already the filtered value (or all values, if the filter is cleared)
+        update_cross_filter: function (dist_click, pie_click, clear_clicks, x_var, pie_var, btn, cross_filter) {
+            var no_update = window.dash_clientside.no_update;
+            var triggered = window.dash_clientside.callback_context.triggered_id;
+            var filters = Object.assign({}, cross_filter);
+            var column, value;
+            if (triggered === 'clear-filter') {
+                filters = {};
+            } else if (triggered === 'dist-plot' && dist_click && btn !== 'Show Histogram') {
+                column = x_var;
+                value = dist_click.points[0].x;
+            } else if (triggered === 'pie-plot' && pie_click) {
+                column = pie_var;
+                value = pie_click.points[0].label;
+            } else {
+                return no_update;
+            }
+            if (column !== undefined) {
+                if (filters[column] === value) {
+                    delete filters[column];
+                } else {
+                    filters[column] = value;
+                }
+            }
+            var labels = Object.keys(filters).map(function (key) {
+                return key + ': ' + filters[key];
+            });
+            var style = {display: labels.length ? 'block' : 'none', textAlign: 'center'};
+            return [filters, labels.length ? 'Filtered to ' + labels.join(', ') : '', style];
+        }
+    }
+});
@@ -0,0 +1,54 @@
+// Loads gallery images (img.lazy-image) only when they are scrolled near the view, by copying data-src to src.
+(function () {
+    var observer = 'IntersectionObserver' in window ?
+        new IntersectionObserver(function (entries) {
+            entries.forEach(function (entry) {
+                if (entry.isIntersecting) {
+                    load(entry.target);
+                }
+            });
+        }, {rootMargin: '200px'}) : null;
+
+    function load(img) {
+        if (observer) {
+            observer.unobserve(img);
+        }
+        var src = img.getAttribute('data-src');
+        if (src && img.getAttribute('src') !== src) {
+            img.setAttribute('src', src);
+        }
+    }
+
+    function watch(img) {
+        if (!img.getAttribute('data-src') || img.getAttribute('src') === img.getAttribute('data-src')) {
+            return;
+        }
+        if (observer) {
+            // React reuses image elements across pages, so drop the previous page's image until this one is in view
+            img.removeAttribute('src');
+            observer.observe(img);
+        } else {
+            load(img);
+        }
+    }
+
+    new MutationObserver(function (mutations) {
+        mutations.forEach(function (mutation) {
+            if (mutation.type === 'attributes') {
+                if (mutation.target.classList.contains('lazy-image')) {
+                    watch(mutation.target);
+                }
+                return;
+            }
+            mutation.addedNodes.forEach(function (node) {
+                if (node.nodeType !== Node.ELEMENT_NODE) {
+                    return;
+                }
+                if (node.classList.contains('lazy-image')) {
+                    watch(node);
+                }
+                node.querySelectorAll('img.lazy-image').forEach(watch);
+            });
+        });
+    }).observe(document.documentElement, {childList: true, subtree: true, attributes: true, attributeFilter: ['data-src']});
+})();
@@ -0,0 +1,47 @@
+// Uploads a file straight to the server (POST /upload, multipart), rather than base64 encoding it into a callback,
+// then loads the dataset into the dashboard: by its key (?dataset=<key>) if it was processed before, otherwise by the
+// name the upload is kept under (?upload=<name>), which processes it in a background job.
+function setSearch(search) {
+    window.history.pushState({}, '', search);
+    // Notify dcc.Location of the new URL
+    window.dispatchEvent(new CustomEvent('_dashprivate_pushstate'));
+}
+
+document.addEventListener('click', function (event) {
+    var button = event.target.closest('#stream-upload');
+    if (!button || button.disabled) {
+        return;
+    }
+    var input = document.createElement('input');
+    input.type = 'file';
+    input.accept = '.csv,.xls,.xlsx';
+    input.addEventListener('change', function () {
+        if (!input.files.length) {
+            return;
+        }
+        var form = new FormData();
+        form.append('file', input.files[0]);
+        var label = button.textContent;
+        button.disabled = true;
+        button.textContent = 'Uploading...';
+        fetch('upload', {method: 'POST', body: form})
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                if (data.dataset_key) {
+                    setSearch('?dataset=' + encodeURIComponent(data.dataset_key));
+                } else if (data.upload) {
+                    setSearch('?upload=' + encodeURIComponent(data.upload));
+                } else {
+                    setSearch('?upload_error=' + encodeURIComponent(JSON.stringify(data.error)));
+                }
+            })
+            .catch(function (error) {
+                setSearch('?upload_error=' + encodeURIComponent(JSON.stringify({other: String(error)})));
+            })
+            .finally(function () {
+                button.disabled = false;
+                button.textContent = label;
+            });
+    });
+    input.click();
+});
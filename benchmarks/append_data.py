@@ -0,0 +1,46 @@
+'''
+Times appending a batch of rows to a saved dataset (`append_contents`: reading the upload, appending it with
+`append_data` and `merge_profiles`, saving the dataset, and counting the cube with `append_cube`) against uploading all
+the rows again (`parse_contents`), on synthetic data of increasing size.
+Run from the repository root with `python -m benchmarks.append_data`.
+'''
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+from benchmarks.synthetic import make_synthetic_data
+
+SIZES = [10_000, 100_000, 1_000_000]
+BATCH_ROWS = 5_000
+
+def get_upload(df):
+    # dcc.Upload output of the rows as a CSV
+    return 'data:text/csv;base64,' + base64.b64encode(df.to_csv(index = False).encode('utf-8')).decode('utf-8')
+
+def main(sizes, batch_rows = BATCH_ROWS):
+    # Processed uploads in a temporary directory, so each run processes its uploads
+    os.environ['DATASET_CACHE_DIR'] = tempfile.mkdtemp(prefix = 'dashboard-benchmark-')
+    from dashboard import parse_contents, append_contents
+
+    print(f"{'rows':>10} {'batch':>8} {'reprocess (s)':>14} {'append (s)':>11}")
+    for num_rows in sizes:
+        df = make_synthetic_data(num_rows, seed = 0)
+        batch = make_synthetic_data(batch_rows, seed = 1)
+        # The dataset being appended to is processed (and its cube counted) when it is uploaded
+        base_key = json.loads(parse_contents(get_upload(df), f'base_{num_rows}.csv'))['dataset_key']
+        combined = get_upload(pd.concat([df, batch], ignore_index = True))
+        batch_upload = get_upload(batch)
+        start = time.perf_counter()
+        parse_contents(combined, f'combined_{num_rows}.csv')
+        reprocess = time.perf_counter() - start
+        start = time.perf_counter()
+        output = json.loads(append_contents(batch_upload, f'batch_{num_rows}.csv', base_key))
+        append = time.perf_counter() - start
+        assert 'error' not in output, output
+        print(f"{num_rows:>10} {batch_rows:>8} {reprocess:>14.3f} {append:>11.3f}")
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,52 @@
+'''
+Times cross-filtered counts (a histogram of Subspecies by View, for the rows of one Species) summed from the count cube
+(`get_cube_counts`) against filtering and counting the rows (`get_counts`), on synthetic data of increasing size.
+Run from the repository root with `python -m benchmarks.cross_filter`.
+'''
+import sys
+import time
+import numpy as np
+from benchmarks.synthetic import make_synthetic_data
+from components.aggregate import get_counts, get_cube, get_cube_counts
+from components.ingest import get_columns, get_features, clean_chunk
+from components.query import get_data
+
+SIZES = [10_000, 100_000, 1_000_000]
+REPEATS = 20
+COLUMNS = ['Subspecies', 'View']
+FILTERS = {'Species': 'melpomene'}
+
+def prepare(num_rows):
+    df = make_synthetic_data(num_rows)
+    df.columns = get_columns(df.columns)
+    features, mapping, img_urls = get_features(df.columns)
+    df = clean_chunk(df, features, mapping)
+    return get_data(df, mapping, features)[0]
+
+def time_median(function):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1e3
+
+def count_rows(df):
+    selected = np.ones(len(df), dtype = bool)
+    for col, value in FILTERS.items():
+        selected &= (df[col] == value).to_numpy()
+    return get_counts(df.loc[selected], COLUMNS)
+
+def main(sizes):
+    print(f"{'rows':>10} {'cube rows':>10} {'cube (s)':>9} {'rows (ms)':>10} {'cube (ms)':>10}")
+    for num_rows in sizes:
+        df = prepare(num_rows)
+        start = time.perf_counter()
+        cube = get_cube(df)
+        build = time.perf_counter() - start
+        rows_time = time_median(lambda: count_rows(df))
+        cube_time = time_median(lambda: get_cube_counts(cube, COLUMNS, FILTERS))
+        print(f"{num_rows:>10} {len(cube):>10} {build:>9.3f} {rows_time:>10.3f} {cube_time:>10.3f}")
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,49 @@
+'''
+Compares the size (JSON sent to the browser) and build time of maps of many distinct localities: combined into grid cells
+(as below DENSITY_MAP_SITES) and drawn as a density image (`make_density_map`), on synthetic data with jittered coordinates.
+Run from the repository root with `python -m benchmarks.density_map`.
+'''
+import sys
+import time
+import numpy as np
+import pandas as pd
+from components.aggregate import get_locality_counts
+from components.graphs import make_map, make_density_map
+import components.graphs
+
+SIZES = [10_000, 100_000, 1_000_000]
+# Zoom levels of grid maps
+ZOOMS = [1, 4, 7]
+
+def make_locality_data(num_rows, seed = 0):
+    # Specimens at distinct localities spread around the source's localities
+    rng = np.random.default_rng(seed)
+    lat = np.clip(rng.normal(0, 15, num_rows), -60, 60).round(5)
+    lon = np.clip(rng.normal(-70, 20, num_rows), -180, 180).round(5)
+    df = pd.DataFrame({'Lat': lat, 'Lon': lon,
+                       'Species': pd.Categorical(rng.choice(['erato', 'melpomene', 'sara', 'hecale'], num_rows))})
+    df['lat-lon'] = (df['Lat'].astype(str) + '|' + df['Lon'].astype(str)).astype('category')
+    df['Samples_at_locality'] = 1
+    df['Species_at_locality'] = df['Species']
+    df['Subspecies_at_locality'] = 'unknown'
+    return df
+
+def measure(make):
+    start = time.perf_counter()
+    size = len(make().to_json())
+    return size / 1024, time.perf_counter() - start
+
+def main(sizes):
+    print(f"{'rows':>10} " + " ".join(f"{f'grid zoom {zoom} (KB)':>18} {'time (s)':>9}" for zoom in ZOOMS)
+          + f" {'density map (KB)':>17} {'time (s)':>9}")
+    for num_rows in sizes:
+        counts = get_locality_counts(make_locality_data(num_rows), 'Species')
+        # Grids as if below DENSITY_MAP_SITES
+        components.graphs.DENSITY_MAP_SITES = len(counts)
+        grids = [measure(lambda: make_map(None, 'Species', zoom = zoom, counts = counts)) for zoom in ZOOMS]
+        density_size, density_time = measure(lambda: make_density_map(counts, 'Species'))
+        print(f"{num_rows:>10} " + " ".join(f"{size:>18.1f} {elapsed:>9.2f}" for size, elapsed in grids)
+              + f" {density_size:>17.1f} {density_time:>9.2f}")
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or SIZES)
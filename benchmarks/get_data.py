@@ -0,0 +1,29 @@
+'''
+Times the upload processing (`get_profile` and `get_data`) on synthetic data of increasing size.
+Run from the repository root with `python -m benchmarks.get_data`.
+'''
+import sys
+import time
+from benchmarks.synthetic import make_synthetic_data
+from components.query import get_data
+from components.profile import get_profile
+
+SIZES = [10_000, 100_000, 1_000_000]
+FEATURES = ['Species', 'Subspecies', 'View', 'Sex', 'Hybrid_stat', 'Lat', 'Lon']
+
+def time_upload(num_rows):
+    df = make_synthetic_data(num_rows)
+    df.columns = df.columns.str.capitalize()
+    start = time.perf_counter()
+    get_profile(df, True)
+    get_data(df, True, list(FEATURES))
+    return time.perf_counter() - start
+
+def main(sizes):
+    print(f"{'rows':>10} {'seconds':>10} {'us/row':>10}")
+    for num_rows in sizes:
+        elapsed = time_upload(num_rows)
+        print(f"{num_rows:>10} {elapsed:>10.3f} {elapsed / num_rows * 1e6:>10.3f}")
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,48 @@
+'''
+Times image selection (`get_filenames`) with the precomputed image index on synthetic data of increasing size.
+Run from the repository root with `python -m benchmarks.get_filenames`.
+'''
+import sys
+import time
+import numpy as np
+from benchmarks.synthetic import make_synthetic_data
+from components.ingest import get_columns, get_features, clean_chunk
+from components.index import get_image_index
+from components.query import get_data, get_filenames
+
+SIZES = [10_000, 100_000, 1_000_000]
+REPEATS = 100
+# (subspecies, view, sex, hybrid) selections
+SELECTIONS = {'any': ('Any', ['dorsal', 'ventral'], ['male', 'female', 'unknown'], ['valid subspecies', 'subspecies synonym']),
+              'species': ('Any-melpomene', ['dorsal'], ['male'], ['valid subspecies', 'subspecies synonym']),
+              'subspecies': (['plesseni', 'lativitta'], ['dorsal'], ['male', 'female'], ['valid subspecies', 'subspecies synonym'])}
+
+def prepare(num_rows):
+    df = make_synthetic_data(num_rows)
+    # source metadata has image filenames, but no urls
+    df['file_url'] = df['Image_filename']
+    df.columns = get_columns(df.columns)
+    features, mapping, img_urls = get_features(df.columns)
+    df = clean_chunk(df, features, mapping)
+    return get_data(df, mapping, features)[0]
+
+def time_selection(df, index, selection):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        get_filenames(df, *selection, 20, index)
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1e3
+
+def main(sizes):
+    print(f"{'rows':>10} {'index (s)':>10} " + " ".join(f"{name + ' (ms)':>16}" for name in SELECTIONS))
+    for num_rows in sizes:
+        df = prepare(num_rows)
+        start = time.perf_counter()
+        index = get_image_index(df)
+        build = time.perf_counter() - start
+        times = [time_selection(df, index, selection) for selection in SELECTIONS.values()]
+        print(f"{num_rows:>10} {build:>10.3f} " + " ".join(f"{elapsed:>16.3f}" for elapsed in times))
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,68 @@
+'''
+Compares peak memory of reading an upload in chunks (`read_upload`) with reading it in one piece (decode the whole
+upload to a string and parse it with `pd.read_csv`), on a synthetic version of the Hoyal Cuthill Gold Standard metadata.
+Run from the repository root with `python -m benchmarks.ingest_memory [num_rows]` (Linux only: reads /proc/self).
+'''
+import base64
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import pandas as pd
+from benchmarks.synthetic import make_synthetic_data
+
+NUM_ROWS = 1_000_000
+
+def get_memory_mb(field):
+    # VmRSS: current resident memory, VmHWM: peak resident memory
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+
+def reset_peak_memory():
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+
+def read_in_one_piece(contents):
+    content_type, content_string = contents.split(',')
+    decoded = base64.b64decode(content_string)
+    return pd.read_csv(io.StringIO(decoded.decode('utf-8')))
+
+def measure(mode, contents_path):
+    '''
+    Runs in a subprocess: reads the upload with the given mode and prints memory used.
+    '''
+    from components.ingest import read_upload
+    with open(contents_path) as file:
+        contents = file.read()
+    baseline = get_memory_mb('VmRSS')
+    reset_peak_memory()
+    if mode == 'chunked':
+        df = read_upload(contents, 'synthetic.csv')[0]
+    else:
+        df = read_in_one_piece(contents)
+    peak = get_memory_mb('VmHWM') - baseline
+    frame = df.memory_usage(deep = True).sum() / 2**20
+    print(f"{mode:>10} {len(contents) / 2**20:>14.1f} {frame:>10.1f} {peak:>10.1f}")
+
+def main(num_rows):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_bytes = make_synthetic_data(num_rows).to_csv(index = False).encode('utf-8')
+        contents_path = os.path.join(tmp_dir, 'contents.txt')
+        with open(contents_path, 'w') as file:
+            file.write('data:text/csv;base64,' + base64.b64encode(csv_bytes).decode('utf-8'))
+        del csv_bytes
+
+        print(f"{num_rows} rows (memory in MB)")
+        print(f"{'mode':>10} {'upload (b64)':>14} {'frame':>10} {'peak':>10}")
+        for mode in ['one-piece', 'chunked']:
+            subprocess.run([sys.executable, '-m', 'benchmarks.ingest_memory', '--measure', mode, contents_path],
+                           check = True)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ROWS)
@@ -0,0 +1,381 @@
+'''
+Load test of the dashboard: simulated sessions replay a typical visit (upload, histogram options, map view, pie chart
+options, and sample images) through the Dash callback endpoint (/_dash-update-component), as the browser would, and the
+throughput, latency percentiles (overall and of each kind of request), and memory of the server are reported.
+Run from the repository root (Linux only for memory: reads /proc), for example:
+
+    python -m benchmarks.load                                        # in-process (Flask test client), 8 concurrent sessions
+    python -m benchmarks.load --workers 1 2 4 --worker-class sync gthread --sessions 64 --concurrency 16
+
+With `--workers`, a gunicorn server (as in run.sh) is started on a free local port for each worker count and class.
+Requests are built from the callbacks the server lists (/_dash-dependencies), with the inputs and state of each session.
+'''
+import argparse
+import base64
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+UPLOAD_FILE = "test_data/HCGSD_full_filepath.csv"
+SESSIONS = 32
+CONCURRENCY = 8
+THREADS = 4
+# Seconds between polls of background (upload) jobs, and between memory samples
+POLL_INTERVAL = 0.2
+SAMPLE_INTERVAL = 0.25
+SERVER_TIMEOUT = 120
+PERCENTILES = [50, 95, 99]
+
+# Initial values of the inputs and state of the callbacks (as in the page's layout)
+INITIAL_VALUES = {'url.search': '',
+                  'dataset-picker.value': None,
+                  'x-variable.value': 'Subspecies',
+                  'color-by.value': 'View',
+                  'sort-by.value': 'alpha',
+                  'dist-view-btn.children': 'Show Map View',
+                  'map-zoom.data': 1,
+                  'cross-filter.data': {},
+                  'prct-brkdwn.value': 'Species',
+                  'display-img.n_clicks': 0,
+                  'subspecies-show.value': 'Any',
+                  'num-images.value': 20}
+
+# A visit: (kind of request, changed input, its new value, other inputs set with it), each sent to the callbacks it triggers
+# ('upload' is a background callback; its result triggers the layout and figures)
+VISIT = [('histogram', 'x-variable.value', 'Species', {}),
+         ('histogram', 'color-by.value', 'Sex', {}),
+         ('sort', 'sort-by.value', 'sum descending', {}),
+         ('map', 'dist-view-btn.children', 'Show Histogram', {'color-by.value': 'Species'}),
+         ('map', 'color-by.value', 'Subspecies', {}),
+         ('histogram', 'dist-view-btn.children', 'Show Map View', {'color-by.value': 'View'}),
+         ('pie', 'prct-brkdwn.value', 'Subspecies', {}),
+         ('pie', 'prct-brkdwn.value', 'View', {}),
+         ('pie', 'prct-brkdwn.value', 'Sex', {})]
+# Kinds of the requests of the callbacks triggered by a new dataset (and by the image display)
+OUTPUT_KINDS = {'output-data-upload.children': 'layout',
+                'dist-plot.figure': 'histogram',
+                'pie-plot.figure': 'pie',
+                'which-sex.options': 'image options',
+                'image-gallery.data': 'display',
+                'image-1.children': 'gallery'}
+
+class TestClientTransport:
+    '''
+    Sends requests to the app in this process, through the Flask test client.
+    '''
+    def __init__(self):
+        from dashboard import server
+        self.client = server.test_client()
+
+    def get(self, path):
+        return self.client.get(path).get_json()
+
+    def post(self, path, body):
+        response = self.client.post(path, json = body)
+        return response.status_code, response.get_json(silent = True)
+
+class HTTPTransport:
+    '''
+    Sends requests to a server at `url` (keeping the connection open between requests of a session).
+    '''
+    def __init__(self, url):
+        import requests
+        self.url = url
+        self.session = requests.Session()
+
+    def get(self, path):
+        return self.session.get(self.url + path).json()
+
+    def post(self, path, body):
+        response = self.session.post(self.url + path, json = body)
+        return response.status_code, response.json() if response.content else None
+
+def get_upload_contents(path):
+    '''
+    Returns the file at `path` as uploaded by dcc.Upload (base64 encoded data URL).
+    '''
+    with open(path, 'rb') as file:
+        return 'data:text/csv;base64,' + base64.b64encode(file.read()).decode('utf-8')
+
+def get_prop_ids(items):
+    return [item['id'] + '.' + item['property'] for item in items]
+
+def get_output_ids(output):
+    '''
+    Returns the 'id.prop' of each output of a callback output string (eg., '..a.b...c.d..' or 'memory.data@<hash>').
+    '''
+    return [item.split('@')[0] for item in output.strip('.').split('...')]
+
+class Session:
+    '''
+    A simulated visit to the dashboard: keeps the values of the page's inputs and sends the callback requests
+    (recording the latency of each) that the browser would send as they change.
+    '''
+    def __init__(self, transport, dependencies, contents, filename):
+        self.transport = transport
+        # Server callbacks (clientside callbacks run in the browser)
+        self.dependencies = [dependency for dependency in dependencies if dependency.get('clientside_function') is None]
+        self.values = {**INITIAL_VALUES, 'upload-data.contents': contents, 'upload-data.filename': filename}
+        self.latencies = []
+
+    def get_body(self, dependency, changed):
+        outputs = [{'id': prop_id.rsplit('.', 1)[0], 'property': prop_id.rsplit('.', 1)[1]}
+                   for prop_id in get_output_ids(dependency['output'])]
+        return {'output': dependency['output'],
+                'outputs': outputs if len(outputs) > 1 else outputs[0],
+                'inputs': [{**item, 'value': self.values.get(prop_id)}
+                           for item, prop_id in zip(dependency['inputs'], get_prop_ids(dependency['inputs']))],
+                'state': [{**item, 'value': self.values.get(prop_id)}
+                          for item, prop_id in zip(dependency['state'], get_prop_ids(dependency['state']))],
+                'changedPropIds': [changed]}
+
+    def send(self, kind, dependency, changed):
+        '''
+        Sends the request of a callback (polling until done for background callbacks), records its latency,
+        and updates the session's values with its outputs.
+        '''
+        body = self.get_body(dependency, changed)
+        start = time.perf_counter()
+        status, result = self.transport.post('/_dash-update-component', body)
+        job = result if status == 200 and 'cacheKey' in result else None
+        # Background callback: poll until the result (or 204, no update, if the job ended without one)
+        while job is not None and status == 200 and 'response' not in result:
+            time.sleep(POLL_INTERVAL)
+            status, result = self.transport.post(f"/_dash-update-component?cacheKey={job['cacheKey']}&job={job['job']}", body)
+        self.latencies.append((kind, time.perf_counter() - start, status))
+        if status == 200 and result is not None and 'response' in result:
+            for component_id, props in result['response'].items():
+                for prop, value in props.items():
+                    self.values[f'{component_id}.{prop}'] = value
+
+    def trigger(self, changed, kind = None):
+        '''
+        Sends the requests of the server callbacks with `changed` as an input (kind named by the callback's output,
+        unless given), and returns their outputs.
+        '''
+        outputs = []
+        for dependency in self.dependencies:
+            if changed in get_prop_ids(dependency['inputs']):
+                output_ids = get_output_ids(dependency['output'])
+                self.send(kind or OUTPUT_KINDS.get(output_ids[0], output_ids[0]), dependency, changed)
+                outputs += output_ids
+        return outputs
+
+    def run(self):
+        self.trigger('upload-data.contents', kind = 'upload')
+        data = json.loads(self.values.get('memory.data') or '{}')
+        if 'dataset_key' not in data:
+            raise RuntimeError(f'Upload failed: {data}')
+        for output in self.trigger('memory.data'):
+            if output == 'output-data-upload.children':
+                # Callbacks with inputs on the new page are called as it loads (figures and image options)
+                self.trigger('cross-filter.data')
+        for kind, changed, value, others in VISIT:
+            if changed == 'dist-view-btn.children' and not data['mapping']:
+                continue
+            self.values.update({changed: value, **others})
+            self.trigger(changed, kind)
+        if data['images']:
+            self.display_images()
+        return self.latencies
+
+    def display_images(self):
+        # Select every value with specimens, as shown by the image options
+        for checklist in ['which-sex', 'which-view', 'hybrid?']:
+            options = self.values.get(checklist + '.options') or []
+            self.values[checklist + '.value'] = [option['value'] for option in options if not option.get('disabled')]
+        self.values['display-img.n_clicks'] = 1
+        self.trigger('display-img.n_clicks')
+        self.trigger('image-gallery.data')
+        gallery = self.values.get('image-gallery.data') or {}
+        if 'cursor' in gallery and gallery['total'] > gallery['page_size']:
+            # Next page (cursor moved in the browser)
+            self.values['image-gallery.data'] = {**gallery, 'cursor': gallery['page_size']}
+            self.trigger('image-gallery.data')
+
+def get_memory_mb(pid):
+    '''
+    Returns memory (MB) of a process and its descendants (Linux only), or None if it cannot be read. Proportional set size
+    (PSS) is summed, so pages shared by processes (eg., forked workers and jobs) are counted once; resident set size (RSS)
+    is used if PSS is not available.
+    '''
+    pids = [pid]
+    total = 0
+    while pids:
+        current = pids.pop()
+        try:
+            total += get_process_memory_kb(current)
+            with open(f'/proc/{current}/task/{current}/children') as children:
+                pids += [int(child) for child in children.read().split()]
+        except (OSError, StopIteration):
+            # process ended, or memory not available
+            if current == pid:
+                return None
+    return total / 1024
+
+def get_process_memory_kb(pid):
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as rollup:
+            return next(int(line.split()[1]) for line in rollup if line.startswith('Pss:'))
+    except (OSError, StopIteration):
+        with open(f'/proc/{pid}/status') as status:
+            return next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+
+class MemorySampler(threading.Thread):
+    '''
+    Samples the memory of a process (and its descendants) every SAMPLE_INTERVAL seconds, keeping the peak.
+    '''
+    def __init__(self, pid):
+        super().__init__(daemon = True)
+        self.pid = pid
+        self.peak = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            memory = get_memory_mb(self.pid)
+            if memory is not None:
+                self.peak = max(self.peak or 0, memory)
+            self.stopped.wait(SAMPLE_INTERVAL)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+def run_sessions(make_transport, pid, args, contents):
+    '''
+    Runs `args.sessions` sessions, `args.concurrency` at a time, measuring memory of process `pid` (and its descendants).
+
+    Returns:
+    --------
+    result - Dictionary of the sessions' 'latencies' ((kind, seconds, status) of each request), 'seconds' taken,
+             and 'memory_mb' (before and peak during the sessions).
+
+    '''
+    dependencies = make_transport().get('/_dash-dependencies')
+    def run_session(number):
+        filename = f'load_test_{number}.csv' if args.unique_uploads else 'load_test.csv'
+        return Session(make_transport(), dependencies, contents, filename).run()
+    memory_before = get_memory_mb(pid)
+    sampler = MemorySampler(pid)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        latencies = [latency for session in executor.map(run_session, range(args.sessions)) for latency in session]
+    seconds = time.perf_counter() - start
+    return {'latencies': latencies, 'seconds': seconds, 'memory_mb': {'before': memory_before, 'peak': sampler.stop()}}
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(workers, worker_class, threads, env):
+    '''
+    Starts gunicorn (as in run.sh) with the given workers on a free local port, waiting until it answers.
+    Returns the process and its url.
+    '''
+    import requests
+    port = get_free_port()
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', worker_class, '-b', f'127.0.0.1:{port}',
+               '-t', '360', 'dashboard:server']
+    if worker_class == 'gthread':
+        command += ['--threads', str(threads)]
+    process = subprocess.Popen(command, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + SERVER_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        try:
+            requests.get(url + '/_dash-dependencies', timeout = 1).raise_for_status()
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'gunicorn did not start within {SERVER_TIMEOUT} s')
+
+def summarize(name, result):
+    '''
+    Returns the throughput, latency percentiles (ms, overall and of each kind of request), errors, and memory of a run.
+    '''
+    def get_percentiles(seconds):
+        return {f'p{percentile}': float(np.percentile(seconds, percentile) * 1e3) for percentile in PERCENTILES}
+    latencies = result['latencies']
+    kinds = {}
+    for kind, seconds, status in latencies:
+        kinds.setdefault(kind, []).append(seconds)
+    return {'config': name,
+            'requests': len(latencies),
+            'errors': sum(status >= 400 for _, _, status in latencies),
+            'seconds': result['seconds'],
+            'requests_per_second': len(latencies) / result['seconds'],
+            'latency_ms': get_percentiles([seconds for _, seconds, _ in latencies]),
+            'kinds': {kind: {'requests': len(seconds), **get_percentiles(seconds)} for kind, seconds in kinds.items()},
+            'memory_mb': result['memory_mb']}
+
+def print_summary(summary):
+    memory = summary['memory_mb']
+    memory = f"{memory['before']:.0f} MB before, {memory['peak']:.0f} MB peak" if memory['peak'] is not None else 'not available'
+    print(f"\n{summary['config']}: {summary['requests']} requests ({summary['errors']} errors) in {summary['seconds']:.1f} s, "
+          f"{summary['requests_per_second']:.1f} requests/s, memory {memory}")
+    print(f"{'request':>16} {'count':>7} " + " ".join(f"{f'p{percentile} (ms)':>10}" for percentile in PERCENTILES))
+    for kind, stats in [('all', {'requests': summary['requests'], **summary['latency_ms']})] + list(summary['kinds'].items()):
+        print(f"{kind:>16} {stats['requests']:>7} " + " ".join(f"{stats[f'p{percentile}']:>10.1f}" for percentile in PERCENTILES))
+
+def get_args(argv):
+    parser = argparse.ArgumentParser(description = 'Load test of the Dash callback endpoint with simulated sessions.')
+    parser.add_argument('--file', default = UPLOAD_FILE, help = 'CSV uploaded by each session')
+    parser.add_argument('--sessions', type = int, default = SESSIONS, help = 'number of sessions')
+    parser.add_argument('--concurrency', type = int, default = CONCURRENCY, help = 'sessions run at the same time')
+    parser.add_argument('--unique-uploads', action = 'store_true',
+                        help = 'upload under a new file name in each session (processed each time), rather than once')
+    parser.add_argument('--workers', type = int, nargs = '+',
+                        help = 'gunicorn worker counts to test (default: in-process, with the Flask test client)')
+    parser.add_argument('--worker-class', nargs = '+', default = ['sync'], help = 'gunicorn worker classes (eg., sync gthread)')
+    parser.add_argument('--threads', type = int, default = THREADS, help = 'threads per gthread worker')
+    parser.add_argument('--output', help = 'save the summaries as JSON')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = get_args(argv)
+    contents = get_upload_contents(args.file)
+    # Processed uploads and background jobs in a temporary directory, so each configuration processes its uploads
+    tmp_dir = tempfile.mkdtemp(prefix = 'dashboard-load-test-')
+    summaries = []
+    if not args.workers:
+        os.environ['DATASET_CACHE_DIR'] = os.path.join(tmp_dir, 'datasets')
+        os.environ['DASHBOARD_JOBS_DIR'] = os.path.join(tmp_dir, 'jobs')
+        result = run_sessions(TestClientTransport, os.getpid(), args, contents)
+        summaries.append(summarize('in-process', result))
+        print_summary(summaries[-1])
+    for worker_class in args.worker_class if args.workers else []:
+        for workers in args.workers:
+            name = f'{workers} {worker_class} workers' + (f' x {args.threads} threads' if worker_class == 'gthread' else '')
+            run_dir = os.path.join(tmp_dir, f'{worker_class}-{workers}')
+            env = {**os.environ,
+                   'DATASET_CACHE_DIR': os.path.join(run_dir, 'datasets'),
+                   'DASHBOARD_JOBS_DIR': os.path.join(run_dir, 'jobs')}
+            process, url = start_server(workers, worker_class, args.threads, env)
+            try:
+                result = run_sessions(lambda: HTTPTransport(url), process.pid, args, contents)
+            finally:
+                process.terminate()
+                process.wait()
+            summaries.append(summarize(name, result))
+            print_summary(summaries[-1])
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(summaries, file, indent = 2)
+    return 1 if any(summary['errors'] for summary in summaries) else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,59 @@
+'''
+Compares the size of the map figure (JSON sent to the browser) drawn from one marker per specimen, as before, with the
+map drawn from locality counts (`make_map`), on the test CSVs and synthetic versions of the Hoyal Cuthill Gold Standard metadata.
+Run from the repository root with `python -m benchmarks.map_size`.
+'''
+import glob
+import time
+import pandas as pd
+import plotly.express as px
+from components.query import get_data
+from components.graphs import make_map
+from components.ingest import get_columns, get_features, clean_chunk, UploadError
+from benchmarks.synthetic import make_synthetic_data
+
+SYNTHETIC_ROWS = [100_000, 1_000_000]
+
+def make_row_map(df, color_by):
+    # Original map: one marker per specimen with valid lat/lon
+    df = df.loc[~df['lat-lon'].astype(str).str.contains('unknown')]
+    return px.scatter_mapbox(df,
+                             lat = "Lat",
+                             lon = "Lon",
+                             custom_data = ["Samples_at_locality", "Species_at_locality", "Subspecies_at_locality"],
+                             size = "Samples_at_locality",
+                             color = color_by,
+                             zoom = 1,
+                             mapbox_style = "white-bg")
+
+def measure(make, df, color_by):
+    start = time.perf_counter()
+    size = len(make(df, color_by).to_json())
+    return size / 1024, time.perf_counter() - start
+
+def prepare(df):
+    df.columns = get_columns(df.columns)
+    included_features, mapping, img_urls = get_features(df.columns)
+    if not mapping:
+        return None
+    df = clean_chunk(df, included_features + (['Locality'] if 'Locality' in df.columns else []), mapping)
+    return get_data(df, mapping, included_features)[0]
+
+def main():
+    datasets = [(path, pd.read_csv(path)) for path in sorted(glob.glob('test_data/*.csv'))]
+    datasets += [(f'synthetic ({num_rows} rows)', make_synthetic_data(num_rows)) for num_rows in SYNTHETIC_ROWS]
+    print(f"{'dataset':>60} {'rows':>8} {'row map (KB)':>13} {'time (s)':>9} {'count map (KB)':>15} {'time (s)':>9}")
+    for name, df in datasets:
+        try:
+            df = prepare(df)
+        except UploadError as e:
+            print(f"{name:>60} skipped: {e.error}")
+            continue
+        if df is None:
+            continue
+        row_size, row_time = measure(make_row_map, df, 'Species')
+        count_size, count_time = measure(make_map, df, 'Species')
+        print(f"{name:>60} {len(df):>8} {row_size:>13.1f} {row_time:>9.2f} {count_size:>15.1f} {count_time:>9.2f}")
+
+if __name__ == '__main__':
+    main()
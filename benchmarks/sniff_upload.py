@@ -0,0 +1,49 @@
+'''
+Times rejecting an upload that is missing a required column (`sniff_upload`) and reading a valid upload with and without
+column projection, on a wide (60 extra columns) synthetic version of the Hoyal Cuthill Gold Standard metadata.
+Run from the repository root with `python -m benchmarks.sniff_upload [num_rows]`.
+'''
+import base64
+import sys
+import time
+import pandas as pd
+from benchmarks.synthetic import make_synthetic_data
+from components.ingest import read_upload, sniff_upload, get_upload_bytes, UploadError, CHUNK_ROWS
+
+NUM_ROWS = 200_000
+EXTRA_COLUMNS = 60
+
+def to_contents(df):
+    return 'data:text/csv;base64,' + base64.b64encode(df.to_csv(index = False).encode('utf-8')).decode('utf-8')
+
+def timed(func, *args):
+    start = time.perf_counter()
+    try:
+        func(*args)
+    except UploadError:
+        pass
+    return time.perf_counter() - start
+
+def read_all_columns(contents, filename):
+    # Full parse without projection (as before sniffing)
+    header = sniff_upload(contents, filename)
+    header = {**header, 'usecols': None}
+    return read_upload(contents, filename, header)
+
+def main(num_rows):
+    df = make_synthetic_data(num_rows)
+    df = df.assign(**{f'extra_{i}': df['Image_filename'] for i in range(EXTRA_COLUMNS)})
+    valid = to_contents(df)
+    missing = to_contents(df.drop(columns = 'Sex'))
+    print(f"{num_rows} rows, {len(df.columns)} columns ({len(valid) / 2**20:.0f} MB base64)")
+    # Reading the first chunk was the earliest rejection before
+    first_chunk = lambda: next(iter(pd.read_csv(get_upload_bytes(missing), chunksize = CHUNK_ROWS)))
+    results = [('reject missing column (sniff)', timed(sniff_upload, missing, 'wide.csv')),
+               ('reject missing column (first chunk)', timed(first_chunk)),
+               ('read all columns', timed(read_all_columns, valid, 'wide.csv')),
+               ('read needed columns', timed(read_upload, valid, 'wide.csv'))]
+    for name, seconds in results:
+        print(f"{name:>36} {seconds:>8.3f} s")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else NUM_ROWS)
@@ -0,0 +1,202 @@
+'''
+Times and memory-profiles each step of the pipeline (upload processing, options, figures, and image selection) on
+synthetic data of increasing size, saves the results as JSON, and compares them with saved results of another commit.
+Run from the repository root, for example:
+
+    python -m benchmarks.suite                                        # 1k to 1M rows, saved in benchmarks/results/<commit>.json
+    python -m benchmarks.suite --sizes 1000 5000000 --localities 100000 --files 1000000
+    python -m benchmarks.suite --baseline benchmarks/results/<other commit>.json
+    python -m benchmarks.suite --compare old.json new.json
+
+With a baseline, exits with status 1 if any step is slower (or uses more memory) than the baseline by more than the
+threshold (and by more than the noise floor), so it can gate a commit.
+Times are the median of the repeats; peak memory is of Python and numpy allocations (tracemalloc), measured separately.
+'''
+import argparse
+import base64
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from benchmarks.synthetic import make_synthetic_data
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+REPEATS = 3
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+# Relative increase (of time or peak memory) counted as a regression
+THRESHOLD = 0.2
+# Differences below these are noise, not regressions
+MIN_SECONDS = 0.005
+MIN_MB = 1.0
+# Image selection (subspecies, view, sex, hybrid) and number of images
+SELECTION = ('Any', ['dorsal', 'ventral'], ['male', 'female', 'unknown'], ['valid subspecies', 'subspecies synonym'])
+NUM_IMAGES = 20
+
+def get_steps(contents, upload_df, df, index):
+    '''
+    Returns the steps to measure as (name, function) pairs, for the synthetic upload (`contents` and its parsed `upload_df`)
+    and its processed DataFrame `df` and image `index`.
+    '''
+    from dashboard import parse_contents
+    from components.graphs import make_hist_plot, make_map, make_pie_plot
+    from components.index import get_image_index
+    from components.query import get_data, get_species_options, get_filenames
+    from components.ingest import get_features
+
+    features, mapping, img_urls = get_features(upload_df.columns)
+    uploads = iter(range(10**9))
+    return [
+        # a new file name each time, so the upload is not already saved
+        ('parse_contents', lambda: parse_contents(contents, f'benchmark_{next(uploads)}.csv')),
+        ('get_data', lambda: get_data(upload_df, mapping, list(features))),
+        ('get_species_options', lambda: get_species_options(df)),
+        ('make_hist_plot', lambda: make_hist_plot(df, 'Subspecies', 'View', 'alpha')),
+        ('make_map', lambda: make_map(df, 'Species')),
+        ('make_pie_plot', lambda: make_pie_plot(df, 'Species')),
+        ('get_image_index', lambda: get_image_index(df)),
+        ('get_filenames', lambda: get_filenames(df, *SELECTION, NUM_IMAGES, index)),
+    ]
+
+def measure_time(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+def measure_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+def prepare(num_rows, args):
+    '''
+    Generates the synthetic upload of `num_rows` rows (as from dcc.Upload), and reads and processes it once.
+    '''
+    from components.ingest import get_columns, get_features, clean_chunk
+    from components.index import get_image_index
+    from components.query import get_data
+
+    raw = make_synthetic_data(num_rows, num_species = args.species, num_localities = args.localities,
+                              num_files = args.files or num_rows)
+    contents = 'data:text/csv;base64,' + base64.b64encode(raw.to_csv(index = False).encode('utf-8')).decode('utf-8')
+    raw.columns = get_columns(raw.columns)
+    features, mapping, img_urls = get_features(raw.columns)
+    upload_df = clean_chunk(raw, features + ['Locality'], mapping)
+    df = get_data(upload_df, mapping, list(features))[0]
+    return contents, upload_df, df, get_image_index(df)
+
+def run(args):
+    results = {}
+    print(f"{'step':>20} {'rows':>10} {'seconds':>10} {'peak MB':>10}")
+    for num_rows in args.sizes:
+        steps = get_steps(*prepare(num_rows, args))
+        for name, function in steps:
+            seconds = measure_time(function, args.repeats)
+            peak_mb = measure_memory(function)
+            results[f'{name}/{num_rows}'] = {'seconds': seconds, 'peak_mb': peak_mb}
+            print(f"{name:>20} {num_rows:>10} {seconds:>10.4f} {peak_mb:>10.1f}")
+    return {'meta': get_run_info(args), 'results': results}
+
+def get_run_info(args):
+    '''
+    Returns the commit, machine, and parameters of a run, saved with its results.
+    '''
+    return {'commit': get_commit(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec = 'seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'params': {'sizes': args.sizes, 'repeats': args.repeats, 'species': args.species,
+                       'localities': args.localities, 'files': args.files}}
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                              check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(baseline, current, threshold = THRESHOLD):
+    '''
+    Compares the results of two runs (as saved by `run`), printing the change of each step measured in both.
+
+    Returns:
+    --------
+    regressions - List of (step, measure, baseline value, current value) of the steps slower (or using more memory) than
+                  the baseline by more than `threshold` (relative) and the noise floor (MIN_SECONDS or MIN_MB).
+
+    '''
+    if baseline['meta']['params'] != current['meta']['params']:
+        print(f"Warning: parameters differ ({baseline['meta']['params']} vs {current['meta']['params']})")
+    regressions = []
+    print(f"{'step':>28} {'baseline s':>11} {'current s':>10} {'change':>8} {'baseline MB':>12} {'current MB':>11} {'change':>8}")
+    for step, result in current['results'].items():
+        if step not in baseline['results']:
+            continue
+        old = baseline['results'][step]
+        line = f"{step:>28}"
+        for measure, noise in [('seconds', MIN_SECONDS), ('peak_mb', MIN_MB)]:
+            change = result[measure] / old[measure] - 1 if old[measure] > 0 else 0.0
+            flag = ''
+            if change > threshold and result[measure] - old[measure] > noise:
+                regressions.append((step, measure, old[measure], result[measure]))
+                flag = ' !'
+            line += f" {old[measure]:>11.4f} {result[measure]:>10.4f} {change:>+7.0%}{flag:2}"
+        print(line)
+    return regressions
+
+def save(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+    with open(path, 'w') as file:
+        json.dump(results, file, indent = 2)
+    print(f"Saved results to {path}")
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+def get_args(argv):
+    parser = argparse.ArgumentParser(description = 'Pipeline benchmark suite on synthetic data.')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = SIZES, help = 'numbers of rows (up to 5M)')
+    parser.add_argument('--repeats', type = int, default = REPEATS, help = 'timed runs of each step (median is saved)')
+    parser.add_argument('--species', type = int, help = 'number of distinct species (default: as in the source data)')
+    parser.add_argument('--localities', type = int, help = 'number of distinct localities (default: as in the source data)')
+    parser.add_argument('--files', type = int, help = 'number of distinct file urls (default: one per row)')
+    parser.add_argument('--output', help = 'results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--baseline', help = 'results file to compare with, fails on regressions')
+    parser.add_argument('--threshold', type = float, default = THRESHOLD, help = 'relative increase counted as a regression')
+    parser.add_argument('--compare', nargs = 2, metavar = ('BASELINE', 'CURRENT'), help = 'compare saved results without running')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = get_args(argv)
+    if args.compare:
+        baseline, current = (load(path) for path in args.compare)
+    else:
+        # Processed uploads and background jobs in a temporary directory, so each run processes its uploads
+        tmp_dir = tempfile.mkdtemp(prefix = 'dashboard-benchmark-')
+        os.environ['DATASET_CACHE_DIR'] = os.path.join(tmp_dir, 'datasets')
+        os.environ['DASHBOARD_JOBS_DIR'] = os.path.join(tmp_dir, 'jobs')
+        current = run(args)
+        save(current, args.output or os.path.join(RESULTS_DIR, f"{current['meta']['commit']}.json"))
+        if not args.baseline:
+            return 0
+        baseline = load(args.baseline)
+    regressions = compare(baseline, current, args.threshold)
+    for step, measure, old, new in regressions:
+        print(f"Regression: {step} {measure} {old:.4f} -> {new:.4f}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+# Source data used as the template for synthetic datasets
+SOURCE_CSV = "test_data/Hoyal_Cuthill_GoldStandard_metadata_cleaned.csv"
+# Range (in degrees) of generated localities, around the source's localities
+LAT_RANGE = (-35.0, 25.0)
+LON_RANGE = (-110.0, -35.0)
+# Base of generated file urls
+FILE_URL_BASE = "https://example.org/images/"
+
+def make_synthetic_data(num_rows, seed = 0, num_species = None, num_localities = None, num_files = None):
+    '''
+    Generates a synthetic dataset shaped like the Hoyal Cuthill Gold Standard metadata by resampling its rows,
+    optionally with more (or fewer) distinct species, localities, and file urls than the source.
+
+    Parameters:
+    -----------
+    num_rows - Integer. Number of rows to generate.
+    seed - Integer. Seed for the random number generator.
+    num_species - Optional integer. Number of distinct species (names 'species_<i>'), instead of the source's.
+    num_localities - Optional integer. Number of distinct localities (names 'locality_<i>' with random lat/lon in
+                     LAT_RANGE and LON_RANGE), instead of the source's.
+    num_files - Optional integer. Adds a 'file_url' column with this many distinct urls.
+
+    Returns:
+    --------
+    df - DataFrame with `num_rows` rows and the same columns as the source CSV (and 'file_url' if `num_files` is given).
+
+    '''
+    source = pd.read_csv(SOURCE_CSV)
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(source), size = num_rows)
+    df = source.iloc[rows].reset_index(drop = True)
+    if num_species is not None:
+        df['Species'] = get_labels('species_', rng.integers(0, num_species, size = num_rows))
+    if num_localities is not None:
+        lat = rng.uniform(*LAT_RANGE, size = num_localities).round(5)
+        lon = rng.uniform(*LON_RANGE, size = num_localities).round(5)
+        localities = rng.integers(0, num_localities, size = num_rows)
+        df['locality'] = get_labels('locality_', localities)
+        df['lat'] = lat[localities]
+        df['lon'] = lon[localities]
+    if num_files is not None:
+        df['file_url'] = get_labels(FILE_URL_BASE, rng.integers(0, num_files, size = num_rows)) + '.png'
+    return df
+
+def get_labels(prefix, ids):
+    '''
+    Returns Series of labels '<prefix><id>' for an array of integer ids (formatted once per distinct id).
+    '''
+    unique_ids, codes = np.unique(ids, return_inverse = True)
+    labels = pd.Index([prefix + str(i) for i in unique_ids], dtype = object)
+    return pd.Series(labels.take(codes))
@@ -0,0 +1,240 @@
+import numpy as np
+import pandas as pd
+
+# Count tables the histogram and pie chart are drawn from, so figure size depends on the number of categories (not rows)
+
+# Columns of the count cube, which cross-filtered charts and image options are counted from
+CUBE_COLUMNS = ['Species', 'Subspecies', 'View', 'Sex', 'Hybrid_stat', 'Locality']
+# Latitude limit of Web Mercator maps
+MAX_MERCATOR_LAT = 85.0511
+# Smallest extent (in degrees) of a density image
+MIN_RASTER_DEGREES = 0.1
+
+def get_counts(df, columns):
+    '''
+    Counts the rows with each combination of values of the given columns (categorical columns are grouped by their codes).
+
+    Parameters:
+    -----------
+    df - DataFrame of specimens.
+    columns - List of columns to count by (eg., [x_var, color_by]).
+
+    Returns:
+    --------
+    counts - DataFrame with a row for each observed combination of `columns` values (in order of first appearance) and its 'count'.
+
+    '''
+    # Drop repeated columns (eg., pie chart of 'Species' with 'Species' hover data)
+    columns = list(dict.fromkeys(columns))
+    return df.groupby(columns, observed = True, sort = False).size().reset_index(name = 'count')
+
+def get_cube(df):
+    '''
+    Counts the rows with each observed combination of the CUBE_COLUMNS values (those in the DataFrame), so counts of any of
+    these columns, for rows with any of their values, are summed from the cube rather than counted from the rows
+    (see `get_cube_counts`). The cube has a row per combination, so its size depends on the number of combinations, not rows.
+    '''
+    return get_counts(df, [col for col in CUBE_COLUMNS if col in df.columns])
+
+def append_cube(cube, df, num_rows):
+    '''
+    Counts the rows appended to a DataFrame into the count cube of its first rows, so only the appended rows are counted.
+
+    Parameters:
+    -----------
+    cube - DataFrame returned by `get_cube` for the first `num_rows` rows of `df` (whose categories come first in those of `df`).
+    df - DataFrame of the rows the cube was counted from, followed by the appended rows (eg., returned by `append_data`).
+    num_rows - Number of rows the cube was counted from.
+
+    Returns:
+    --------
+    cube - DataFrame as returned by `get_cube(df)`.
+
+    '''
+    columns = [col for col in CUBE_COLUMNS if col in df.columns]
+    batch_cube = get_cube(df.iloc[num_rows:])
+    # Categories of the cube are extended to those of `df`, keeping its codes
+    cube = cube.astype({col: df[col].dtype for col in columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    # Combinations of the cube keep their order, followed by those first seen in the appended rows (as `get_counts`)
+    return (pd.concat([cube, batch_cube], ignore_index = True)
+            .groupby(columns, observed = True, sort = False)['count'].sum().reset_index())
+
+def get_cube_counts(cube, columns, filters = None):
+    '''
+    Sums the count cube by the given columns, for the rows with the given value of each filtered column.
+
+    Parameters:
+    -----------
+    cube - DataFrame returned by `get_cube`.
+    columns - List of columns to count by (eg., [x_var, color_by]), columns of the cube.
+    filters - Optional dictionary of the value to keep of any columns of the cube (eg., {'Subspecies': 'nanna'}).
+
+    Returns:
+    --------
+    counts - DataFrame as returned by `get_counts` for the rows matching `filters`.
+
+    '''
+    columns = list(dict.fromkeys(columns))
+    selected = np.ones(len(cube), dtype = bool)
+    for col, value in (filters or {}).items():
+        selected &= (cube[col] == value).to_numpy()
+    return cube.loc[selected].groupby(columns, observed = True, sort = False)['count'].sum().reset_index()
+
+def sort_counts(counts, x_var, sort_by):
+    '''
+    Sorts count table by the x-axis variable: alphabetically or by total count at each x value.
+
+    Parameters:
+    -----------
+    counts - DataFrame returned by `get_counts`.
+    x_var - Variable plotted along the x-axis.
+    sort_by - Ordering of bar charts ('alpha', 'sum ascending', or 'sum descending').
+
+    Returns:
+    --------
+    counts - Sorted count table.
+    x_order - List of x values in sorted order.
+
+    '''
+    labels = counts[x_var].astype(str)
+    if sort_by == 'alpha':
+        order = np.argsort(labels.to_numpy(), kind = 'stable')
+    else:
+        totals = counts.groupby(x_var, observed = True, sort = False)['count'].transform('sum').to_numpy()
+        if sort_by == 'sum descending':
+            totals = -totals
+        order = np.lexsort((labels.to_numpy(), totals))
+    counts = counts.iloc[order]
+    x_order = list(dict.fromkeys(counts[x_var]))
+    return counts, x_order
+
+def get_unknown_locality(lat_lon):
+    '''
+    Returns boolean array, True for rows whose lat-lon pair has an unknown lat or lon (checked once per category when categorical).
+    '''
+    if isinstance(lat_lon.dtype, pd.CategoricalDtype):
+        unknown = lat_lon.cat.categories.astype(str).str.contains('unknown')
+        # Final True entry for null (code -1)
+        return np.append(unknown, True)[lat_lon.cat.codes.to_numpy()]
+    return lat_lon.astype(str).str.contains('unknown').to_numpy()
+
+def get_locality_counts(df, color_by):
+    '''
+    Counts specimens with valid lat/lon by locality and color.
+
+    Parameters:
+    -----------
+    df - DataFrame of specimens (processed for mapping).
+    color_by - Selected categorical variable by which to color.
+
+    Returns:
+    --------
+    counts - DataFrame with a row for each observed (lat-lon, color_by) pair, with its 'Lat', 'Lon', locality information
+             ('Samples_at_locality', 'Species_at_locality', 'Subspecies_at_locality'), and 'count' of specimens.
+
+    '''
+    mapped = df.loc[~get_unknown_locality(df['lat-lon'])]
+    counts = mapped.groupby(['lat-lon', color_by], observed = True, sort = False).agg(
+                    Lat = ('Lat', 'first'),
+                    Lon = ('Lon', 'first'),
+                    Samples_at_locality = ('Samples_at_locality', 'first'),
+                    Species_at_locality = ('Species_at_locality', 'first'),
+                    Subspecies_at_locality = ('Subspecies_at_locality', 'first'),
+                    count = ('Lat', 'size')
+                ).reset_index()
+    return counts.astype({'Lat': float, 'Lon': float})
+
+def bin_locality_counts(counts, color_by, grid_size):
+    '''
+    Combines locality counts into cells of a lat/lon grid, for each color.
+
+    Parameters:
+    -----------
+    counts - DataFrame returned by `get_locality_counts`.
+    color_by - Selected categorical variable by which to color.
+    grid_size - Size of grid cells in degrees.
+
+    Returns:
+    --------
+    binned - DataFrame with a row for each observed (grid cell, color_by) pair, with the count-weighted mean 'Lat' and 'Lon' of
+             its localities, 'Samples_in_area' (all colors), 'Localities' (number of lat-lon pairs), and 'count' of specimens.
+
+    '''
+    binned = counts.assign(cell_lat = np.floor(counts['Lat'] / grid_size),
+                           cell_lon = np.floor(counts['Lon'] / grid_size),
+                           Lat = counts['Lat'] * counts['count'],
+                           Lon = counts['Lon'] * counts['count'])
+    binned = binned.groupby(['cell_lat', 'cell_lon', color_by], observed = True, sort = False).agg(
+                    Lat = ('Lat', 'sum'),
+                    Lon = ('Lon', 'sum'),
+                    Localities = ('lat-lon', 'nunique'),
+                    count = ('count', 'sum')
+                ).reset_index()
+    binned['Lat'] = binned['Lat'] / binned['count']
+    binned['Lon'] = binned['Lon'] / binned['count']
+    binned['Samples_in_area'] = binned.groupby(['cell_lat', 'cell_lon'])['count'].transform('sum')
+    return binned
+
+def get_mercator_y(lat):
+    '''
+    Returns Web Mercator y coordinates (in radians) of latitudes, clipped to the latitudes shown on web maps.
+    '''
+    lat = np.radians(np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    return np.log(np.tan(np.pi / 4 + lat / 2))
+
+def get_mercator_lat(y):
+    '''
+    Returns latitudes of Web Mercator y coordinates (inverse of `get_mercator_y`).
+    '''
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+def rasterize_locality_counts(counts, color_by, max_pixels):
+    '''
+    Bins locality counts into pixels of an image of their extent in Web Mercator, as shown on web maps.
+
+    Parameters:
+    -----------
+    counts - DataFrame returned by `get_locality_counts`.
+    color_by - Selected categorical variable by which to color.
+    max_pixels - Size (in pixels) of the longer side of the image.
+
+    Returns:
+    --------
+    raster - Dictionary with 'totals' (array of specimens in each pixel, rows from north to south),
+             'dominant' (array of the code of the `color_by` value with most specimens in each pixel, -1 if empty),
+             'categories' (list of `color_by` values, in order of first appearance), and
+             'bounds' ((west, south, east, north) edges of the image in degrees).
+
+    '''
+    # Out of range coordinates are drawn at the edge of the map
+    lon = np.clip(counts['Lon'].to_numpy(), -180, 180)
+    y = get_mercator_y(counts['Lat'].to_numpy())
+    west, east = lon.min(), lon.max()
+    south, north = y.min(), y.max()
+    # Pad a single locality (or line of localities) to a small area
+    min_span = np.radians(MIN_RASTER_DEGREES)
+    if east - west < MIN_RASTER_DEGREES:
+        west, east = west - MIN_RASTER_DEGREES / 2, east + MIN_RASTER_DEGREES / 2
+    if north - south < min_span:
+        south, north = south - min_span / 2, north + min_span / 2
+    # Same scale along both axes (degrees of longitude per radian of mercator y)
+    lon_span, y_span = east - west, np.degrees(north - south)
+    scale = max(lon_span, y_span) / max_pixels
+    width = max(1, int(np.ceil(lon_span / scale)))
+    height = max(1, int(np.ceil(y_span / scale)))
+    cols = np.minimum(((lon - west) / lon_span * width).astype(np.int64), width - 1)
+    rows = np.minimum(((north - y) / (north - south) * height).astype(np.int64), height - 1)
+    pixels = rows * width + cols
+
+    codes, categories = pd.factorize(counts[color_by])
+    weights = counts['count'].to_numpy()
+    totals = np.bincount(pixels, weights = weights, minlength = width * height)
+    # Specimens of each (pixel, value) pair, then the value with most specimens in each pixel
+    pixel_counts = pd.DataFrame({'pixel': pixels, 'code': codes, 'count': weights}).groupby(['pixel', 'code'], sort = False)['count'].sum()
+    pixel_counts = pixel_counts.sort_values(ascending = False, kind = 'stable').reset_index().drop_duplicates('pixel')
+    dominant = np.full(width * height, -1, dtype = np.int64)
+    dominant[pixel_counts['pixel'].to_numpy()] = pixel_counts['code'].to_numpy()
+    return {'totals': totals.reshape(height, width),
+            'dominant': dominant.reshape(height, width),
+            'categories': list(categories),
+            'bounds': (west, get_mercator_lat(south), east, get_mercator_lat(north))}
@@ -0,0 +1,406 @@
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+try:
+    import fcntl
+except ImportError:
+    # File locks are not available on Windows, only requests within a process are collapsed there
+    fcntl = None
+
+# Server-side store for processed datasets, so only a key needs to travel to the browser.
+# Maximum memory (in MB) held by processed datasets in each server process.
+DATASET_CACHE_MB = int(os.environ.get('DATASET_CACHE_MB', 1024))
+# Processed datasets are also saved as Arrow IPC files in a directory shared by all server processes (workers).
+DATASET_CACHE_DIR = os.environ.get('DATASET_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'dashboard-cache'))
+# Maximum disk space (in MB) for saved datasets.
+DATASET_DISK_CACHE_MB = int(os.environ.get('DATASET_DISK_CACHE_MB', 10240))
+# Maximum memory (in MB) for data derived from datasets (eg., count tables) in each server process.
+DERIVED_CACHE_MB = int(os.environ.get('DERIVED_CACHE_MB', 256))
+# Maximum memory (in MB, by serialized size) for figures in each server process.
+FIGURE_CACHE_MB = int(os.environ.get('FIGURE_CACHE_MB', 64))
+# Increment when the processed data format changes, so saved datasets are not reused
+CACHE_VERSION = 6
+METADATA_KEY = b'dashboard'
+# Datasets are saved under the SHA-256 hash (hex digest) of their upload
+KEY_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+class LRUCache:
+    '''
+    Thread-safe least-recently-used cache bounded by the total size of its entries.
+
+    Parameters:
+    -----------
+    max_size - Maximum total size of entries (as measured by `sizeof`) before least recently used entries are evicted.
+    sizeof - Function returning the size of a value. Defaults to counting each entry as 1.
+
+    '''
+    def __init__(self, max_size, sizeof = None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default = None):
+        '''
+        Returns the value saved for `key` (marking it most recently used), or `default` if there is none.
+        '''
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        '''
+        Saves `value` under `key`, evicting least recently used entries until the cache fits within `max_size`.
+        A value larger than `max_size` is not saved.
+        '''
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last = False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        '''
+        Returns dictionary of cache counters: hits, misses, evictions, entries, and size.
+        '''
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'size': self.size}
+
+def get_dataset_size(dataset):
+    '''
+    Approximates memory used by a processed dataset (DataFrame and metadata), by the DataFrame's memory usage. Datasets loaded from
+    their saved files are counted at their full size, though their columns are mapped from the file (shared by all processes).
+    '''
+    df, meta = dataset
+    return int(df.memory_usage(deep = True).sum())
+
+def get_size(value):
+    '''
+    Approximates memory used by a value derived from a dataset (DataFrames, arrays, and containers of them).
+    '''
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep = True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(get_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(get_size(key) + get_size(item) for key, item in value.items())
+    return sys.getsizeof(value)
+
+dataset_cache = LRUCache(DATASET_CACHE_MB * 2**20, sizeof = get_dataset_size)
+derived_cache = LRUCache(DERIVED_CACHE_MB * 2**20, sizeof = get_size)
+# Figures are saved as (parsed figure dictionary, length of the serialized figure), sized by the length
+figure_cache = LRUCache(FIGURE_CACHE_MB * 2**20, sizeof = lambda entry: entry[1])
+
+def get_dataset_path(key):
+    return os.path.join(DATASET_CACHE_DIR, f'{key}.v{CACHE_VERSION}.arrow')
+
+def check_key(key):
+    '''
+    Raises KeyError if `key` is not a dataset key (a hex digest), eg., a path given in the URL or the browser's store,
+    so it is never used to build a file path.
+    '''
+    if not isinstance(key, str) or KEY_PATTERN.fullmatch(key) is None:
+        raise KeyError(key)
+
+def get_lock_path(key):
+    return os.path.join(DATASET_CACHE_DIR, 'locks', f'{key}.lock')
+
+def get_pin_path(key):
+    return os.path.join(DATASET_CACHE_DIR, 'pinned', key)
+
+def pin_dataset(key):
+    '''
+    Keeps the dataset saved under `key` in the cache directory (not removed by `prune_disk_cache`), eg., for data files
+    offered by the server, until it is unpinned by `set_pinned_datasets`.
+    '''
+    os.makedirs(os.path.dirname(get_pin_path(key)), exist_ok = True)
+    with open(get_pin_path(key), 'a'):
+        pass
+
+def set_pinned_datasets(keys):
+    '''
+    Pins the datasets saved under `keys` (see `pin_dataset`) and unpins all others.
+    '''
+    for key in keys:
+        pin_dataset(key)
+    for key in get_pinned_datasets() - set(keys):
+        try:
+            os.remove(get_pin_path(key))
+        except FileNotFoundError:
+            pass
+
+def get_pinned_datasets():
+    try:
+        return set(os.listdir(os.path.dirname(get_pin_path(''))))
+    except FileNotFoundError:
+        return set()
+
+# Locks held by threads of this process for processing each dataset: key -> [lock, number of threads using it]
+_dataset_locks = {}
+_dataset_locks_lock = threading.Lock()
+
+@contextmanager
+def dataset_lock(key):
+    '''
+    Holds an exclusive lock on processing the dataset saved under `key`, across threads and server processes (workers),
+    so concurrent identical uploads are processed once: later requests wait, then find the saved dataset.
+    '''
+    with _dataset_locks_lock:
+        entry = _dataset_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            if fcntl is None:
+                yield
+            else:
+                os.makedirs(os.path.dirname(get_lock_path(key)), exist_ok = True)
+                with open(get_lock_path(key), 'a') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        with _dataset_locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _dataset_locks[key]
+
+def save_dataset(key, df, meta):
+    '''
+    Saves processed DataFrame and its metadata to an (uncompressed) Arrow IPC file in the shared cache directory.
+    Object columns of numbers and 'unknown' (or missing) entries (eg., 'Lat' and 'Lon') are saved as numbers, with NaN for 'unknown',
+    and other object columns mixing numbers and strings as strings, so all columns load without copying (see `load_dataset_file`).
+    '''
+    numeric_columns = {}
+    string_columns = []
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna = False) != 'string':
+            numeric = pd.to_numeric(df[col], errors = 'coerce')
+            # Missing entries too (NaN, eg., 'Lat' of a saved dataset followed by appended rows)
+            if (numeric.notna() | df[col].isna() | (df[col] == 'unknown')).all():
+                numeric_columns[col] = numeric
+            else:
+                string_columns.append(col)
+    df = df.astype({col: str for col in string_columns}).assign(**numeric_columns)
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    for i, col in enumerate(df.columns):
+        if pd.api.types.is_float_dtype(df[col].dtype):
+            # NaN saved as a value (Arrow would save it as null), so the column loads as the saved buffer
+            table = table.set_column(i, col, pa.array(df[col].to_numpy(dtype = np.float64), type = pa.float64()))
+    metadata = json.dumps({'meta': meta})
+    table = table.replace_schema_metadata({**table.schema.metadata, METADATA_KEY: metadata})
+
+    os.makedirs(DATASET_CACHE_DIR, exist_ok = True)
+    # Write to temporary file first, so other workers never read a partial file
+    fd, tmp_path = tempfile.mkstemp(dir = DATASET_CACHE_DIR, suffix = '.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, get_dataset_path(key))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    prune_disk_cache()
+
+def load_dataset_file(key):
+    '''
+    Memory-maps the saved Arrow IPC file for `key`, so all workers share the operating system's page cache of it.
+    Returns None if no such file is saved.
+
+    Returns:
+    --------
+    df - Processed DataFrame.
+    meta - Dictionary of dataset metadata.
+
+    '''
+    path = get_dataset_path(key)
+    try:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        # Mark as recently used for pruning
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    metadata = json.loads(table.schema.metadata[METADATA_KEY])
+    # split_blocks avoids consolidating (copying) numeric columns out of the mapped file, and string columns stay in it
+    # (Arrow-backed) rather than being copied to Python strings. Categorical columns copy only their categories.
+    df = table.to_pandas(split_blocks = True, types_mapper = get_pandas_dtype)
+    return df, metadata['meta']
+
+def get_pandas_dtype(arrow_type):
+    # Arrow-backed strings for string columns, default conversion (None) of others
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+def prune_disk_cache():
+    '''
+    Removes least recently used dataset files until the cache directory fits within DATASET_DISK_CACHE_MB.
+    Pinned datasets (see `pin_dataset`) count towards the size but are not removed.
+    '''
+    pinned = get_pinned_datasets()
+    entries = []
+    with os.scandir(DATASET_CACHE_DIR) as it:
+        for entry in it:
+            if entry.name.endswith('.arrow'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Removed by another worker
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= DATASET_DISK_CACHE_MB * 2**20:
+            break
+        if os.path.basename(path).split('.')[0] in pinned:
+            continue
+        try:
+            os.remove(path)
+            # Lock file of the dataset (see `dataset_lock`)
+            os.remove(get_lock_path(os.path.basename(path).split('.')[0]))
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+def put_dataset(key, df, meta):
+    '''
+    Saves processed DataFrame and its metadata (mapping and images booleans, profile, and uploaded columns) on the server.
+    '''
+    save_dataset(key, df, meta)
+    # The saved (memory-mapped) dataset is kept rather than `df`, so this process holds no private copy of it, and uses the
+    # same data as the other processes. `df` is kept if the file was pruned right away (the cache directory is too small).
+    dataset_cache.put(key, load_dataset_file(key) or (df, meta))
+
+def get_dataset(key):
+    '''
+    Retrieves processed DataFrame saved under `key`, from memory if possible, otherwise from the shared cache directory.
+    Raises KeyError if the dataset is not (or no longer) available on the server.
+
+    Returns:
+    --------
+    df - Processed DataFrame. Shared between callbacks, so it must not be modified.
+    meta - Dictionary of dataset metadata (mapping and images booleans, profile, and uploaded columns).
+
+    '''
+    check_key(key)
+    dataset = dataset_cache.get(key)
+    if dataset is None:
+        dataset = load_dataset_file(key)
+        if dataset is None:
+            raise KeyError(key)
+        dataset_cache.put(key, dataset)
+    return dataset
+
+def get_meta(key):
+    '''
+    Retrieves metadata (eg., profile) of the dataset saved under `key`, from memory if loaded, otherwise from the schema
+    of its saved file (without reading the rows).
+    Raises KeyError if the dataset is not (or no longer) available on the server.
+    '''
+    check_key(key)
+    dataset = dataset_cache.get(key)
+    if dataset is not None:
+        return dataset[1]
+    try:
+        with pa.memory_map(get_dataset_path(key)) as source:
+            schema = pa.ipc.open_file(source).schema
+    except FileNotFoundError:
+        raise KeyError(key)
+    return json.loads(schema.metadata[METADATA_KEY])['meta']
+
+def get_derived(key, name, build):
+    '''
+    Retrieves data derived from the dataset saved under `key` (eg., a count table), building it on first use in this process.
+    Raises KeyError if the dataset is not available on the server.
+
+    Parameters:
+    -----------
+    key - String. Key of the dataset.
+    name - Hashable name of the derived data (eg., ('counts', 'Species', 'View')).
+    build - Function that takes the processed DataFrame and returns the derived data.
+
+    Returns:
+    --------
+    Derived data. Shared between callbacks, so it must not be modified.
+
+    '''
+    value = derived_cache.get((key, name))
+    if value is None:
+        df, meta = get_dataset(key)
+        value = build(df)
+        derived_cache.put((key, name), value)
+    return value
+
+def get_figure(key, name, build):
+    '''
+    Retrieves figure of the dataset saved under `key` for the given plot and options, building it on first use in this process.
+    Figures are saved as the dictionaries sent to the browser (sized by their serialized length), so repeated selections
+    skip building (and validating) the Plotly figure and parsing it. The same dictionary is returned on each hit, so
+    callers must not modify it.
+    Raises KeyError if the figure must be built and the dataset is not available on the server.
+
+    Parameters:
+    -----------
+    key - String. Key of the dataset.
+    name - Hashable name of the figure: plot type and options (eg., ('hist', 'Species', 'View', 'alpha')).
+    build - Function that takes the processed DataFrame and returns the Plotly figure.
+
+    Returns:
+    --------
+    Dictionary of the figure (as sent to the browser).
+
+    '''
+    entry = figure_cache.get((key, name))
+    if entry is None:
+        df, meta = get_dataset(key)
+        serialized = build(df).to_json()
+        entry = (json.loads(serialized), len(serialized))
+        figure_cache.put((key, name), entry)
+    return entry[0]
+
+def get_cache_stats():
+    '''
+    Returns dictionary of counters (hits, misses, evictions, entries, and size) of each cache in this process.
+    '''
+    return {'datasets': dataset_cache.stats(),
+            'derived': derived_cache.stats(),
+            'figures': figure_cache.stats()}
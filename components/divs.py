@@ -9,6 +9,7 @@ BUTTON_STYLE = {'color': 'MidnightBlue',
                 'background-color': 'BlanchedAlmond', 
                 'border-color': 'MidnightBlue',
                 'font-size': '15px'}
+PAGE_INFO_STYLE = {'color': 'MidnightBlue', 'margin': '0 15px'}
 ERROR_STYLE = {'textAlign': 'center', 'color': 'FireBrick', 'margin-bottom' : 10}
 SORT_LIST = [{'label': 'Alphabetical', 'value': 'alpha'},
                 {'label': 'Ascending', 'value': 'sum ascending'},
@@ -150,15 +151,14 @@ def get_map_div():
     
     return map_div
 
-def get_img_div(df, all_species, img_url):
+def get_img_div(profile, img_url):
     '''
     Generates the Image Sampling options section of the dashboard, including button to display images. 
     Provides empty list if no URLs are provided in the DataFrame for the entries.
 
     Parameters:
     -----------
-    df - DataFrame with relevant data for display.
-    all_species - All available species options for get_image dropdown.
+    profile - Dataset profile (from `get_profile`): species options for get_image dropdown, and values of the image filters.
     img_url - Boolean. If False, does not render "Data Sample Image Selection" section of Dashboard. 
 
     Returns:
@@ -167,6 +167,7 @@ def get_img_div(df, all_species, img_url):
 
     '''
     if img_url:
+        vocabularies = profile['vocabularies']
         img_div =[
                     html.H1("Data Sample Image Selection", style = H1_STYLE),
 
@@ -178,7 +179,7 @@ def get_img_div(df, all_species, img_url):
                         html.H4("Show me sample images of ...", style = H4_STYLE),
                         #select Species/Subspecies to view (defaul to Any)
                         # Note: these should be the same type to interact properly, first must not be clearable
-                        dcc.Dropdown(options = list(all_species.keys()),
+                        dcc.Dropdown(options = list(profile['species'].keys()),
                                         value = 'Any',
                                         id = 'species-show',
                                         clearable = False),
@@ -190,25 +191,25 @@ def get_img_div(df, all_species, img_url):
                         # Further Refine by Features
                         html.H4("that are ...", style = H4_STYLE),
                         html.Div([
-                            dcc.Checklist(df.Sex.unique(), 
-                                            df.Sex.unique()[0:2],
+                            dcc.Checklist(vocabularies['Sex'], 
+                                            vocabularies['Sex'][0:2],
                                             id = 'which-sex')],
                             style = QUARTER_DIV_STYLE
                             ),
                         html.Div([
-                            dcc.Checklist(df.View.unique(), 
-                                            df.View.unique()[0:2],
+                            dcc.Checklist(vocabularies['View'], 
+                                            vocabularies['View'][0:2],
                                             id = 'which-view')],
                             style = QUARTER_DIV_STYLE
                             ),
                         html.Div([
-                            dcc.Checklist(df.Hybrid_stat.unique(), 
-                                            df.Hybrid_stat.unique()[0:2],
+                            dcc.Checklist(vocabularies['Hybrid_stat'], 
+                                            vocabularies['Hybrid_stat'][0:2],
                                             id = 'hybrid?')],
                             style = QUARTER_DIV_STYLE
                             ),
                         html.Div([
-                            html.H5("How many images?", style = H4_STYLE),
+                            html.H5("How many images per page?", style = H4_STYLE),
                             dcc.Input(type = 'number',
                                         min = 1,
                                         max = 100,
@@ -233,7 +234,23 @@ def get_img_div(df, all_species, img_url):
                     html.Br(),
 
                     # Image Should appear
-                    html.Div(id = 'image-1')
+                    html.Div(id = 'image-1'),
+
+                    # Pages of the gallery (shown once images are displayed)
+                    html.Div([
+                        html.Button('Previous',
+                                    style = BUTTON_STYLE,
+                                    id = 'prev-images',
+                                    n_clicks = 0),
+                        html.Span(id = 'image-page-info', style = PAGE_INFO_STYLE),
+                        html.Button('Next',
+                                    style = BUTTON_STYLE,
+                                    id = 'next-images',
+                                    n_clicks = 0)
+                    ], id = 'image-pager', style = {'display': 'none'}),
+
+                    # Seed, selections, and cursor of the displayed gallery
+                    dcc.Store(id = 'image-gallery')
         ]
     else:
         img_div = []
@@ -260,6 +277,8 @@ def get_main_div(hist_div, img_div):
                 id = 'dist-options',
                 style = HALF_DIV_STYLE
         ),
+        # Both distribution options layouts, swapped in the browser (see `update_dist_view` in assets/clientside.js)
+        dcc.Store(id = 'dist-layouts', data = {'hist': hist_div, 'map': get_map_div()}),
 
         # Pie chart options: 'Species', 'Subspecies', 'View', 'Sex', 'Hybrid Status'
         html.Div([
@@ -284,6 +303,17 @@ def get_main_div(hist_div, img_div):
         html.Div([
             dcc.Graph(id = 'pie-plot')], style = HALF_DIV_STYLE),
 
+        # Values clicked in the histogram or pie chart, which the other charts and sample images are filtered to
+        # (see `update_cross_filter` in assets/clientside.js)
+        dcc.Store(id = 'cross-filter', data = {}),
+        html.Div([
+            html.Span(id = 'cross-filter-info', style = PAGE_INFO_STYLE),
+            html.Button('Clear Filter',
+                        style = BUTTON_STYLE,
+                        id = 'clear-filter',
+                        n_clicks = 0)
+        ], id = 'cross-filter-div', style = {'display': 'none'}),
+
         html.Hr(),
         
         html.Div(img_div),
@@ -303,7 +333,7 @@ def get_error_div(error_dict):
 
     Parameters:
     -----------
-    error_dict - Dictionary containing information about the error. Potential keys are 'feature', 'type', 'unicode', and 'other'.
+    error_dict - Dictionary containing information about the error. Potential keys are 'feature', 'mapping', 'type', 'columns', 'expired', 'unicode', and 'other'.
 
     Returns:
     --------
@@ -337,6 +367,22 @@ def get_error_div(error_dict):
                                      "."],
                             style = ERROR_STYLE)
         ])
+    elif 'columns' in error_dict.keys():
+        columns = error_dict['columns']
+        error_div = html.Div([
+                            html.H4("Appended data must have the same columns as the current dataset (" +
+                                    ", ".join(columns['expected']) + "), but has: " + ", ".join(columns['found']) + ".",
+                                    style = ERROR_STYLE),
+                            html.H4(["Please see the ",
+                                     DOCS_LINK,
+                                     "."],
+                            style = ERROR_STYLE)
+        ])
+    elif 'expired' in error_dict.keys():
+        error_div = html.Div([
+            html.H4("This dataset is no longer available on the server, please upload it again.",
+                    style = ERROR_STYLE)
+        ])
     elif 'unicode' in error_dict.keys():
         error_div = html.Div([
             html.H4("There was a UnicodeDecode error processing this file.",
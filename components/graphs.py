@@ -1,8 +1,42 @@
+import base64
+import io
+import os
+import threading
+import numpy as np
+import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.colors import unlabel_rgb
+from PIL import Image
+from components.aggregate import get_counts, sort_counts, get_locality_counts, bin_locality_counts, rasterize_locality_counts
 
-def make_hist_plot(df, x_var, color_by, sort_by):
+# Maximum number of localities plotted individually, above this nearby localities are combined into grid cells
+MAX_MAP_SITES = 2000
+# Number of localities above which the map shows an image of specimen density (colored by the most common value in each pixel)
+DENSITY_MAP_SITES = int(os.environ.get('DENSITY_MAP_SITES', 100_000))
+# Size (in pixels) of the longer side of density images
+DENSITY_IMAGE_PIXELS = int(os.environ.get('DENSITY_IMAGE_PIXELS', 512))
+# Number of opacity levels of density images
+OPACITY_LEVELS = 8
+# Approximate width (in pixels) of a grid cell at any zoom level
+GRID_CELL_PIXELS = 20
+# Copy of the default template of each thread. Plotly Express reads the template through child objects built (and cached)
+# on first access, so threads building figures at once from the shared template can fail
+_templates = threading.local()
+
+def get_template():
+    '''
+    Returns this thread's copy of the default Plotly template, for Plotly Express figures.
+    '''
+    if not hasattr(_templates, 'template'):
+        _templates.template = go.layout.Template(pio.templates[pio.templates.default])
+    return _templates.template
+
+def make_hist_plot(df, x_var, color_by, sort_by, counts = None):
     '''
     Generates interactive histogram of selected variable, with option of properties to color by and order in which to sort.
+    Bars are drawn from counts of each (x_var, color_by) pair, sorted on the server.
     
     Parameters:
     -----------
@@ -10,23 +44,28 @@ def make_hist_plot(df, x_var, color_by, sort_by):
     x_var - Variable to plot distribution.
     color_by - Property to color the plot by.
     sort_by - Ordering of bar charts (Alphabetical, Ascending, or Descending).
+    counts - Optional precomputed count table of (x_var, color_by) pairs (from `get_counts`), used instead of counting `df`.
 
     Returns: 
     --------
     fig - Histogram of the distribution of the requested variable.
     '''
-    if sort_by == 'alpha':
-        fig = px.histogram(df.sort_values(x_var),
-                        x = x_var,
-                        color = color_by,
-                        color_discrete_sequence = px.colors.qualitative.Bold)
-    else:
-        fig = px.histogram(df,
-                        x = x_var,
-                        color = color_by,
-                        color_discrete_sequence = px.colors.qualitative.Bold).update_xaxes(categoryorder = sort_by)
+    if counts is None:
+        counts = get_counts(df, [x_var, color_by])
+    counts, x_order = sort_counts(counts, x_var, sort_by)
+    fig = px.histogram(counts,
+                    x = x_var,
+                    y = 'count',
+                    histfunc = 'sum',
+                    color = color_by,
+                    color_discrete_sequence = px.colors.qualitative.Bold,
+                    template = get_template())
+    fig.update_xaxes(get_hist_xaxis(x_order, sort_by))
+    # counts are already aggregated, so label the sum as the count
+    fig.for_each_trace(lambda trace: trace.update(hovertemplate = trace.hovertemplate.replace('sum of count', 'count')))
 
     fig.update_layout(title = {'text': f'Distribution of {x_var} Colored by {color_by}'},
+                      yaxis_title = 'count',
                       font = {'size': 16},
                       margin = {
                             'l': 30,
@@ -37,42 +76,92 @@ def make_hist_plot(df, x_var, color_by, sort_by):
 
     return fig
 
-def make_map(df, color_by):
+def get_hist_xaxis(x_order, sort_by):
+    '''
+    Returns x-axis properties ordering histogram bars: `x_order` (from `sort_counts`) for 'alpha', else by plotly's sum of bars.
+    '''
+    if sort_by == 'alpha':
+        # categoryorder defaults to 'array' when categoryarray is given
+        return {'categoryarray': x_order}
+    return {'categoryorder': sort_by}
+
+def make_map(df, color_by, zoom = 1, counts = None):
     '''
     Generates interactive map of species and subspecies by location.
+    Plots one marker per locality and color; with more than MAX_MAP_SITES localities, nearby localities
+    are combined into cells of a grid sized for the zoom level, and with more than DENSITY_MAP_SITES,
+    specimen density is drawn as an image (see `make_density_map`).
     
     Parameters:
     -----------
     df - DataFrame of specimens.
     color_by - Selected categorical variable by which to color.
+    zoom - Zoom level of the map, sets grid size when combining localities.
+    counts - Optional precomputed locality counts (from `get_locality_counts`), used instead of counting `df`.
 
     Returns: 
     --------
     fig - Map of their locations.
     '''
-    df = df.copy()
-    # only use entries that have valid lat & lon for mapping
-    df = df.loc[df['lat-lon'].str.contains('unknown') == False]
-    fig = px.scatter_mapbox(df,
-                        lat = "Lat",
-                        lon = "Lon",
-                        #projection = "natural earth",
-                        custom_data = ["Samples_at_locality", "Species_at_locality", "Subspecies_at_locality"],
-                        size = "Samples_at_locality",
-                        color = color_by,
-                        color_discrete_sequence = px.colors.qualitative.Bold,
-                        title = "Distribution of Samples",
-                        zoom = 1,
-                        mapbox_style = "white-bg")
-    
-    fig.update_traces(hovertemplate = 
-                        "Latitude: %{lat}<br>"+
-                        "Longitude: %{lon}<br>" +
-                        "Samples at lat/lon: %{customdata[0]}<br>" +
-                        "Species at lat/lon: %{customdata[1]}<br>" +
-                        "Subspecies at lat/lon: %{customdata[2]}<br>"
-    )
+    if counts is None:
+        # only use entries that have valid lat & lon for mapping
+        counts = get_locality_counts(df, color_by)
+    num_sites = counts['lat-lon'].nunique()
+    if num_sites > DENSITY_MAP_SITES:
+        return make_density_map(counts, color_by)
+    grid_size = get_grid_size(num_sites, zoom)
+    if grid_size is None:
+        fig = px.scatter_mapbox(counts,
+                            lat = "Lat",
+                            lon = "Lon",
+                            #projection = "natural earth",
+                            custom_data = ["Samples_at_locality", "Species_at_locality", "Subspecies_at_locality", "count"],
+                            size = "Samples_at_locality",
+                            color = color_by,
+                            color_discrete_sequence = px.colors.qualitative.Bold,
+                            template = get_template(),
+                            title = "Distribution of Samples",
+                            zoom = 1,
+                            mapbox_style = "white-bg")
+        
+        fig.update_traces(hovertemplate = 
+                            "Latitude: %{lat}<br>"+
+                            "Longitude: %{lon}<br>" +
+                            "Samples at lat/lon: %{customdata[0]}<br>" +
+                            "Species at lat/lon: %{customdata[1]}<br>" +
+                            "Subspecies at lat/lon: %{customdata[2]}<br>" +
+                            "Samples of this " + color_by + ": %{customdata[3]}<br>"
+        )
+    else:
+        binned = bin_locality_counts(counts, color_by, grid_size)
+        fig = px.scatter_mapbox(binned,
+                            lat = "Lat",
+                            lon = "Lon",
+                            custom_data = ["Samples_in_area", "Localities", "count"],
+                            size = "Samples_in_area",
+                            color = color_by,
+                            color_discrete_sequence = px.colors.qualitative.Bold,
+                            template = get_template(),
+                            title = "Distribution of Samples",
+                            zoom = 1,
+                            mapbox_style = "white-bg")
+
+        fig.update_traces(hovertemplate = 
+                            "Latitude: %{lat:.2f}<br>"+
+                            "Longitude: %{lon:.2f}<br>" +
+                            "Samples in area: %{customdata[0]}<br>" +
+                            "Localities of this " + color_by + " in area: %{customdata[1]}<br>" +
+                            "Samples of this " + color_by + " in area: %{customdata[2]}<br>"
+        )
+
+    update_map_layout(fig)
 
+    return fig
+
+def update_map_layout(fig, layers = None):
+    '''
+    Sets the layout shared by maps: satellite imagery background (under any other mapbox `layers`), font, and margins.
+    '''
     fig.update_layout(
         font = {'size': 16},
         margin = {
@@ -88,34 +177,101 @@ def make_map(df, color_by):
             "source": ["https://services.arcgisonline.com/arcgis/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}"]
             # Usage and Licensing (ArcGIS World Imagery): https://services.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer
             # Style: https://roblabs.com/xyz-raster-sources/styles/arcgis-world-imagery.json
-        }]
+        }] + (layers or []),
+        # keep user's view (center and zoom) when redrawn for a new zoom level
+        uirevision = 'map'
     )
 
+def make_density_map(counts, color_by):
+    '''
+    Generates map of specimen density as an image layer (at most DENSITY_IMAGE_PIXELS wide or tall), so its size
+    does not depend on the number of localities. Each pixel is colored by the `color_by` value with most specimens there,
+    with opacity increasing with (the log of) its number of specimens.
+
+    Parameters:
+    -----------
+    counts - Locality counts (from `get_locality_counts`).
+    color_by - Selected categorical variable by which to color.
+
+    Returns:
+    --------
+    fig - Map with the density image, and a legend of the `color_by` values.
+    '''
+    raster = rasterize_locality_counts(counts, color_by, DENSITY_IMAGE_PIXELS)
+    west, south, east, north = raster['bounds']
+    colors = px.colors.qualitative.Bold
+    # Legend entries (without markers) in the colors of the image
+    legend = pd.DataFrame({color_by: raster['categories'], 'Lat': np.nan, 'Lon': np.nan})
+    fig = px.scatter_mapbox(legend,
+                        lat = "Lat",
+                        lon = "Lon",
+                        color = color_by,
+                        category_orders = {color_by: raster['categories']},
+                        color_discrete_sequence = colors,
+                        template = get_template(),
+                        title = "Density of Samples",
+                        center = {'lat': (south + north) / 2, 'lon': (west + east) / 2},
+                        zoom = 1,
+                        mapbox_style = "white-bg")
+    fig.update_traces(hoverinfo = 'skip', hovertemplate = None)
+    update_map_layout(fig, [{
+        "below": "traces",
+        "sourcetype": "image",
+        "source": get_density_image(raster, colors),
+        "coordinates": [[west, north], [east, north], [east, south], [west, south]]
+    }])
     return fig
 
-def make_pie_plot(df, var):
+def get_density_image(raster, colors):
+    '''
+    Returns PNG data URL of a density raster (from `rasterize_locality_counts`), colored by its dominant values.
+    '''
+    totals, dominant = raster['totals'], raster['dominant']
+    palette = np.array([unlabel_rgb(color) for color in colors], dtype = np.uint8)
+    rgba = np.zeros(totals.shape + (4,), dtype = np.uint8)
+    occupied = dominant >= 0
+    rgba[occupied, :3] = palette[dominant[occupied] % len(palette)]
+    # Opacity from 40% (one specimen) to fully opaque (most specimens), in OPACITY_LEVELS steps (which compress well)
+    levels = np.round(np.log1p(totals[occupied]) / np.log1p(totals.max()) * (OPACITY_LEVELS - 1))
+    rgba[occupied, 3] = (100 + 155 * levels / (OPACITY_LEVELS - 1)).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format = 'PNG', optimize = True)
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+def make_pie_plot(df, var, counts = None):
     '''
     Generates interactive pie chart of dataset specimens with option of properties to color by.
+    Slices are drawn from counts of each `var` value (and its species, for 'Subspecies').
 
     Parameters:
     -----------
     df - DataFrame of specimens.
     var - Selected categorical variable by which to color.
+    counts - Optional precomputed count table (from `get_counts`, by [var] or ['Subspecies', 'Species']), used instead of counting `df`.
     
     Returns: 
     --------
     fig - Pie chart of the percentage breakdown of the `var` samples in the dataset.
     '''
+    if counts is None:
+        counts = get_counts(df, get_pie_columns(var))
     if(var == 'Subspecies'):
-        pie_fig = px.pie(df,
+        pie_fig = px.pie(counts,
                  names = var,
+                 values = 'count',
                  color_discrete_sequence = px.colors.qualitative.Bold,
+                 template = get_template(),
                  hover_data = ['Species'])
+        pie_fig.update_traces(hovertemplate = 'Subspecies=%{label}<br>Species=%{customdata[0]}<extra></extra>')
     else:
-        pie_fig = px.pie(df,
+        pie_fig = px.pie(counts,
                  names = var,
-                 color_discrete_sequence = px.colors.qualitative.Bold)
-        pie_fig.update_traces(textposition = 'inside', textinfo = 'percent+label')
+                 values = 'count',
+                 color_discrete_sequence = px.colors.qualitative.Bold,
+                 template = get_template())
+        pie_fig.update_traces(textposition = 'inside',
+                              textinfo = 'percent+label',
+                              hovertemplate = var + '=%{label}<extra></extra>')
 
     pie_fig.update_layout(title = {'text': f'Percentage Breakdown of {var}'},
                           font = {'size': 16},
@@ -127,3 +283,21 @@ def make_pie_plot(df, var):
                             })
 
     return pie_fig
+
+def get_pie_columns(var):
+    '''
+    Returns columns to count for pie chart of `var` (subspecies slices also show their species).
+    '''
+    if var == 'Subspecies':
+        return ['Subspecies', 'Species']
+    return [var]
+
+def get_grid_size(num_sites, zoom):
+    '''
+    Returns the size (in degrees) of grid cells for combining localities at the given zoom level,
+    or None if the localities are plotted individually (or as a density image).
+    '''
+    if num_sites <= MAX_MAP_SITES or num_sites > DENSITY_MAP_SITES:
+        return None
+    # Mapbox tiles are 256 pixels wide, the world is 2**zoom tiles wide
+    return 360 * GRID_CELL_PIXELS / (256 * 2**int(zoom))
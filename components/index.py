@@ -0,0 +1,202 @@
+import random
+import numpy as np
+import pandas as pd
+
+# Inverted index of the image filter columns, so image selections do not filter (copy) the DataFrame
+
+INDEX_COLUMNS = ['Species', 'Subspecies', 'View', 'Sex', 'Hybrid_stat']
+# Values in more than 1/DENSE_FRACTION of rows are indexed by a bitset, others by their (sorted) row numbers
+DENSE_FRACTION = 64
+# Bitsets are arrays of bytes (bits in row order, as by np.packbits) padded to whole 64-bit words, counted a word at a time
+WORD_BYTES = 8
+# Masks for counting bits of 64-bit words
+M1 = np.uint64(0x5555555555555555)
+M2 = np.uint64(0x3333333333333333)
+M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+H01 = np.uint64(0x0101010101010101)
+
+def get_image_index(df):
+    '''
+    Builds inverted index of the image filter columns (INDEX_COLUMNS) and of rows with known file urls.
+
+    Parameters:
+    -----------
+    df - DataFrame with image metadata.
+
+    Returns:
+    --------
+    index - Dictionary with 'num_rows', 'has_file' (bitset of rows with a known 'File_url'),
+            and 'columns': for each column, the 'codes' of its values, and for each value code either
+            a 'dense' bitset or 'sparse' bytes of a bitset (see `get_sparse_bits`).
+
+    '''
+    num_rows = len(df)
+    index = {'num_rows': num_rows, 'columns': {}}
+    for col in INDEX_COLUMNS:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            codes = df[col].cat.codes.to_numpy()
+            categories = df[col].cat.categories
+        else:
+            codes, categories = pd.factorize(df[col])
+        # Rows sorted by code (stable, so rows of each value stay in order)
+        order = np.argsort(codes, kind = 'stable').astype(np.int32)
+        bounds = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+        dense = {}
+        sparse = {}
+        for code in range(len(categories)):
+            rows = order[bounds[code]:bounds[code + 1]]
+            if len(rows) * DENSE_FRACTION > num_rows:
+                dense[code] = to_bitset(rows, num_rows)
+            elif len(rows) > 0:
+                sparse[code] = get_sparse_bits(rows)
+        index['columns'][col] = {'codes': {value: code for code, value in enumerate(categories)},
+                                 'dense': dense, 'sparse': sparse}
+    has_file = np.zeros(num_rows, dtype = bool)
+    if 'File_url' in df.columns:
+        has_file = (df['File_url'] != 'unknown').to_numpy() & df['File_url'].notna().to_numpy()
+    index['has_file'] = pack_bits(has_file)
+    return index
+
+def new_bitset(num_rows):
+    '''
+    Returns empty bitset of `num_rows` bits.
+    '''
+    return np.zeros(-(-num_rows // (8 * WORD_BYTES)) * WORD_BYTES, dtype = np.uint8)
+
+def pack_bits(selected):
+    '''
+    Returns bitset of a boolean array.
+    '''
+    bitset = new_bitset(len(selected))
+    packed = np.packbits(selected)
+    bitset[:len(packed)] = packed
+    return bitset
+
+def to_bitset(rows, num_rows):
+    '''
+    Returns bitset of `num_rows` bits with the bits of the (sorted, unique) `rows` set.
+    '''
+    bitset = new_bitset(num_rows)
+    set_bits(bitset, rows)
+    return bitset
+
+def get_sparse_bits(rows):
+    '''
+    Returns the (sorted, unique) positions and values of the non-zero bytes of a bitset with the bits of the
+    (sorted, unique) `rows` set, so they can be set in another bitset in time proportional to the number of rows.
+    '''
+    positions = rows >> 3
+    bits = (np.uint8(128) >> (rows & 7).astype(np.uint8)).astype(np.uint8)
+    # Combine the bits of rows that share a byte
+    starts = np.flatnonzero(np.diff(positions, prepend = -1))
+    return positions[starts], np.bitwise_or.reduceat(bits, starts)
+
+def set_bits(bitset, rows):
+    '''
+    Sets the bits of the (sorted, unique) `rows` in a bitset.
+    '''
+    if len(rows) > 0:
+        positions, values = get_sparse_bits(rows)
+        bitset[positions] |= values
+
+def get_column_selection(index, column, values):
+    '''
+    Finds the rows of an indexed column with any of the given values.
+
+    Parameters:
+    -----------
+    index - Dictionary returned by `get_image_index`.
+    column - Name of column to check.
+    values - List of values to select.
+
+    Returns:
+    --------
+    selected - Bitset of the selected rows, or None if every row is selected.
+
+    '''
+    column_index = index['columns'][column]
+    codes = {column_index['codes'][value] for value in values if value in column_index['codes']}
+    if codes.issuperset(column_index['dense']) and codes.issuperset(column_index['sparse']):
+        return None
+    dense = [column_index['dense'][code] for code in codes if code in column_index['dense']]
+    selected = dense[0].copy() if dense else new_bitset(index['num_rows'])
+    for bitset in dense[1:]:
+        selected |= bitset
+    for code in codes:
+        if code in column_index['sparse']:
+            positions, values = column_index['sparse'][code]
+            selected[positions] |= values
+    return selected
+
+def get_selection_bitset(index, selections):
+    '''
+    Intersects the selections of several indexed columns.
+
+    Parameters:
+    -----------
+    index - Dictionary returned by `get_image_index`.
+    selections - List of (column, values) pairs.
+
+    Returns:
+    --------
+    selected - Bitset of the rows with one of the selected values in every column.
+
+    '''
+    selected = None
+    for column, values in selections:
+        column_selected = get_column_selection(index, column, values)
+        if column_selected is None:
+            continue
+        if selected is None:
+            selected = column_selected
+        else:
+            selected &= column_selected
+    if selected is None:
+        selected = pack_bits(np.ones(index['num_rows'], dtype = bool))
+    return selected
+
+def count_word_bits(bitset):
+    '''
+    Returns number of set bits in each 64-bit word of a bitset (parallel bit count, in place on a single copy).
+    '''
+    words = bitset.view(np.uint64)
+    shifted = words >> np.uint64(1)
+    shifted &= M1
+    counts = words - shifted
+    np.right_shift(counts, np.uint64(2), out = shifted)
+    shifted &= M2
+    counts &= M2
+    counts += shifted
+    np.right_shift(counts, np.uint64(4), out = shifted)
+    counts += shifted
+    counts &= M4
+    counts *= H01
+    counts >>= np.uint64(56)
+    # counts are at most 64, so they are the same as signed integers
+    return counts.view(np.int64)
+
+def count_bits(bitset):
+    return int(count_word_bits(bitset).sum())
+
+def sample_bits(bitset, num, rng = None, word_counts = None):
+    '''
+    Randomly selects (without replacement) `num` of the set bits of a bitset, unpacking only the words holding them.
+    `word_counts` are the bit counts of its words (from `count_word_bits`), if already computed.
+    `rng` is an optional random.Random instance (defaults to the random module), which samples in time proportional to `num`.
+
+    Returns:
+    --------
+    rows - Array of the selected row numbers.
+
+    '''
+    rng = rng or random
+    if word_counts is None:
+        word_counts = count_word_bits(bitset)
+    cumulative = np.cumsum(word_counts)
+    ranks = np.array(rng.sample(range(int(cumulative[-1])), num), dtype = np.int64)
+    # Word holding each selected bit, then the bit's position within the word
+    words = np.searchsorted(cumulative, ranks, side = 'right')
+    ranks_in_word = ranks - np.concatenate([[0], cumulative])[words]
+    word_bits = np.unpackbits(bitset.reshape(-1, WORD_BYTES)[words], axis = 1)
+    positions = np.argmax(np.cumsum(word_bits, axis = 1) > ranks_in_word[:, None], axis = 1)
+    return words * 8 * WORD_BYTES + positions
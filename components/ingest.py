@@ -0,0 +1,319 @@
+import base64
+import hashlib
+import io
+import os
+import pathlib
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Reading and validating uploaded data
+
+# Number of rows of an uploaded CSV parsed (and checked) at a time
+CHUNK_ROWS = 100_000
+READ_BUFFER_SIZE = 2**20
+# Number of rows read to check the header and lat/lon values before parsing the whole upload
+SNIFF_ROWS = 1000
+SNIFF_BUFFER_SIZE = 2**16
+# Directory for files uploaded to the server's /upload route while they are processed
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'dashboard-uploads'))
+# Seconds an uploaded file waiting to be processed is kept if the dashboard never loads it
+UPLOAD_MAX_AGE = int(os.environ.get('UPLOAD_MAX_AGE', 24 * 60 * 60))
+FEATURES = ['Species', 'Subspecies', 'View', 'Sex', 'Hybrid_stat', 'Lat', 'Lon', 'File_url']
+# Columns with repeated labels, stored as categoricals
+CATEGORICAL_FEATURES = ['Species', 'Subspecies', 'View', 'Sex', 'Hybrid_stat', 'Locality']
+
+class UploadError(Exception):
+    '''
+    Raised when uploaded data does not meet requirements.
+    `error` is the dictionary describing the error for `get_error_div` (eg., {'feature': 'Species'}).
+    '''
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+class Base64Reader(io.RawIOBase):
+    '''
+    Read-only binary stream of data decoded from a base64 string, decoded one block at a time.
+
+    Parameters:
+    -----------
+    content_string - String containing base64 encoded data.
+    start - Integer. Position in `content_string` at which the encoded data begins.
+
+    '''
+    def __init__(self, content_string, start = 0):
+        self.content_string = content_string
+        self.position = start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Every 4 base64 characters decode to 3 bytes
+        num_chars = max(len(buffer) // 3, 1) * 4
+        block = self.content_string[self.position:self.position + num_chars]
+        self.position += len(block)
+        decoded = base64.b64decode(block)
+        buffer[:len(decoded)] = decoded
+        return len(decoded)
+
+def get_columns(columns):
+    '''
+    Capitalizes column names, renaming 'Long' to 'Lon' if there is no 'Lon' column.
+    '''
+    columns = pd.Index(columns).str.capitalize()
+    if 'Lon' not in columns:
+        columns = columns.where(columns != 'Long', 'Lon')
+    return columns
+
+def get_features(columns):
+    '''
+    Checks for required columns. Raises UploadError if a required feature is missing.
+
+    Parameters:
+    -----------
+    columns - Capitalized column names of uploaded data.
+
+    Returns:
+    --------
+    included_features - List of features (columns) included in the data.
+    mapping - Boolean. False when lat or lon is missing (disables Map View).
+    img_urls - Boolean. False when file urls are missing (disables sample image options).
+
+    '''
+    mapping = 'Lat' in columns and 'Lon' in columns
+    img_urls = 'File_url' in columns
+    for feature in FEATURES:
+        if feature not in columns and feature not in ['Lat', 'Lon', 'File_url']:
+            raise UploadError({'feature': feature})
+    included_features = [feature for feature in FEATURES if feature in columns]
+    return included_features, mapping, img_urls
+
+def to_categorical(series):
+    '''
+    Converts a column to categorical with (object) categories in order of appearance, so chunks combine consistently.
+    '''
+    categories = pd.Index(series.dropna().unique(), dtype = object)
+    return series.astype(pd.CategoricalDtype(categories))
+
+def clean_chunk(chunk, columns, mapping):
+    '''
+    Processes a chunk of uploaded data: keeps only the needed columns, sets lat/lon outside their ranges to null,
+    and converts repeated labels to categoricals. Raises UploadError if lat or lon has non-numeric values.
+
+    Parameters:
+    -----------
+    chunk - DataFrame of rows of uploaded data (with capitalized columns).
+    columns - List of columns to keep.
+    mapping - Boolean. True when lat/lon are given in dataset.
+
+    Returns:
+    --------
+    chunk - Processed DataFrame.
+
+    '''
+    chunk = chunk[columns].copy()
+    if mapping:
+        try:
+            # Check lat and lon within appropriate ranges (lat: [-90, 90], lon: [-180, 180])
+            valid_lat = chunk['Lat'].astype(float).between(-90, 90)
+            chunk.loc[~valid_lat, 'Lat'] = np.nan
+            valid_lon = chunk['Lon'].astype(float).between(-180, 180)
+            chunk.loc[~valid_lon, 'Lon'] = np.nan
+        except ValueError as e:
+            print(e)
+            raise UploadError({'mapping': str(e)})
+    for col in CATEGORICAL_FEATURES:
+        if col in columns:
+            chunk[col] = to_categorical(chunk[col])
+    return chunk
+
+def concat_chunks(chunks):
+    '''
+    Combines processed chunks into one DataFrame, one column at a time to release each chunk's memory as it goes.
+    '''
+    data = {}
+    for col in chunks[0].columns:
+        values = [chunk.pop(col) for chunk in chunks]
+        if isinstance(values[0].dtype, pd.CategoricalDtype):
+            data[col] = union_categoricals(values)
+        else:
+            data[col] = pd.concat(values, ignore_index = True)
+    return pd.DataFrame(data)
+
+def get_upload_bytes(contents, buffer_size = READ_BUFFER_SIZE):
+    '''
+    Returns binary stream of uploaded data: read from the file if `contents` is the path (os.PathLike) of a saved upload,
+    otherwise decoded from the contents (base64 encoded data URL) as it is read.
+    '''
+    if isinstance(contents, os.PathLike):
+        return open(contents, 'rb', buffering = buffer_size)
+    return io.BufferedReader(Base64Reader(contents, contents.index(',') + 1), buffer_size = buffer_size)
+
+def get_upload_hash(contents, filename, prefix = ''):
+    '''
+    Hashes uploaded data to key the processed dataset, reading the decoded bytes in blocks, so the same file gets the same
+    key whether uploaded as contents, uploaded to the server (see `UploadFile`), or read from the data directory.
+
+    Parameters:
+    -----------
+    contents - Uploaded data: path (os.PathLike) of a saved upload, or contents (base64 encoded data URL).
+    filename - String. Name of uploaded file (included in the hash).
+    prefix - String included before the name (eg., key of the dataset the upload is appended to).
+
+    Returns:
+    --------
+    String. Hexadecimal SHA-256 digest of the prefix, file name, and data.
+
+    '''
+    digest = hashlib.sha256((prefix + filename).encode('utf-8'))
+    with get_upload_bytes(contents) as stream:
+        while block := stream.read(READ_BUFFER_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+class UploadFile(io.FileIO):
+    '''
+    Temporary file (in `upload_dir`) receiving a file uploaded to the server, hashed as it is written (matching
+    `get_upload_hash`). Used as the stream factory of werkzeug's form parser, so the upload is written to disk once.
+    The caller removes the file (`path`).
+    '''
+    def __init__(self, upload_dir, filename):
+        os.makedirs(upload_dir, exist_ok = True)
+        fd, path = tempfile.mkstemp(dir = upload_dir, suffix = os.path.splitext(filename)[1])
+        super().__init__(fd, 'r+')
+        self.path = pathlib.Path(path)
+        self.digest = hashlib.sha256(filename.encode('utf-8'))
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[super().write(view):]
+        self.digest.update(data)
+        return len(data)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+def store_upload(path, dataset_key):
+    '''
+    Renames an uploaded file (in the upload directory) to be processed later, in a background job, by the name returned.
+    The name starts with the dataset key, so the key does not have to be passed along with it (see `get_stored_upload`).
+    '''
+    name = f'{dataset_key}-{path.name}'
+    os.replace(path, path.with_name(name))
+    return name
+
+def get_stored_upload(upload_dir, name):
+    '''
+    Returns path and dataset key of an uploaded file stored by `store_upload`.
+    Raises KeyError if the name is not one of a stored upload (it comes from the URL) or the file no longer exists.
+    '''
+    dataset_key, _, rest = name.partition('-')
+    if (len(dataset_key) != 64 or not rest or os.path.basename(name) != name
+            or any(c not in '0123456789abcdef' for c in dataset_key)):
+        raise KeyError(name)
+    path = pathlib.Path(upload_dir, name)
+    if not path.is_file():
+        raise KeyError(name)
+    return path, dataset_key
+
+def remove_stale_uploads(upload_dir, max_age = UPLOAD_MAX_AGE):
+    '''
+    Removes files from the upload directory last modified more than `max_age` seconds ago (uploads never processed).
+    '''
+    if not os.path.isdir(upload_dir):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(upload_dir):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+def read_sample(contents, filename, nrows, usecols = None):
+    '''
+    Reads the first `nrows` rows of the uploaded data (all rows if None). Raises UploadError if the file type is wrong.
+    '''
+    if 'csv' in filename:
+        buffer_size = SNIFF_BUFFER_SIZE if nrows else READ_BUFFER_SIZE
+        with get_upload_bytes(contents, buffer_size) as stream:
+            return pd.read_csv(stream, encoding = 'utf-8', nrows = nrows, usecols = usecols)
+    elif 'xls' in filename:
+        if isinstance(contents, os.PathLike):
+            return pd.read_excel(contents, nrows = nrows, usecols = usecols)
+        # Excel files are zip archives, read from a (seekable) decoded copy
+        return pd.read_excel(io.BytesIO(base64.b64decode(contents[contents.index(',') + 1:])), nrows = nrows, usecols = usecols)
+    raise UploadError({'type': 'wrong file type'})
+
+def sniff_upload(contents, filename):
+    '''
+    Checks the header and first SNIFF_ROWS rows of uploaded data, so uploads that do not meet requirements are rejected
+    before the whole file is parsed. Raises UploadError if the file type is wrong or the data does not meet requirements.
+
+    Parameters:
+    -----------
+    contents - String. Uploaded contents (base64 encoded data URL) from dcc.Upload, or path of a saved upload.
+    filename - String. Name of uploaded file.
+
+    Returns:
+    --------
+    header - Dictionary of 'usecols' (uploaded names of the columns to read), 'columns' (their capitalized names),
+             'included_features', 'mapping', and 'img_urls' (see `get_features`).
+
+    '''
+    sample = read_sample(contents, filename, SNIFF_ROWS)
+    uploaded_columns = list(sample.columns)
+    sample.columns = get_columns(sample.columns)
+    included_features, mapping, img_urls = get_features(sample.columns)
+    columns = included_features + (['Locality'] if 'Locality' in sample.columns else [])
+    # Check lat/lon values of the sample
+    clean_chunk(sample, columns, mapping)
+    return {'usecols': [uploaded for uploaded, column in zip(uploaded_columns, sample.columns) if column in columns],
+            'columns': columns,
+            'included_features': included_features,
+            'mapping': mapping,
+            'img_urls': img_urls}
+
+def clean_upload_chunk(chunk, header):
+    '''
+    Capitalizes column names of a chunk of uploaded data and processes it (see `clean_chunk`).
+    '''
+    chunk.columns = get_columns(chunk.columns)
+    return clean_chunk(chunk, header['columns'], header['mapping'])
+
+def read_upload(contents, filename, header = None):
+    '''
+    Reads uploaded data and checks that it meets requirements. Only the needed columns are parsed, and
+    CSVs are decoded and parsed in chunks of CHUNK_ROWS rows.
+    Raises UploadError if the file type is wrong or the data does not meet requirements.
+
+    Parameters:
+    -----------
+    contents - String. Uploaded contents (base64 encoded data URL) from dcc.Upload, or path of a saved upload.
+    filename - String. Name of uploaded file.
+    header - Optional dictionary returned by `sniff_upload` for these contents, checked first if not given.
+
+    Returns:
+    --------
+    df - DataFrame with the included features (and 'Locality' if given).
+    included_features - List of features (columns) included in the data.
+    mapping - Boolean. True when lat/lon are given in dataset.
+    img_urls - Boolean. True when file urls are given in dataset.
+
+    '''
+    if header is None:
+        header = sniff_upload(contents, filename)
+    processed_chunks = []
+    if 'csv' in filename:
+        with get_upload_bytes(contents) as stream:
+            for chunk in pd.read_csv(stream, encoding = 'utf-8', chunksize = CHUNK_ROWS, usecols = header['usecols']):
+                processed_chunks.append(clean_upload_chunk(chunk, header))
+    else:
+        chunk = read_sample(contents, filename, None, usecols = header['usecols'])
+        processed_chunks.append(clean_upload_chunk(chunk, header))
+    return concat_chunks(processed_chunks), header['included_features'], header['mapping'], header['img_urls']
@@ -0,0 +1,205 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request, Response
+from dash.exceptions import PreventUpdate
+
+# Opt-in timing of callbacks (and stages within them) and their request/response sizes, reported in Prometheus text format.
+# Set DASHBOARD_METRICS=1 to record metrics, and DASHBOARD_METRICS_LOG=1 to also log a JSON line per callback request.
+METRICS_ENABLED = os.environ.get('DASHBOARD_METRICS', '0') == '1'
+METRICS_LOG = os.environ.get('DASHBOARD_METRICS_LOG', '0') == '1'
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+# Path of Dash callback requests
+CALLBACK_PATH = '/_dash-update-component'
+
+logger = logging.getLogger('dashboard.metrics')
+_current = threading.local()
+
+class Histogram:
+    '''
+    Counts of observations in cumulative LATENCY_BUCKETS, with their sum and total count.
+    '''
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    '''
+    Thread-safe store of the callback metrics of this server process.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # callback -> Histogram of time spent in the callback function
+            self.callback_seconds = {}
+            # (callback, stage) -> [total seconds, count]
+            self.stage_seconds = {}
+            # (callback, outcome) -> count ('ok', 'prevented', or 'error')
+            self.calls = {}
+            # callback -> Histogram of time of the whole request (including Dash decoding and serialization)
+            self.request_seconds = {}
+            # (callback, 'request' or 'response') -> total bytes
+            self.payload_bytes = {}
+
+    def record_callback(self, name, seconds, stages, outcome):
+        with self._lock:
+            self.callback_seconds.setdefault(name, Histogram()).observe(seconds)
+            for stage, stage_seconds in stages.items():
+                totals = self.stage_seconds.setdefault((name, stage), [0.0, 0])
+                totals[0] += stage_seconds
+                totals[1] += 1
+            self.calls[(name, outcome)] = self.calls.get((name, outcome), 0) + 1
+
+    def record_request(self, name, seconds, request_bytes, response_bytes):
+        with self._lock:
+            self.request_seconds.setdefault(name, Histogram()).observe(seconds)
+            for direction, size in [('request', request_bytes), ('response', response_bytes)]:
+                self.payload_bytes[(name, direction)] = self.payload_bytes.get((name, direction), 0) + size
+
+    def render(self, gauges = None):
+        '''
+        Returns the metrics in Prometheus text exposition format.
+        `gauges` is an optional dictionary of extra gauges: name -> list of (labels dictionary, value).
+        '''
+        lines = []
+        with self._lock:
+            add_histograms(lines, 'dashboard_callback_seconds', 'Time spent in callback functions.',
+                           self.callback_seconds)
+            add_histograms(lines, 'dashboard_request_seconds',
+                           'Time spent on callback requests, including decoding inputs and serializing outputs.',
+                           self.request_seconds)
+            add_metric(lines, 'dashboard_callback_stage_seconds_total', 'counter', 'Time spent in each stage of callbacks.',
+                       [({'callback': name, 'stage': stage}, totals[0]) for (name, stage), totals in self.stage_seconds.items()])
+            add_metric(lines, 'dashboard_callback_stage_calls_total', 'counter', 'Number of times each stage of callbacks ran.',
+                       [({'callback': name, 'stage': stage}, totals[1]) for (name, stage), totals in self.stage_seconds.items()])
+            add_metric(lines, 'dashboard_callback_calls_total', 'counter', 'Number of callback calls by outcome.',
+                       [({'callback': name, 'outcome': outcome}, count) for (name, outcome), count in self.calls.items()])
+            add_metric(lines, 'dashboard_callback_payload_bytes_total', 'counter', 'Size of callback requests and responses.',
+                       [({'callback': name, 'direction': direction}, size)
+                        for (name, direction), size in self.payload_bytes.items()])
+        for name, samples in (gauges or {}).items():
+            add_metric(lines, name, 'gauge', '', samples)
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def format_labels(labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+def add_metric(lines, name, kind, description, samples):
+    if description:
+        lines.append(f'# HELP {name} {description}')
+    lines.append(f'# TYPE {name} {kind}')
+    for labels, value in samples:
+        lines.append(f'{name}{format_labels(labels)} {value}')
+
+def add_histograms(lines, name, description, histograms):
+    lines.append(f'# HELP {name} {description}')
+    lines.append(f'# TYPE {name} histogram')
+    for callback, histogram in histograms.items():
+        for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+            lines.append(f'{name}_bucket{format_labels({"callback": callback, "le": bound})} {count}')
+        lines.append(f'{name}_bucket{format_labels({"callback": callback, "le": "+Inf"})} {histogram.count}')
+        lines.append(f'{name}_sum{format_labels({"callback": callback})} {histogram.sum}')
+        lines.append(f'{name}_count{format_labels({"callback": callback})} {histogram.count}')
+
+def instrument_callback(func):
+    '''
+    Decorator timing a callback function and the stages (see `stage`) within it, when metrics are enabled.
+    '''
+    if not METRICS_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_current, 'stages', None) is not None:
+            # Called from another callback, time as a stage of it
+            with stage(func.__name__):
+                return func(*args, **kwargs)
+        _current.stages = {}
+        outcome = 'ok'
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except PreventUpdate:
+            outcome = 'prevented'
+            raise
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            stages = _current.stages
+            _current.stages = None
+            metrics.record_callback(func.__name__, seconds, stages, outcome)
+            if has_request_context():
+                g.metrics_callback = {'callback': func.__name__, 'outcome': outcome,
+                                      'callback_seconds': seconds, 'stages': stages}
+    return wrapper
+
+@contextmanager
+def stage(name):
+    '''
+    Times a stage of the current callback (eg., 'load_dataset' or 'build_figure'), when metrics are enabled.
+    Repeated stages within a callback are added together.
+    '''
+    stages = getattr(_current, 'stages', None)
+    if stages is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+def init_metrics(server, gauges = None):
+    '''
+    Adds request timing of callbacks and the '/metrics' route to the Flask server, when metrics are enabled.
+    `gauges` is an optional function returning extra gauges to report (see `Metrics.render`).
+    '''
+    if not METRICS_ENABLED:
+        return
+    if METRICS_LOG and not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.INFO)
+
+    @server.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def record_request(response):
+        if request.path.endswith(CALLBACK_PATH) and 'metrics_callback' in g:
+            record = g.metrics_callback
+            seconds = time.perf_counter() - g.metrics_start
+            request_bytes = request.content_length or 0
+            response_bytes = response.calculate_content_length() or 0
+            metrics.record_request(record['callback'], seconds, request_bytes, response_bytes)
+            if METRICS_LOG:
+                logger.info(json.dumps({**record,
+                                        'request_seconds': seconds,
+                                        'request_bytes': request_bytes,
+                                        'response_bytes': response_bytes,
+                                        'pid': os.getpid()}))
+        return response
+
+    @server.route('/metrics')
+    def get_metrics():
+        return Response(metrics.render(gauges() if gauges else None), mimetype = 'text/plain; version=0.0.4')
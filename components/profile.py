@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+# Summary of a dataset computed once at upload, so layouts are built without reading its rows
+
+# Columns counted by the profile (required features)
+PROFILE_COLUMNS = ['Species', 'Subspecies', 'View', 'Sex', 'Hybrid_stat']
+
+def get_profile(df, mapping):
+    '''
+    Summarizes uploaded data in a single grouped pass over its rows (before processing, so missing values can be told apart).
+
+    Parameters:
+    -----------
+    df - DataFrame of the uploaded data (see `read_upload`).
+    mapping - Boolean. True when lat/lon are given in dataset.
+
+    Returns:
+    --------
+    profile - Dictionary (saved as JSON) with:
+                'num_rows' - number of rows.
+                'species' - species options and their subspecies (see `get_species_map`).
+                'vocabularies' - for each of PROFILE_COLUMNS, its values in order of first appearance (missing values as 'unknown', as processed).
+                'counts' - for each of PROFILE_COLUMNS, number of rows with each value of its vocabulary.
+                'bounds' - dictionary of the 'lat' and 'lon' [min, max] of known locations, or None if there are none (or no mapping).
+
+    '''
+    cube = df.groupby(PROFILE_COLUMNS, sort = False, dropna = False, observed = True).size().reset_index(name = 'count')
+    profile = {'num_rows': int(cube['count'].sum()),
+               'species': get_species_map(cube),
+               'vocabularies': {},
+               'counts': {},
+               'bounds': get_bounds(df) if mapping else None}
+    for col in PROFILE_COLUMNS:
+        values = cube[col].astype(object).where(cube[col].notna(), 'unknown')
+        col_counts = cube['count'].groupby(values.to_numpy(), sort = False).sum()
+        profile['vocabularies'][col] = col_counts.index.tolist()
+        profile['counts'][col] = col_counts.tolist()
+    return profile
+
+def get_species_map(pairs):
+    '''
+    Produces a dictionary of species options (eg., melpomene, erato, and Any) and their subspecies.
+
+    Parameters:
+    -----------
+    pairs - DataFrame of the observed ('Species', 'Subspecies') pairs (possibly with other columns), in order of first appearance.
+
+    Returns:
+    --------
+    all_species - Dictionary of all potential species options and their subspecies (missing species and subspecies are left out).
+                  Each species' list starts with 'Any-<species>', and 'Any' lists all subspecies.
+
+    '''
+    pairs = pairs[['Species', 'Subspecies']]
+    all_species = {}
+    # drop nulls to avoid adding non-species (or subspecies below)
+    for species, subspecies in pairs.loc[pairs['Species'].notna()].groupby('Species', sort = False, observed = True)['Subspecies']:
+        # need this to match as filled for img selection
+        all_species[species] = ['Any-' + species] + subspecies.dropna().unique().tolist()
+    all_species['Any'] = ['Any'] + pairs['Subspecies'].dropna().unique().tolist()
+    return all_species
+
+def get_bounds(df):
+    '''
+    Returns the 'lat' and 'lon' [min, max] of rows with known lat and lon, or None if there are none.
+    '''
+    lat = pd.to_numeric(df['Lat'], errors = 'coerce').to_numpy(dtype = float)
+    lon = pd.to_numeric(df['Lon'], errors = 'coerce').to_numpy(dtype = float)
+    known = np.isfinite(lat) & np.isfinite(lon)
+    if not known.any():
+        return None
+    return {'lat': [float(lat[known].min()), float(lat[known].max())],
+            'lon': [float(lon[known].min()), float(lon[known].max())]}
+
+def merge_profiles(profile, added):
+    '''
+    Combines the profile of a dataset with the profile of rows appended to it, giving the profile of all the rows
+    (as from `get_profile`) in time proportional to the number of values rather than rows.
+
+    Parameters:
+    -----------
+    profile - Dictionary returned by `get_profile` for the dataset.
+    added - Dictionary returned by `get_profile` for the appended rows.
+
+    Returns:
+    --------
+    profile - Dictionary of the profile of the dataset followed by the appended rows.
+
+    '''
+    merged = {'num_rows': profile['num_rows'] + added['num_rows'],
+              'species': merge_species_maps(profile['species'], added['species']),
+              'vocabularies': {},
+              'counts': {},
+              'bounds': merge_bounds(profile['bounds'], added['bounds'])}
+    for col in PROFILE_COLUMNS:
+        counts = dict(zip(profile['vocabularies'][col], profile['counts'][col]))
+        for value, count in zip(added['vocabularies'][col], added['counts'][col]):
+            counts[value] = counts.get(value, 0) + count
+        merged['vocabularies'][col] = list(counts)
+        merged['counts'][col] = list(counts.values())
+    return merged
+
+def merge_species_maps(all_species, added):
+    '''
+    Combines species options (see `get_species_map`), keeping species and subspecies in order of first appearance and 'Any' last.
+    '''
+    merged = {species: list(subspecies) for species, subspecies in all_species.items() if species != 'Any'}
+    for species, subspecies in added.items():
+        if species != 'Any':
+            merged[species] = list(dict.fromkeys(merged.get(species, []) + subspecies))
+    merged['Any'] = list(dict.fromkeys(all_species['Any'] + added['Any']))
+    return merged
+
+def merge_bounds(bounds, added):
+    '''
+    Combines the lat/lon bounds of known locations (see `get_bounds`), either of which may be None.
+    '''
+    if bounds is None or added is None:
+        return bounds or added
+    return {axis: [min(bounds[axis][0], added[axis][0]), max(bounds[axis][1], added[axis][1])] for axis in ['lat', 'lon']}
@@ -1,16 +1,28 @@
 import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
 from dash import html
+from components.ingest import to_categorical
+from components.index import get_image_index, get_selection_bitset, pack_bits, count_bits, count_word_bits, sample_bits
+from components.profile import get_species_map
+from components.thumbnails import get_thumbnail_url, get_image_url, prefetch_thumbnails
 
 # Helper functions for Dashboard
 
 PRINT_STYLE = {"color": "MidnightBlue"}
 IMG_STYLE = {"max-width": "400px"}
+# Columns of repeated labels, stored as categoricals (filtered and counted by their integer codes)
+CATEGORICAL_COLUMNS = ['Species', 'Subspecies', 'View', 'Sex', 'Hybrid_stat', 'Locality',
+                       'lat-lon', 'Species_at_locality', 'Subspecies_at_locality']
+# Columns of values computed per lat-lon pair (see `get_data`)
+LOCALITY_COLUMNS = ['Samples_at_locality', 'Species_at_locality', 'Subspecies_at_locality']
 
 def get_data(df, mapping, features):
     '''
     Reads in DataFrame and performs required manipulations: 
         - fill null values in required columns with 'unknown'
         - add 'lat-lon', `Samples_at_locality`, 'Species_at_locality', and 'Subspecies_at_locality' columns.
+        - store columns of repeated labels (CATEGORICAL_COLUMNS) as categoricals.
         - make list of categorical columns.
 
     Parameters:
@@ -37,6 +49,10 @@ def get_data(df, mapping, features):
     ]
 
     df = df.copy()
+    # categorical columns need 'unknown' as a category to be filled
+    for col in df.select_dtypes('category').columns:
+        if 'unknown' not in df[col].cat.categories:
+            df[col] = df[col].cat.add_categories('unknown')
     df = df.fillna('unknown')
     features.append('Locality')
     
@@ -44,18 +60,17 @@ def get_data(df, mapping, features):
     if not mapping:
         if 'Locality' not in df.columns:
             df['Locality'] = 'unknown'
-        return df[features], cat_list      
+        return to_categoricals(df)[features], cat_list
     
     # else lat and lon are in dataset, so process locality information
-    df['lat-lon'] = df['Lat'].astype(str) + '|' + df['Lon'].astype(str)
-    df["Samples_at_locality"] = df['lat-lon'].map(df['lat-lon'].value_counts()) # will duplicate if multiple views of same sample
+    df['lat-lon'] = (df['Lat'].astype(str) + '|' + df['Lon'].astype(str)).astype('category')
+    codes = df['lat-lon'].cat.codes.to_numpy()
+    df["Samples_at_locality"] = np.bincount(codes)[codes] # will duplicate if multiple views of same sample
 
     # Count and record number of species and subspecies at each lat-lon
-    for lat_lon in df['lat-lon']:
-        species_list = ['{}'.format(i) for i in df.loc[df['lat-lon'] == lat_lon]['Species'].unique()]
-        subspecies_list = ['{}'.format(i) for i in df.loc[df['lat-lon'] == lat_lon]['Subspecies'].unique()]
-        df.loc[df['lat-lon'] == lat_lon, "Species_at_locality"] = ", ".join(species_list)
-        df.loc[df['lat-lon'] == lat_lon, "Subspecies_at_locality"] = ", ".join(subspecies_list)
+    # (computed once per distinct lat-lon, then broadcast back to the rows)
+    df["Species_at_locality"] = get_locality_column(df['lat-lon'], get_unique_at_locality(df, 'Species'))
+    df["Subspecies_at_locality"] = get_locality_column(df['lat-lon'], get_unique_at_locality(df, 'Subspecies'))
 
     if 'Locality' not in df.columns:
         df['Locality'] = df['lat-lon'] # contains "unknown" if lat or lon null
@@ -64,7 +79,140 @@ def get_data(df, mapping, features):
     for feature in new_features:
         features.append(feature)
 
-    return df[features], cat_list
+    return to_categoricals(df)[features], cat_list
+
+def append_data(df, batch, mapping, features):
+    '''
+    Appends uploaded rows to processed data (as if processed together with `get_data`), updating the locality columns
+    of only the localities in the batch rather than recounting the values at every locality.
+
+    Parameters:
+    -----------
+    df - Processed DataFrame (returned by `get_data`).
+    batch - DataFrame of the uploaded rows to append, with the same features as the data `df` was processed from.
+    mapping - Boolean. True when lat/lon are given in dataset.
+    features - List of features (columns) included in the batch.
+
+    Returns:
+    --------
+    df - Processed DataFrame of the rows of `df` followed by the rows of `batch`.
+    cat_list - List of categorical variables for RadioItems (pie chart and map).
+
+    '''
+    batch, cat_list = get_data(batch, mapping, list(features))
+    data = {}
+    for col in df.columns:
+        if mapping and col in LOCALITY_COLUMNS:
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            # categories of `df` come first, so its codes are kept
+            data[col] = union_categoricals([df[col], batch[col]])
+        else:
+            data[col] = pd.concat([df[col], batch[col]], ignore_index = True)
+    merged = pd.DataFrame(data)
+    if mapping:
+        for col, values in get_appended_locality_columns(df, batch, merged['lat-lon']).items():
+            merged[col] = values
+    return merged[df.columns], cat_list
+
+def get_appended_locality_columns(df, batch, lat_lon):
+    '''
+    Computes the locality columns (LOCALITY_COLUMNS) of processed rows followed by a processed batch, from the values at
+    each locality of the rows and of the batch, so only the localities in the batch are combined.
+
+    Parameters:
+    -----------
+    df - Processed DataFrame.
+    batch - Processed DataFrame of the appended rows (with their locality columns counted over the batch alone).
+    lat_lon - Categorical Series of the lat-lon pairs of the rows of `df` followed by those of `batch`,
+              whose categories start with those of df['lat-lon'].
+
+    Returns:
+    --------
+    columns - Dictionary of the values of each locality column for the rows of `df` followed by those of `batch`.
+
+    '''
+    codes = lat_lon.cat.codes.to_numpy().astype(np.int64)
+    num_localities = len(lat_lon.cat.categories)
+    df_codes = codes[:len(df)]
+    # Localities in the batch, and the first batch row at each
+    touched, first_rows = np.unique(codes[len(df):], return_index = True)
+    columns = {}
+
+    samples = np.zeros(num_localities, dtype = np.int64)
+    samples[df_codes] = df['Samples_at_locality'].to_numpy()
+    samples[touched] += batch['Samples_at_locality'].to_numpy()[first_rows]
+    columns['Samples_at_locality'] = samples[codes]
+
+    for col in ['Species_at_locality', 'Subspecies_at_locality']:
+        # Code of each locality's value (-1 for localities new in the batch)
+        locality_codes = np.full(num_localities, -1, dtype = np.int64)
+        locality_codes[df_codes] = df[col].cat.codes.to_numpy()
+        categories = df[col].cat.categories
+        added = batch[col].to_numpy()[first_rows]
+        values = [value if code < 0 else merge_value_lists(categories[code], value)
+                  for code, value in zip(locality_codes[touched], added)]
+        new_values = pd.Index(values, dtype = object).difference(categories, sort = False)
+        categories = categories.append(new_values)
+        locality_codes[touched] = categories.get_indexer(values)
+        # Drop values no longer at any locality
+        used = np.unique(locality_codes)
+        recode = np.zeros(len(categories), dtype = np.int64)
+        recode[used] = np.arange(len(used))
+        columns[col] = pd.Categorical.from_codes(recode[locality_codes][codes], categories[used])
+    return columns
+
+def merge_value_lists(values, added):
+    '''
+    Adds the values of a comma-separated list (as in the 'Species_at_locality' column) that are not yet in another,
+    keeping them in order of first appearance.
+    '''
+    return ", ".join(dict.fromkeys(values.split(", ") + added.split(", ")))
+
+def to_categoricals(df):
+    '''
+    Converts any of the CATEGORICAL_COLUMNS in the DataFrame that are not yet categorical.
+    '''
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = to_categorical(df[col])
+    return df
+
+def get_locality_column(lat_lon, values):
+    '''
+    Broadcasts values computed per lat-lon pair back to the rows, as a categorical (by way of the lat-lon codes).
+
+    Parameters:
+    -----------
+    lat_lon - Categorical Series of the lat-lon pair of each row.
+    values - Series of values indexed by lat-lon.
+
+    Returns:
+    --------
+    Categorical of the value at each row's lat-lon.
+
+    '''
+    codes, uniques = pd.factorize(values.reindex(lat_lon.cat.categories))
+    return pd.Categorical.from_codes(codes[lat_lon.cat.codes.to_numpy()], uniques)
+
+def get_unique_at_locality(df, feature):
+    '''
+    Collects the unique values of a feature at each lat-lon pair in a single grouped pass.
+
+    Parameters:
+    -----------
+    df - DataFrame with 'lat-lon' column.
+    feature - String. Column to collect values of (eg., 'Species' or 'Subspecies').
+
+    Returns:
+    --------
+    Series indexed by lat-lon with the comma-separated unique values of `feature` at that locality (in order of first appearance).
+
+    '''
+    pairs = df[['lat-lon', feature]].drop_duplicates()
+    # as strings (mapping a categorical column would give categorical values, which are factorized by category order)
+    values = pairs[feature].astype(object).map('{}'.format)
+    return values.groupby(pairs['lat-lon'], sort = False, observed = True).agg(", ".join)
 
 def get_species_options(df):
     '''
@@ -79,20 +227,13 @@ def get_species_options(df):
     all_species - Dictionary of all potential species options and their subspecies.
 
     '''
-    species_list = list(df.Species.dropna().unique()) # drop nulls to avoid adding non-species (or subspecies below)
-    all_species = {}
-    for species in species_list:
-        subspecies_list = df.loc[df.Species == species, 'Subspecies'].dropna().unique()
-        subspecies_list = np.insert(subspecies_list, 0 , 'Any-' + species) # need this to match as filled for img selection
-        all_species[species] = list(subspecies_list)
-    all_subspecies = np.insert(df.Subspecies.dropna().unique(), 0, 'Any')
-    all_species['Any'] = list(all_subspecies)
-    
-    return all_species
+    # One grouped pass, rather than a scan of the rows of each species
+    pairs = df.groupby(['Species', 'Subspecies'], sort = False, dropna = False, observed = True).size().reset_index()
+    return get_species_map(pairs)
 
 # Retrieve selected number of images
 
-def get_images(df, subspecies, view, sex, hybrid, num_images):
+def get_images(df, subspecies, view, sex, hybrid, num_images, index = None):
     '''
     Retrieves the user-selected number of images.
 
@@ -104,25 +245,45 @@ def get_images(df, subspecies, view, sex, hybrid, num_images):
     sex - String. Sex of specimen selected by the user.
     hybrid - String. Hybrid status of specimen selected by the user.
     num_images - Integer. Number of images requested by the user.
+    index - Optional image index of `df` (from `get_image_index`), built if not given.
 
     Returns:
     --------
-    Imgs - List of html image elements with `src` element pointing to paths for the requested number of images matching given parameters.
+    Imgs - List of html image elements with `data-src` element pointing to paths for the requested number of images matching given parameters.
+           Local images (paths under the image root) are shown as thumbnails, linked to the full size image.
            Returns html header4 "No Such Images. Please make another selection." if no images matching parameters exist.
            Returns html header4 indicating number of matching entries without filepath(s).
     '''
     try:
-        filepaths = get_filenames(df, subspecies, view, sex, hybrid, num_images)
+        filepaths = get_filenames(df, subspecies, view, sex, hybrid, num_images, index)
     except ValueError as e:
         return html.H4(str(e) + " Please make another selection.", 
                     style = PRINT_STYLE)
-    Imgs = [html.Img(src = filepaths[i], style = IMG_STYLE) for i in range(len(filepaths))]
+    prefetch_thumbnails(filepaths)
+    Imgs = [get_image_element(filepath) for filepath in filepaths]
     
     return Imgs
 
-def get_filenames(df, subspecies, view, sex, hybrid, num_images):
+def get_image_element(filepath):
+    '''
+    Returns (lazily loaded) html image element of an image: a thumbnail linked to the full size image if local,
+    else the image at `filepath`.
+    '''
+    thumbnail_url = get_thumbnail_url(filepath)
+    if thumbnail_url is None:
+        return get_lazy_img(filepath)
+    return html.A(get_lazy_img(thumbnail_url), href = get_image_url(filepath), target = '_blank')
+
+def get_lazy_img(src):
+    '''
+    Returns html image element that is loaded when scrolled into view (`data-src` is copied to `src` by assets/lazy_images.js).
+    '''
+    return html.Img(**{'data-src': src}, className = 'lazy-image', style = IMG_STYLE)
+
+def get_filenames(df, subspecies, view, sex, hybrid, num_images, index = None):
     '''
     Randomly selects the given number of filepaths (file urls) for images adhering to specified filters.
+    Rows are selected by intersecting bitsets of the image index, so the DataFrame is not filtered.
     Raises ValueError indicating no such images if none match the user selections.
     
     Parameters:
@@ -133,40 +294,65 @@ def get_filenames(df, subspecies, view, sex, hybrid, num_images):
     sex - String. Sex of specimen selected by the user.
     hybrid - String. Hybrid status of specimen selected by the user.
     num_images - Integer. Number of images requested by the user. Defaults to 1 if no selection.
+    index - Optional image index of `df` (from `get_image_index`), built if not given.
 
     Returns:
     --------
     filepaths - List of filepaths (URLs) corresponding to the selected filenames. 
     
     '''
+    selected, word_counts = get_image_rows(df, subspecies, view, sex, hybrid, index)
+    max_imgs = int(word_counts.sum())
+    if num_images == None:
+        num = 1
+    else:
+        num = min(num_images, max_imgs)
+    sample_rows = sample_bits(selected, num, word_counts = word_counts)
+    filepaths = df.File_url.iloc[sample_rows]
+    #return list of filepaths for min(user-selected, available) images randomly selected images from the filtered dataset
+    return [str(filepath) for filepath in filepaths]
+
+def get_image_rows(df, subspecies, view, sex, hybrid, index = None, filters = None):
+    '''
+    Finds the rows with known file urls adhering to specified filters (see `get_filenames`),
+    and to the optional `filters` (dictionary of the value to keep of any columns, eg., {'Locality': 'Panama'}).
+    Raises ValueError indicating no such images if none match the user selections.
+
+    Returns:
+    --------
+    selected - Bitset of the matching rows with file urls.
+    word_counts - Bit counts of the words of `selected` (from `count_word_bits`).
+
+    '''
+    if index is None:
+        index = get_image_index(df)
     if ('Any' in subspecies and type(subspecies) == str) or ('Any' in subspecies[0] and len(subspecies) == 1):
         if type(subspecies) == list:
             subspecies = subspecies[0]
         if subspecies == 'Any':
-            df_sub = df.copy()
+            selections = []
         else:
             species = subspecies.split('-')[1] # should match case as filled
-            df_sub = df.loc[df.Species == species].copy()
+            selections = [('Species', [species])]
     else:
-        df_sub = df.loc[df.Subspecies.isin(subspecies)].copy()
-    df_sub = df_sub.loc[df_sub.View.isin(view)]
-    df_sub = df_sub.loc[df_sub.Sex.isin(sex)]
-    df_sub = df_sub.loc[df_sub.Hybrid_stat.isin(hybrid)]
+        selections = [('Subspecies', subspecies)]
+    selections += [('View', view), ('Sex', sex), ('Hybrid_stat', hybrid)]
+    filters = filters or {}
+    selections += [(col, [value]) for col, value in filters.items() if col in index['columns']]
+    selected = get_selection_bitset(index, selections)
+    # Columns not in the index (eg., 'Locality') are checked by their codes
+    for col, value in filters.items():
+        if col not in index['columns']:
+            selected &= pack_bits(get_selection(df[col], [value]))
 
-    num_entries = len(df_sub)
+    num_entries = count_bits(selected)
     # Filter out any entries that have missing URLs:
-    df_sub = df_sub.loc[df_sub.File_url != 'unknown']
-    max_imgs = len(df_sub)
+    selected &= index['has_file']
+    word_counts = count_word_bits(selected)
+    max_imgs = int(word_counts.sum())
     missing_vals = num_entries - max_imgs
     if max_imgs > 0:
-        if num_images == None:
-            num = 1
-        else:
-            num = min(num_images, max_imgs)
-        df_filtered = df_sub.sample(num)
-        filepaths = df_filtered.File_url.astype('string').values
-        #return list of filepaths for min(user-selected, available) images randomly selected images from the filtered dataset
-        return list(filepaths)
+        return selected, word_counts
     # If there aren't any images to display, check if there are no such entries or just missing information.
     elif missing_vals == 0:
         # No images & no matching records
@@ -174,3 +360,56 @@ def get_filenames(df, subspecies, view, sex, hybrid, num_images):
     else:
         # There are records matching, but not able to display images for them
         raise ValueError(f"No Such Images to display; {missing_vals} record(s) with unknown filepath(s) match this selection.")
+
+def get_gallery_rows(df, subspecies, view, sex, hybrid, seed, index = None, filters = None):
+    '''
+    Shuffles the rows with images adhering to specified filters, so pages of a gallery are slices of a stable random order.
+    Raises ValueError indicating no such images if none match the user selections.
+
+    Parameters:
+    -----------
+    df - DataFrame with image metadata.
+    subspecies, view, sex, hybrid - Selections of the user (see `get_filenames`).
+    seed - Integer. Seed of the permutation, the same seed gives the same order.
+    index - Optional image index of `df` (from `get_image_index`), built if not given.
+    filters - Optional dictionary of the value to keep of any columns (see `get_image_rows`).
+
+    Returns:
+    --------
+    rows - Array of the matching row numbers in (seeded) random order.
+
+    '''
+    selected, word_counts = get_image_rows(df, subspecies, view, sex, hybrid, index, filters)
+    rows = np.flatnonzero(np.unpackbits(selected)).astype(np.int32)
+    return np.random.default_rng(seed).permutation(rows)
+
+def get_gallery_page(df, rows, cursor, page_size):
+    '''
+    Returns html image elements (see `get_image_element`) of a page of a gallery: `page_size` of the `rows`
+    (from `get_gallery_rows`) starting at `cursor`. Only the page's file urls are read.
+    '''
+    filepaths = [str(filepath) for filepath in df.File_url.iloc[rows[cursor:cursor + page_size]]]
+    prefetch_thumbnails(filepaths)
+    return [get_image_element(filepath) for filepath in filepaths]
+
+def get_selection(column, values):
+    '''
+    Finds the rows of a column with any of the given values. Categorical columns are checked by their integer codes.
+
+    Parameters:
+    -----------
+    column - Series to check.
+    values - List of values to select.
+
+    Returns:
+    --------
+    selected - Boolean array, True for rows with one of the `values`.
+
+    '''
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Lookup table of selected codes, with a final False entry for null (code -1)
+        selected_codes = np.zeros(len(column.cat.categories) + 1, dtype = bool)
+        positions = column.cat.categories.get_indexer(pd.Index(values, dtype = object).unique())
+        selected_codes[positions[positions >= 0]] = True
+        return selected_codes[column.cat.codes.to_numpy()]
+    return column.isin(values).to_numpy()
@@ -0,0 +1,97 @@
+import json
+import os
+import pathlib
+import tempfile
+import components.cache
+from components.cache import dataset_lock
+from components.ingest import get_upload_hash
+
+# Registry of data files in a local directory (DASHBOARD_DATA_DIR), offered in the dashboard without uploading them.
+# Files are keyed by the hash of their name and contents, rehashed only when their modification time or size changes.
+# Keys are saved in a manifest in the dataset cache directory, shared by all server processes (workers and background jobs),
+# so a file is hashed once (usually before the server starts, see `load_data_files` in dashboard.py).
+DATA_DIR = os.environ.get('DASHBOARD_DATA_DIR')
+DATA_EXTENSIONS = ('.csv', '.xls', '.xlsx')
+MANIFEST_NAME = 'data-files.json'
+
+def list_data_files():
+    '''
+    Returns sorted list of names of the data files (CSV or Excel) in DATA_DIR, empty if no DATA_DIR is set.
+    '''
+    if not DATA_DIR or not os.path.isdir(DATA_DIR):
+        return []
+    return sorted(entry.name for entry in os.scandir(DATA_DIR)
+                  if entry.is_file() and entry.name.lower().endswith(DATA_EXTENSIONS))
+
+def get_manifest_path():
+    return os.path.join(components.cache.DATASET_CACHE_DIR, MANIFEST_NAME)
+
+def read_manifest():
+    '''
+    Returns the saved manifest of data files: dictionary of file name -> [modification time, size, dataset key].
+    Empty if none is saved yet.
+    '''
+    try:
+        with open(get_manifest_path()) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_manifest_entry(name, entry):
+    '''
+    Saves (or replaces) the manifest entry of a data file, keeping those saved by other processes.
+    '''
+    # Held across server processes, so concurrent entries are not lost
+    with dataset_lock(MANIFEST_NAME):
+        manifest = {**read_manifest(), name: list(entry)}
+        os.makedirs(components.cache.DATASET_CACHE_DIR, exist_ok = True)
+        # Write to temporary file first, so other processes never read a partial manifest
+        fd, tmp_path = tempfile.mkstemp(dir = components.cache.DATASET_CACHE_DIR, suffix = '.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(manifest, file)
+            os.replace(tmp_path, get_manifest_path())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+def get_data_file_key(name):
+    '''
+    Returns the dataset key of a data file in DATA_DIR from the manifest, without hashing it, or None if the file is not
+    there, or is new or changed since it was hashed (by its modification time and size).
+    '''
+    if name not in list_data_files():
+        return None
+    try:
+        stat = os.stat(pathlib.Path(DATA_DIR, name))
+    except OSError:
+        return None
+    entry = read_manifest().get(name)
+    if entry is None or entry[:2] != [stat.st_mtime_ns, stat.st_size]:
+        return None
+    return entry[2]
+
+def get_data_file(name):
+    '''
+    Returns path and dataset key of a data file in DATA_DIR, hashing it only if it is new or changed.
+    Raises KeyError if there is no such file.
+
+    Parameters:
+    -----------
+    name - String. File name (as listed by `list_data_files`).
+
+    Returns:
+    --------
+    path - pathlib.Path of the file.
+    dataset_key - String. Hash of the file name and contents.
+
+    '''
+    if name not in list_data_files():
+        raise KeyError(name)
+    path = pathlib.Path(DATA_DIR, name)
+    stat = os.stat(path)
+    entry = read_manifest().get(name)
+    if entry is None or entry[:2] != [stat.st_mtime_ns, stat.st_size]:
+        entry = [stat.st_mtime_ns, stat.st_size, get_upload_hash(path, name)]
+        save_manifest_entry(name, entry)
+    return path, entry[2]
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from PIL import Image
+
+# Resized copies of local sample images, so image displays do not send full resolution files
+
+# Directory local File_url paths are relative to (and confined to)
+IMAGE_ROOT = os.path.realpath(os.environ.get('DASHBOARD_IMAGE_ROOT', os.getcwd()))
+THUMBNAIL_CACHE_DIR = os.environ.get('THUMBNAIL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'dashboard-thumbnails'))
+# Widths (in pixels) thumbnails are served at, the first is used for image displays
+THUMBNAIL_WIDTHS = [int(width) for width in os.environ.get('THUMBNAIL_WIDTHS', '400,200,800').split(',')]
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '4'))
+# Seconds browsers may reuse thumbnails and images without checking their ETag
+IMAGE_MAX_AGE = int(os.environ.get('IMAGE_MAX_AGE', str(24 * 60 * 60)))
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+
+_executor = ThreadPoolExecutor(max_workers = THUMBNAIL_WORKERS, thread_name_prefix = 'thumbnail')
+# Thumbnail path -> Future of thumbnails being resized, so concurrent requests for one thumbnail resize it once
+_pending = {}
+_pending_lock = threading.Lock()
+
+def get_image_path(file_url):
+    '''
+    Returns the absolute path of a local image file (given relative to IMAGE_ROOT),
+    or None if `file_url` is not an image file under IMAGE_ROOT (eg., a remote url).
+    '''
+    if not isinstance(file_url, str) or '://' in file_url or file_url.startswith('data:'):
+        return None
+    path = os.path.realpath(os.path.join(IMAGE_ROOT, file_url))
+    if os.path.commonpath([path, IMAGE_ROOT]) != IMAGE_ROOT:
+        return None
+    if os.path.splitext(path)[1].lower() not in IMAGE_EXTENSIONS or not os.path.isfile(path):
+        return None
+    return path
+
+def get_image_etag(path, width = None):
+    '''
+    Returns ETag of an image file (or its thumbnail of the given width), from its path, modification time, and size.
+    '''
+    stat = os.stat(path)
+    return hashlib.sha256(f'{path}|{stat.st_mtime_ns}|{stat.st_size}|{width}'.encode()).hexdigest()[:32]
+
+def get_thumbnail_url(file_url, width = None):
+    '''
+    Returns the dashboard's url of the thumbnail of a local image, or None if `file_url` is not a local image.
+    '''
+    if get_image_path(file_url) is None:
+        return None
+    return f'/thumbnail/{width or THUMBNAIL_WIDTHS[0]}/{quote(file_url)}'
+
+def get_image_url(file_url):
+    '''
+    Returns the dashboard's url of a local image at full size, or None if `file_url` is not a local image.
+    '''
+    if get_image_path(file_url) is None:
+        return None
+    return f'/image/{quote(file_url)}'
+
+def get_thumbnail(path, width):
+    '''
+    Returns the path of the thumbnail of an image file with the given width, resizing it if not in the thumbnail cache.
+
+    Parameters:
+    -----------
+    path - Absolute path of the image file (from `get_image_path`).
+    width - Width of the thumbnail in pixels (images narrower than this are not enlarged).
+
+    Returns:
+    --------
+    thumbnail_path - Path of the thumbnail in THUMBNAIL_CACHE_DIR.
+    etag - ETag of the thumbnail.
+
+    '''
+    thumbnail_path, etag, future = start_thumbnail(path, width)
+    if future is not None:
+        future.result()
+    return thumbnail_path, etag
+
+def start_thumbnail(path, width):
+    '''
+    Starts resizing (in the thread pool) the thumbnail of an image file, unless it is in the thumbnail cache.
+    Returns its path, ETag, and Future (None if already cached).
+    '''
+    etag = get_image_etag(path, width)
+    thumbnail_path = os.path.join(THUMBNAIL_CACHE_DIR, etag + get_thumbnail_extension(path))
+    if os.path.exists(thumbnail_path):
+        return thumbnail_path, etag, None
+    with _pending_lock:
+        future = _pending.get(thumbnail_path)
+        started = future is None
+        if started:
+            future = _executor.submit(make_thumbnail, path, width, thumbnail_path)
+            _pending[thumbnail_path] = future
+    if started:
+        # Outside the lock, as it runs immediately if already resized
+        future.add_done_callback(lambda _: remove_pending(thumbnail_path))
+    return thumbnail_path, etag, future
+
+def remove_pending(thumbnail_path):
+    with _pending_lock:
+        _pending.pop(thumbnail_path, None)
+
+def prefetch_thumbnails(file_urls, width = None):
+    '''
+    Starts resizing (in the thread pool) the thumbnails of local images not yet in the thumbnail cache,
+    so they are ready (or in progress) when the browser requests them.
+    '''
+    for file_url in file_urls:
+        path = get_image_path(file_url)
+        if path is not None:
+            start_thumbnail(path, width or THUMBNAIL_WIDTHS[0])
+
+def get_thumbnail_extension(path):
+    '''
+    Returns file extension of thumbnails of an image: JPEG thumbnails of JPEG images, PNG (lossless, keeps transparency) of others.
+    '''
+    return '.jpg' if os.path.splitext(path)[1].lower() in {'.jpg', '.jpeg'} else '.png'
+
+def make_thumbnail(path, width, thumbnail_path):
+    '''
+    Resizes image file to the given width (keeping its aspect ratio) and saves it (atomically) to `thumbnail_path`.
+    '''
+    with Image.open(path) as image:
+        image.draft('RGB', (width, width * image.height // max(image.width, 1)))
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+        if thumbnail_path.endswith('.jpg'):
+            image = image.convert('RGB')
+        elif image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok = True)
+        fd, tmp_path = tempfile.mkstemp(dir = THUMBNAIL_CACHE_DIR, suffix = '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, format = 'JPEG' if thumbnail_path.endswith('.jpg') else 'PNG', optimize = True)
+            os.replace(tmp_path, thumbnail_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
@@ -1,36 +1,104 @@
-import pandas as pd
-import numpy as np
-import base64
-import io
 import json
+import os
+import random
+import sys
+import tempfile
+import uuid
+from urllib.parse import parse_qs
 import dash
-from dash import Dash, html, dcc, Input, Output, State
-from dash.exceptions import PreventUpdate
-from components.query import get_data, get_species_options, get_images
-from components.graphs import make_hist_plot, make_map, make_pie_plot
-from components.divs import get_main_div, get_error_div, get_hist_div, get_map_div, get_img_div
+import diskcache
+import multiprocess
+from dash import Dash, DiskcacheManager, html, dcc, Input, Output, State, ClientsideFunction, Patch
+from dash.exceptions import PreventUpdate, MissingCallbackContextException
+from flask import request, Response, send_file, abort
+from werkzeug.formparser import parse_form_data
+from components.query import get_data, append_data, get_gallery_rows, get_gallery_page
+from components.profile import get_profile, merge_profiles
+from components.index import get_image_index
+from components.graphs import make_hist_plot, make_map, make_pie_plot, get_pie_columns, get_grid_size, get_hist_xaxis
+from components.divs import get_main_div, get_error_div, get_hist_div, get_img_div
+from components.cache import (get_dataset, get_meta, get_derived, get_figure, get_cache_stats, put_dataset, pin_dataset,
+                              set_pinned_datasets, dataset_lock)
+from components.aggregate import get_counts, get_cube, append_cube, get_cube_counts, sort_counts, get_locality_counts
+from components.ingest import (read_upload, sniff_upload, get_upload_hash, store_upload, get_stored_upload, remove_stale_uploads,
+                               UploadFile, UploadError, UPLOAD_DIR)
+from components.metrics import init_metrics, instrument_callback, stage
+from components.registry import list_data_files, get_data_file, get_data_file_key
+from components.thumbnails import get_image_path, get_image_etag, get_thumbnail, THUMBNAIL_WIDTHS, IMAGE_MAX_AGE
+# plotly imports its JSON encoder on first use, where concurrent requests (threaded workers) can get it partly imported
+import orjson  # noqa: F401
 
 # Fixed style
 PRINT_STYLE = {'textAlign': 'center', 'color': 'MidnightBlue', 'margin-bottom' : 10}
+UPLOAD_BUTTON_STYLE = {'color': 'MidnightBlue', 
+                       'background-color': 'BlanchedAlmond', 
+                       'border-color': 'MidnightBlue',
+                       'font-size': '16px'}
+
+# Uploads are processed in background jobs (separate processes, tracked in DASHBOARD_JOBS_DIR), so they do not hold a server worker
+JOBS_DIR = os.environ.get('DASHBOARD_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'dashboard-jobs'))
+# Seconds a job's result is kept. Each job gets its own key (by default, jobs with the same arguments share one, so of
+# sessions uploading the same file at the same time, only the first to ask would get the result)
+JOB_EXPIRE = int(os.environ.get('DASHBOARD_JOB_EXPIRE', 600))
+
+# Jobs are started as new processes (the spawn start method) rather than forked from the server worker: a job forked while
+# another thread of the worker (eg., with gunicorn gthread workers) holds a lock, such as SQLite's for the job cache,
+# inherits the lock as held and waits for it (until diskcache times out, losing the result) to save its progress and result
+multiprocess.set_start_method('spawn', force = True)
+background_manager = DiskcacheManager(diskcache.Cache(JOBS_DIR), cache_by = [lambda: uuid.uuid4().hex], expire = JOB_EXPIRE)
+
+# Messages shown as each step of upload processing starts
+UPLOAD_STEPS = {'validating': 'Checking columns and first rows...',
+                'parsing': 'Reading and validating rows...',
+                'aggregating': 'Aggregating localities...',
+                'done': 'Done.'}
+# Errors an upload can report through the URL (?upload_error=<error JSON>), each with a message (see `get_error_div`)
+UPLOAD_ERROR_KEYS = ('feature', 'mapping', 'type', 'unicode', 'other')
 
 # Initialize app/dashboard and set layout
-app = Dash(__name__, suppress_callback_exceptions=True)
+app = Dash(__name__, suppress_callback_exceptions=True, background_callback_manager = background_manager)
 server = app.server
 
 app.layout = html.Div([
-                dcc.Upload(html.Button('Upload Data',
-                                    style = {'color': 'MidnightBlue', 
-                                            'background-color': 'BlanchedAlmond', 
-                                            'border-color': 'MidnightBlue',
-                                            'font-size': '16px'}),
-                            id = 'upload-data',
-                            multiple = False
-                            ),
+                # Dataset loaded by key (?dataset=<key>), or large file upload processed (?upload=<name>)
+                dcc.Location(id = 'url', refresh = False),
+                html.Div([
+                    dcc.Upload(html.Button('Upload Data',
+                                        style = UPLOAD_BUTTON_STYLE),
+                                id = 'upload-data',
+                                multiple = False,
+                                style = {'display': 'inline-block'}
+                                ),
+                    # Adds the rows of a file to the current dataset (see `append_contents`)
+                    dcc.Upload(html.Button('Append Data',
+                                        style = {**UPLOAD_BUTTON_STYLE, 'margin-left': '10px'}),
+                                id = 'append-data',
+                                multiple = False,
+                                style = {'display': 'inline-block'}
+                                ),
+                    # Streams the file to the server (/upload) rather than through the browser memory (see assets/upload.js)
+                    html.Button('Upload Large File',
+                                id = 'stream-upload',
+                                style = {**UPLOAD_BUTTON_STYLE, 'margin-left': '10px'}),
+                    # Datasets preprocessed from the server's data directory (DASHBOARD_DATA_DIR)
+                    html.Div(dcc.Dropdown(id = 'dataset-picker',
+                                          placeholder = 'Or choose a dataset',
+                                          style = {'font-size': '16px'}),
+                             id = 'dataset-picker-div',
+                             style = {'display': 'inline-block', 'width': '300px', 'margin-left': '10px',
+                                      'vertical-align': 'middle'})
+                ]),
                 # Set up memory store with loading indicator, will revert on page refresh
                 dcc.Loading(id = 'memory-loading',
                             type = "circle",
                             color = 'DarkMagenta',
                             children = dcc.Store(id = 'memory')),
+                # File to process in a background job: a large file upload or a file from the data directory
+                dcc.Store(id = 'pending-file'),
+                # Stage of upload processing (shown while processing)
+                html.Div(id = 'upload-progress', style = {**PRINT_STYLE, 'display': 'none'}),
+                # Zoom level (integer) of the map, sets grid size for datasets with many localities
+                dcc.Store(id = 'map-zoom', data = 1),
                 html.Hr(),
                 
                 html.Div(children = [html.H3('Upload data (CSV or XLS) to see distribution statistics.', 
@@ -46,100 +114,406 @@ app.layout = html.Div([
 ])
 
 # Data read in and save to memory
-@app.callback(
-        Output('memory', 'data', allow_duplicate=True),
-        Input('upload-data', 'contents'),
-        State('upload-data', 'filename'),
-        prevent_initial_call = True
-)
-
-def parse_contents(contents, filename):
+def parse_contents(contents, filename, dataset_key = None, progress = None):
     '''
-    Reads uploaded data, checks that it meets requirements, and processes it. Returns processed data and available options in JSON.
+    Reads uploaded data, checks that it meets requirements, and processes it, once per upload:
+    concurrent requests with the same upload wait for the first to finish, then use its saved data.
+    Saves processed data on the server and returns its key and available options in JSON.
+    `contents` are from dcc.Upload, or the path of a saved upload with its `dataset_key` (hash of name and contents).
+    `progress` is an optional function called with a message as each stage of processing starts (see `report_progress`).
     '''
     if contents is None:
         raise PreventUpdate
-    content_type, content_string = contents.split(',')
-
-    decoded = base64.b64decode(content_string)
+    if dataset_key is not None:
+        saved = get_saved_options(dataset_key)
+        if saved is not None:
+            return saved
+    # Check header and first rows, so uploads missing requirements are rejected before parsing the whole file
+    report_progress(progress, 'validating')
     try:
-        if 'csv' in filename:
-            df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
-        elif 'xls' in filename:
-            df = pd.read_excel(io.BytesIO(decoded))
-        else:
-            return json.dumps({'error': {'type': 'wrong file type'}})
-    except UnicodeDecodeError as e:
-        print(e)
-        return json.dumps({'error': {'unicode': str(e)}})
-    
+        with stage('sniff_upload'):
+            header = sniff_upload(contents, filename)
     except Exception as e:
-        print(e)
-        return json.dumps({'error': {'other': str(e)}})
-    # Check for required columns
+        return get_upload_error(e)
+    if dataset_key is None:
+        dataset_key = get_upload_hash(contents, filename)
+    saved = get_saved_options(dataset_key)
+    if saved is not None:
+        return saved
+    with dataset_lock(dataset_key):
+        # Processed by another request while waiting
+        saved = get_saved_options(dataset_key)
+        if saved is not None:
+            return saved
+        return process_upload(contents, filename, dataset_key, header, progress)
+
+def report_progress(progress, step):
+    '''
+    Reports the start of a step of upload processing (one of UPLOAD_STEPS) to the `progress` function, if any.
+    '''
+    if progress is not None:
+        progress(UPLOAD_STEPS[step])
+
+def get_upload_error(e):
+    '''
+    Returns the error (for `get_error_div`) of an exception raised while reading an upload, in JSON.
+    '''
+    if isinstance(e, UploadError):
+        return json.dumps({'error': e.error})
+    print(e)
+    if isinstance(e, UnicodeDecodeError):
+        return json.dumps({'error': {'unicode': str(e)}})
+    return json.dumps({'error': {'other': str(e)}})
+
+def get_saved_options(dataset_key):
+    '''
+    Returns key and options of an already processed upload in JSON, or None if it is not saved.
+    '''
+    try:
+        meta = get_meta(dataset_key)
+    except KeyError:
+        return None
+    return get_memory_data(dataset_key, meta)
+
+def process_upload(contents, filename, dataset_key, header, progress = None):
+    '''
+    Reads uploaded data, checks that it meets requirements, and processes it.
+    Saves processed data on the server under `dataset_key` and returns its key and available options in JSON.
+    `header` is the dictionary returned by `sniff_upload` for the upload, and `progress` an optional progress function.
+    '''
+    # Read (only needed columns) and check data in chunks
     # If no lat/lon, disable Map View button
     # If no image urls, disable sample image options
-    mapping = True
-    img_urls = True
-    features = ['Species', 'Subspecies', 'View', 'Sex', 'Hybrid_stat', 'Lat', 'Lon', 'File_url']
-    included_features = []
-    df.columns = df.columns.str.capitalize()
-    for feature in features:
-        if feature not in list(df.columns):
-            if feature == 'Lat' or feature == 'Lon':
-                if feature == 'Lon':
-                    if 'Long' not in list(df.columns):
-                        mapping = False
-                    else:
-                        df = df.rename(columns = {"Long": "Lon"})
-                        included_features.append('Lon')
-                else:
-                    mapping = False
-            elif feature == 'File_url':
-                img_urls = False
-            else:
-                return json.dumps({'error': {'feature': feature}})
-        else:
-            included_features.append(feature)
-    
-    # Check for lat/lon bounds & type if columns exist
-    if mapping:
-        try:
-            # Check lat and lon within appropriate ranges (lat: [-90, 90], lon: [-180, 180])
-            valid_lat = df['Lat'].astype(float).between(-90, 90)
-            df.loc[~valid_lat, 'Lat'] = np.nan
-            valid_lon = df['Lon'].astype(float).between(-180, 180)
-            df.loc[~valid_lon, 'Lon'] = np.nan
-        except ValueError as e:
-            print(e)
-            return json.dumps({'error': {'mapping': str(e)}})
+    report_progress(progress, 'parsing')
+    try:
+        with stage('read_upload'):
+            df, included_features, mapping, img_urls = read_upload(contents, filename, header)
+    except Exception as e:
+        return get_upload_error(e)
 
     # get dataset-determined static data:
         # the dataframe and categorical features - processed for map view if mapping is True
-        # all possible species, subspecies -- must run first to avoid adding "unknown" to lists
-        # will likely include categorical options in later instance (sooner)
-    all_species = get_species_options(df)
-    processed_df, cat_list = get_data(df, mapping, included_features)
-    # save data to dictionary to save as json 
-    data = {
-            'processed_df': processed_df.to_json(date_format = 'iso', orient = 'split'),
-            'all_species': all_species,
+        # profile of all possible species, subspecies, and values of options -- must run first to avoid adding "unknown" to lists
+    report_progress(progress, 'aggregating')
+    with stage('profile'):
+        profile = get_profile(df, mapping)
+    with stage('process'):
+        processed_df, cat_list = get_data(df, mapping, included_features)
+    # save data on the server, only key and options are saved as json
+    meta = {
             'mapping': mapping,
-            'images': img_urls
-        }   
-    return json.dumps(data)
+            'images': img_urls,
+            'profile': profile,
+            'columns': header['columns']
+        }
+    with stage('save_dataset'):
+        put_dataset(dataset_key, processed_df, meta)
+    # count cube now, so the first cross-filter is quick
+    with stage('cube'):
+        get_derived(dataset_key, ('cube',), get_cube)
+    if img_urls:
+        # index image filters now, so the first image selection is quick
+        with stage('image_index'):
+            get_derived(dataset_key, ('image_index',), get_image_index)
+    report_progress(progress, 'done')
+    return get_memory_data(dataset_key, meta)
+
+def append_contents(contents, filename, base_key, progress = None):
+    '''
+    Reads uploaded rows, checks that they have the same columns as the dataset saved under `base_key`, and appends them,
+    once per upload and dataset. Appended data is saved as a new dataset (keyed by `base_key` and the upload), so data
+    derived from the original dataset stays valid, and only the localities in the upload are recounted (see `append_data`),
+    and only its rows counted into the count cube (see `append_cube`).
+    Returns key and options of the appended dataset in JSON (as `parse_contents`), or of the upload alone if there is no saved dataset.
+    '''
+    if contents is None:
+        raise PreventUpdate
+    try:
+        meta = get_meta(base_key)
+    except KeyError:
+        return parse_contents(contents, filename, progress = progress)
+    dataset_key = get_upload_hash(contents, filename, prefix = base_key)
+    saved = get_saved_options(dataset_key)
+    if saved is not None:
+        return saved
+    report_progress(progress, 'validating')
+    try:
+        with stage('sniff_upload'):
+            header = sniff_upload(contents, filename)
+        if header['columns'] != meta['columns']:
+            raise UploadError({'columns': {'expected': meta['columns'], 'found': header['columns']}})
+    except Exception as e:
+        return get_upload_error(e)
+    with dataset_lock(dataset_key):
+        saved = get_saved_options(dataset_key)
+        if saved is not None:
+            return saved
+        report_progress(progress, 'parsing')
+        try:
+            with stage('read_upload'):
+                batch, included_features, mapping, img_urls = read_upload(contents, filename, header)
+            with stage('load_dataset'):
+                df, meta = get_dataset(base_key)
+        except KeyError:
+            return json.dumps({'error': {'expired': base_key}})
+        except Exception as e:
+            return get_upload_error(e)
+        report_progress(progress, 'aggregating')
+        with stage('profile'):
+            profile = merge_profiles(meta['profile'], get_profile(batch, mapping))
+        with stage('append'):
+            processed_df, cat_list = append_data(df, batch, mapping, included_features)
+        meta = {**meta, 'profile': profile}
+        with stage('save_dataset'):
+            put_dataset(dataset_key, processed_df, meta)
+        # only the appended rows are counted into the cube of the dataset
+        with stage('cube'):
+            cube = get_derived(base_key, ('cube',), get_cube)
+            get_derived(dataset_key, ('cube',), lambda merged: append_cube(cube, merged, len(df)))
+        report_progress(progress, 'done')
+        return get_memory_data(dataset_key, meta)
+
+def get_memory_data(dataset_key, meta):
+    '''
+    Returns key and options of a processed dataset in JSON, as saved in the dashboard's memory
+    (species options for the image selector, and whether it has lat/lon and image urls).
+    '''
+    return json.dumps({'dataset_key': dataset_key,
+                       'all_species': meta['profile']['species'],
+                       'mapping': meta['mapping'],
+                       'images': meta['images']})
 
-# Callback to update processed data if new data uploaded
+# Callback to update processed data if loaded by key, or to process a large file upload or a file from the data directory
 @app.callback(
         Output('memory', 'data'),
+        Output('pending-file', 'data'),
+        Input('url', 'search'),
+        Input('dataset-picker', 'value')
+)
+@instrument_callback
+    
+def update_output(search, dataset_name):
+    if dash.callback_context.triggered_id == 'dataset-picker':
+        if dataset_name is None:
+            raise PreventUpdate
+        # Files processed before (see `load_data_files`) load from the manifest, without hashing them
+        dataset_key = get_data_file_key(dataset_name)
+        saved = None if dataset_key is None else get_saved_options(dataset_key)
+        if saved is not None:
+            return saved, dash.no_update
+        # New or changed files are hashed and processed in the background job
+        return dash.no_update, {'data_file': dataset_name}
+    return load_from_search(search)
+
+# Callback to update processed data if new data uploaded, appended, or chosen (a large file upload or a file from the data
+# directory, see `update_output`), processed in a background job reporting its progress. All of them are processed by this
+# callback, so new data of any kind while processing cancels the job (Dash stops the previous job of a background callback
+# when it is triggered again).
+@app.callback(
+        Output('memory', 'data', allow_duplicate = True),
         Input('upload-data', 'contents'),
+        Input('append-data', 'contents'),
+        Input('pending-file', 'data'),
         State('upload-data', 'filename'),
+        State('append-data', 'filename'),
+        State('memory', 'data'),
+        background = True,
+        progress = Output('upload-progress', 'children'),
+        running = [(Output('upload-progress', 'style'), {**PRINT_STYLE, 'display': 'block'}, {**PRINT_STYLE, 'display': 'none'})],
         prevent_initial_call = True
 )
-    
-def update_output(contents, filename):
-    if contents is not None:
-        return parse_contents(contents, filename)
+
+def process_data(set_progress, contents, appended, pending, filename, appended_filename, jsonified_data):
+    # Not instrumented, as it runs in the job's process (its stages are timed by the server's requests polling it)
+    triggered_id = dash.callback_context.triggered_id
+    if triggered_id == 'upload-data':
+        return parse_contents(contents, filename, progress = set_progress)
+    if triggered_id == 'append-data':
+        # Rows appended to the current dataset, or uploaded if there is none
+        data = json.loads(jsonified_data or '{}')
+        if 'dataset_key' not in data:
+            return parse_contents(appended, appended_filename, progress = set_progress)
+        return append_contents(appended, appended_filename, data['dataset_key'], progress = set_progress)
+    if pending is None:
+        raise PreventUpdate
+    if 'upload' in pending:
+        return load_upload(pending['upload'], progress = set_progress)
+    return load_data_file(pending['data_file'], progress = set_progress)
+
+def load_upload(name, progress = None):
+    '''
+    Returns key and options of a file uploaded to /upload in JSON, processing it (see `parse_contents`) and removing it.
+    '''
+    try:
+        path, dataset_key = get_stored_upload(UPLOAD_DIR, name)
+    except KeyError:
+        # Already processed (eg., the page was opened twice)
+        dataset_key = name.partition('-')[0]
+        return get_saved_options(dataset_key) or json.dumps({'error': {'expired': dataset_key}})
+    try:
+        return parse_contents(path, name, dataset_key, progress)
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def load_data_file(name, progress = None):
+    '''
+    Returns key and options of a dataset from the data directory in JSON, processing the file if it is new or changed.
+    The dataset is pinned, so it is kept in the dataset cache directory (see `pin_dataset`).
+    '''
+    try:
+        path, dataset_key = get_data_file(name)
+    except (KeyError, OSError):
+        return json.dumps({'error': {'other': f'{name} is no longer in the data directory.'}})
+    pin_dataset(dataset_key)
+    return parse_contents(path, name, dataset_key, progress)
+
+def load_data_files():
+    '''
+    Processes the files in the data directory that are new or changed, so they load without hashing or parsing when
+    chosen, and pins their datasets, unpinning those of files since changed or removed. Run once before the server
+    starts (see run.sh).
+
+    Returns:
+    --------
+    failed - Dictionary of the names of files that could not be loaded -> their upload error dictionary.
+
+    '''
+    keys = []
+    failed = {}
+    for name in list_data_files():
+        output = json.loads(load_data_file(name))
+        if 'error' in output:
+            failed[name] = output['error']
+            print(f'Could not load {name} from the data directory: {output["error"]}', file = sys.stderr)
+        else:
+            keys.append(output['dataset_key'])
+    set_pinned_datasets(keys)
+    return failed
+
+@app.callback(
+        Output('dataset-picker', 'options'),
+        Output('dataset-picker-div', 'style'),
+        Input('url', 'pathname'),
+        State('dataset-picker-div', 'style')
+)
+@instrument_callback
+
+def set_dataset_options(pathname, style):
+    '''
+    Lists the files in the data directory as dataset options when the page loads, hiding the picker if there are none.
+    '''
+    names = list_data_files()
+    style = {**style, 'display': 'inline-block' if names else 'none'}
+    return [{'label': name, 'value': name} for name in names], style
+
+def get_search_error(value):
+    '''
+    Returns the upload error dictionary (for `get_error_div`) given in JSON in the URL query (`?upload_error=<error JSON>`).
+    The URL can be edited, so anything other than one known error with a message is reported as a failed upload.
+    '''
+    try:
+        error = json.loads(value)
+    except ValueError:
+        error = None
+    if isinstance(error, dict) and len(error) == 1:
+        key, message = next(iter(error.items()))
+        if key in UPLOAD_ERROR_KEYS and isinstance(message, str):
+            return error
+    return {'other': 'The upload failed.'}
+
+def load_from_search(search):
+    '''
+    Returns key and options of the dataset given in the URL query (`?dataset=<key>`) in JSON, or the upload error
+    given in it (`?upload_error=<error JSON>`), and the file to process, if any: a large file upload
+    (`?upload=<name>`, see `upload_file`) not processed yet. Prevents update if none is given.
+    '''
+    query = parse_qs((search or '').lstrip('?'))
+    if 'upload_error' in query:
+        return json.dumps({'error': get_search_error(query['upload_error'][0])}), dash.no_update
+    if 'upload' in query:
+        name = query['upload'][0]
+        saved = get_saved_options(name.partition('-')[0])
+        if saved is not None:
+            return saved, dash.no_update
+        return dash.no_update, {'upload': name}
+    if 'dataset' not in query:
+        raise PreventUpdate
+    saved = get_saved_options(query['dataset'][0])
+    if saved is None:
+        return json.dumps({'error': {'expired': query['dataset'][0]}}), dash.no_update
+    return saved, dash.no_update
+
+def load_dataset(jsonified_data):
+    '''
+    Loads saved data and the processed DataFrame it refers to from the server.
+    Prevents callback update if the DataFrame is no longer available.
+    '''
+    data = json.loads(jsonified_data)
+    try:
+        with stage('load_dataset'):
+            dff, meta = get_dataset(data['dataset_key'])
+    except KeyError:
+        raise PreventUpdate
+    return data, dff
+
+def load_figure(data, name, build):
+    '''
+    Loads figure of the saved data for the given plot and options (see `get_figure`), built once per dataset and options.
+    Prevents callback update if the DataFrame is no longer available.
+    '''
+    def build_figure(dff):
+        with stage('build_figure'):
+            return build(dff)
+    try:
+        with stage('load_figure'):
+            return get_figure(data['dataset_key'], name, build_figure)
+    except KeyError:
+        raise PreventUpdate
+
+def load_counts(data, columns, filters = None):
+    '''
+    Loads count table of the given columns for the saved data, counted once per dataset.
+    With `filters` (dictionary of the value to keep of any CUBE_COLUMNS), counts only the matching rows, summed from the count cube.
+    '''
+    if filters:
+        return get_cube_counts(load_cube(data), columns, filters)
+    return get_derived(data['dataset_key'], ('counts',) + tuple(columns), lambda df: get_counts(df, columns))
+
+def load_cube(data):
+    '''
+    Loads count cube (see `get_cube`) of the saved data, counted once per dataset.
+    '''
+    return get_derived(data['dataset_key'], ('cube',), get_cube)
+
+def get_other_filters(cross_filter, column):
+    '''
+    Returns the cross-filter of a chart of `column`: the values clicked in other charts (a chart is not filtered by its own clicks).
+    '''
+    return {col: value for col, value in (cross_filter or {}).items() if col != column}
+
+def get_filters_name(filters):
+    '''
+    Returns the part of a figure's cache name for its cross-filter (empty if not filtered, so unfiltered figures keep their names).
+    '''
+    return (json.dumps(filters, sort_keys = True),) if filters else ()
+
+def load_locality_counts(data, color_by):
+    '''
+    Loads map counts of each locality and `color_by` value for the saved data, counted once per dataset.
+    '''
+    return get_derived(data['dataset_key'], ('locality_counts', color_by), lambda df: get_locality_counts(df, color_by))
+
+def load_gallery_rows(data, selection, seed, filters = None):
+    '''
+    Loads the rows with images matching the selection (subspecies, view, sex, hybrid) and cross-filter in the seeded order
+    of a gallery, shuffled once per dataset, selection, and seed. Raises ValueError if no images match the selection.
+    '''
+    index = get_derived(data['dataset_key'], ('image_index',), get_image_index)
+    return get_derived(data['dataset_key'], ('gallery', json.dumps(selection), seed) + get_filters_name(filters),
+                       lambda df: get_gallery_rows(df, *selection, seed, index, filters))
 
 # Callback to get main div (histogram, pie chart, and image example options)
 @app.callback(
@@ -147,6 +521,7 @@ def update_output(contents, filename):
         Input('memory', 'data'),
         prevent_initial_call = True
 )
+@instrument_callback
 
 def get_visuals(jsonified_data):
     '''
@@ -157,48 +532,29 @@ def get_visuals(jsonified_data):
     data = json.loads(jsonified_data)
     if 'error' in data:
         return get_error_div(data['error'])
-    dff = pd.read_json(io.StringIO(data['processed_df']), orient = 'split')
+    try:
+        meta = get_meta(data['dataset_key'])
+    except KeyError:
+        return get_error_div({'expired': data['dataset_key']})
 
-    # get divs
+    # get divs (from the dataset's profile, without loading its rows)
     hist_div = get_hist_div(data['mapping'])
-    img_div = get_img_div(dff, data['all_species'], data['images'])
+    img_div = get_img_div(meta['profile'], data['images'])
     children = get_main_div(hist_div, img_div)
 
     return children
 
 # Distribution Section
-# Callback to update which options are visible (histogram vs map)
-@app.callback(
+# Callback to update which options are visible (histogram vs map), swapping the layouts saved in the page
+# (as the button's label changes, the options are updated before the figure)
+app.clientside_callback(
+        ClientsideFunction(namespace = 'dashboard', function_name = 'update_dist_view'),
         Output('dist-options', 'children'),
         Input('dist-view-btn', 'n_clicks'),
         Input('dist-view-btn', 'children'),
-        Input('memory', 'data')
+        State('dist-layouts', 'data')
 )
 
-def update_dist_view(n_clicks, children, jsonified_data):
-    '''
-    Updates the upper left distribution options based on selected distribution chart (histogram or map).
-    Activates on click to change, defaults to histogram view.
-
-    Parameters:
-    -----------
-    n_clicks - Number of clicks. 
-    children - Label on button, determins which distribution options to show.
-    jsonified_data - Saved dictionary of DataFrame, species options, and mapping (boolean on lat/lon availability).
-
-    Returns:
-    --------
-    hist_div or map_div - The HTML Div corresponding to the selected distribution figure.
-    '''
-    data = json.loads(jsonified_data)
-    if n_clicks == 0 or n_clicks == None:
-        return get_hist_div(data['mapping'])
-    if n_clicks > 0:
-        if children == "Show Histogram":
-            return get_hist_div(data['mapping'])
-        else:
-            return get_map_div()
-
 # Callback to update the distribution figure (histogram or map)
 @app.callback(
     #dist output
@@ -212,10 +568,15 @@ def update_dist_view(n_clicks, children, jsonified_data):
     #button information
     Input(component_id='dist-view-btn', component_property='children'),
     # Saved Data
-    Input('memory', 'data')
+    Input('memory', 'data'),
+    # map zoom (sets grid size for large datasets)
+    Input('map-zoom', 'data'),
+    # values clicked in the charts
+    Input('cross-filter', 'data')
 )
+@instrument_callback
 
-def update_dist_plot(x_var, color_by, sort_by, btn, jsonified_data):
+def update_dist_plot(x_var, color_by, sort_by, btn, jsonified_data, zoom = 1, cross_filter = None):
     '''
     Updates distribution figure with either map or histogram based on selections.
     Selection is based on current label of the button ('Map View' or 'Show Histogram'), which updates prior to graph.
@@ -226,20 +587,85 @@ def update_dist_plot(x_var, color_by, sort_by, btn, jsonified_data):
     color_by - User-selected property to color the plot by.
     sort_by - User-selected ordering of bar charts (Alphabetical, Ascending, or Descending).
     btn - Current label of the button ('Map View' or 'Show Histogram').
-    jsonified_data - Saved dictionary of DataFrame, species options, and mapping (boolean on lat/lon availability).
+    jsonified_data - Saved dictionary of DataFrame key, species options, and mapping (boolean on lat/lon availability).
+    zoom - Zoom level of the map (sets grid size when localities are combined).
+    cross_filter - Dictionary of the values clicked in the histogram or pie chart (the histogram is filtered to those of other variables).
 
     Returns: 
     --------
     fig -  Figure returned from appropriate function call: histogram or map of the distribution of the requested variable.
+           Only the x-axis order is sent (as a Patch of the shown histogram) when only the sort order changed.
     '''
-    # open dataframe from saved data
     data = json.loads(jsonified_data)
-    dff = pd.read_json(io.StringIO(data['processed_df']), orient = 'split')
+    changed = get_changed_props()
     # get distribution graph based on button value
     if btn == "Show Histogram":
-        return make_map(dff, color_by)
-    else:
-        return make_hist_plot(dff, x_var, color_by, sort_by)
+        # the map is not cross-filtered
+        if changed == {'cross-filter.data'}:
+            raise PreventUpdate
+        return load_figure(data, ('map', color_by, zoom),
+                           lambda dff: make_map(dff, color_by, zoom = zoom, counts = load_locality_counts(data, color_by)))
+    filters = get_other_filters(cross_filter, x_var)
+    if changed == {'sort-by.value'}:
+        return get_sort_patch(data, x_var, color_by, sort_by, filters)
+    return load_figure(data, ('hist', x_var, color_by, sort_by) + get_filters_name(filters),
+                       lambda dff: make_hist_plot(dff, x_var, color_by, sort_by, counts = load_counts(data, [x_var, color_by], filters)))
+
+def get_changed_props():
+    '''
+    Returns the set of properties (eg., 'sort-by.value') that triggered the current callback (empty if not called as a callback).
+    '''
+    try:
+        return set(dash.callback_context.triggered_prop_ids)
+    except MissingCallbackContextException:
+        return set()
+
+def get_sort_patch(data, x_var, color_by, sort_by, filters = None):
+    '''
+    Returns Patch of the shown histogram reordering its bars (see `make_hist_plot`), sorted from its count table
+    (of the rows matching `filters`, if given).
+    '''
+    try:
+        counts = load_counts(data, [x_var, color_by], filters)
+    except KeyError:
+        raise PreventUpdate
+    with stage('sort_patch'):
+        counts, x_order = sort_counts(counts, x_var, sort_by)
+        patch = Patch()
+        # Unset categoryorder to order by categoryarray
+        xaxis = {'categoryorder': None, **get_hist_xaxis(x_order, sort_by)}
+        for prop, value in xaxis.items():
+            patch['layout']['xaxis'][prop] = value
+    return patch
+
+@app.callback(
+    Output('map-zoom', 'data'),
+    Input(component_id='dist-plot', component_property='relayoutData'),
+    State('map-zoom', 'data'),
+    State('memory', 'data'),
+    prevent_initial_call = True
+)
+@instrument_callback
+
+def update_map_zoom(relayout_data, zoom, jsonified_data):
+    '''
+    Records the map's (integer) zoom level when it changes, only for datasets with localities combined into grid cells,
+    so the map is redrawn with a finer (or coarser) grid. Panning and histogram changes do not update.
+    '''
+    if not relayout_data or 'mapbox.zoom' not in relayout_data:
+        raise PreventUpdate
+    new_zoom = int(relayout_data['mapbox.zoom'])
+    if new_zoom == zoom:
+        raise PreventUpdate
+    data = json.loads(jsonified_data)
+    color_by = 'Species' # number of localities does not depend on color
+    try:
+        num_sites = load_locality_counts(data, color_by)['lat-lon'].nunique()
+    except KeyError:
+        raise PreventUpdate
+    if get_grid_size(num_sites, new_zoom) is None:
+        raise PreventUpdate
+    return new_zoom
 
 # Pie Section
 
@@ -249,65 +675,108 @@ def update_dist_plot(x_var, color_by, sort_by, btn, jsonified_data):
     #pie input (var)
     Input(component_id='prct-brkdwn', component_property='value'),
     # Saved Data
-    Input('memory', 'data')
+    Input('memory', 'data'),
+    # values clicked in the charts
+    Input('cross-filter', 'data')
 )
+@instrument_callback
 
-def update_pie_plot(var, jsonified_data):
+def update_pie_plot(var, jsonified_data, cross_filter = None):
     '''
     Updates the pie chart of dataset specimens based on user selection of variable to color by.
 
     Parameters:
     -----------
     var - User-selected categorical variable by which to color.
-    jsonified_data - Saved dictionary of DataFrame, species options, and mapping (boolean on lat/lon availability).
+    jsonified_data - Saved dictionary of DataFrame key, species options, and mapping (boolean on lat/lon availability).
+    cross_filter - Dictionary of the values clicked in the histogram or pie chart (the pie chart is filtered to those of other variables).
 
     Returns: 
     --------
     fig - Pie chart figure returned from function call: percentage breakdown of `var` samples in the dataset.
     '''
-    # open dataframe from saved data
     data = json.loads(jsonified_data)
-    dff = pd.read_json(io.StringIO(data['processed_df']), orient = 'split')
-    return make_pie_plot(dff, var)
+    filters = get_other_filters(cross_filter, var)
+    return load_figure(data, ('pie', var) + get_filters_name(filters),
+                       lambda dff: make_pie_plot(dff, var, counts = load_counts(data, get_pie_columns(var), filters)))
+
+# Callback to update the cross-filter when a histogram bar or pie slice is clicked (or the filter is cleared)
+app.clientside_callback(
+    ClientsideFunction(namespace = 'dashboard', function_name = 'update_cross_filter'),
+    Output('cross-filter', 'data'),
+    Output('cross-filter-info', 'children'),
+    Output('cross-filter-div', 'style'),
+    Input('dist-plot', 'clickData'),
+    Input('pie-plot', 'clickData'),
+    Input('clear-filter', 'n_clicks'),
+    State('x-variable', 'value'),
+    State('prct-brkdwn', 'value'),
+    State('dist-view-btn', 'children'),
+    State('cross-filter', 'data'),
+    prevent_initial_call = True
+)
 
 # Image Section
 
-# Callback for Image Species Selection
-@app.callback(
+# Callback for Image Species Selection (subspecies options of the selected species, from the saved species options)
+app.clientside_callback(
+    ClientsideFunction(namespace = 'dashboard', function_name = 'set_subspecies_options'),
     Output(component_id = 'subspecies-show', component_property= 'options'),
     Input(component_id = 'species-show', component_property = 'value'),
     Input('memory', 'data')
 )
 
-def set_subspecies_options(selected_species, jsonified_data):
-    ''' 
-    Sets subspecies options in dropdown based on user-selected species.
+# Callback for Image Subspecies Selection
+app.clientside_callback(
+    ClientsideFunction(namespace = 'dashboard', function_name = 'set_subspecies_value'),
+    Output(component_id = 'subspecies-show', component_property= 'value'),
+    Input(component_id = 'subspecies-show', component_property = 'options')
+)
+
+# Callback for the image filter options: number of specimens with each value (matching the cross-filter)
+@app.callback(
+    Output('which-sex', 'options'),
+    Output('which-view', 'options'),
+    Output('hybrid?', 'options'),
+    Input('cross-filter', 'data'),
+    State('memory', 'data')
+)
+@instrument_callback
+
+def update_image_options(cross_filter, jsonified_data):
+    '''
+    Labels the options of the image filters (sex, view, and hybrid status) with their number of specimens matching the
+    cross-filter, from the count cube (or the dataset's profile, if not filtered). Options with none are disabled.
 
     Parameters:
     -----------
-    jsonified_data - Saved dictionary of DataFrame, species options, and mapping (boolean on lat/lon availability).
+    cross_filter - Dictionary of the values clicked in the histogram or pie chart.
+    jsonified_data - Saved dictionary of DataFrame key, species options, and mapping (boolean on lat/lon availability).
 
-    Returns: 
+    Returns:
     --------
-    list of subspecies options based on user-selected species. 
+    Options of the 'which-sex', 'which-view', and 'hybrid?' checklists.
     '''
     data = json.loads(jsonified_data)
-    all_species = data['all_species']
-    return [{'label': i, 'value': i} for i in all_species[selected_species]]
-
-# Callback for Image Subspecies Selection
-@app.callback(
-    Output(component_id = 'subspecies-show', component_property= 'value'),
-    Input(component_id = 'subspecies-show', component_property = 'options')
-)
-
-def set_subspecies_value(available_options):
-    # Collect selected subspecies to display in multi-select dropdown.
-    return available_options[0]['value']
+    try:
+        profile = get_meta(data['dataset_key'])['profile']
+    except KeyError:
+        raise PreventUpdate
+    options = []
+    for col in ['Sex', 'View', 'Hybrid_stat']:
+        values = profile['vocabularies'][col]
+        if cross_filter:
+            counts = load_counts(data, [col], cross_filter)
+            counts = dict(zip(counts[col], counts['count']))
+        else:
+            counts = dict(zip(values, profile['counts'][col]))
+        options.append([{'label': f'{value} ({counts.get(value, 0):,})', 'value': value, 'disabled': counts.get(value, 0) == 0}
+                        for value in values])
+    return options
 
 # Image & Display Images Button Callback
 @app.callback(
-    Output('image-1', 'children'),
+    Output('image-gallery', 'data'),
     Input('display-img', 'n_clicks'),
     Input('memory', 'data'),
     State('subspecies-show', 'value'),
@@ -315,40 +784,171 @@ def set_subspecies_value(available_options):
     State('which-sex', 'value'),
     State('hybrid?', 'value'),
     State('num-images', 'value'),
+    State('cross-filter', 'data'),
     prevent_initial_call = True
 )
+@instrument_callback
 
-# Retrieve selected number of images
-def update_display(n_clicks, jsonified_data, subspecies, view, sex, hybrid, num_images):
+# Start a gallery of the selected images
+def update_display(n_clicks, jsonified_data, subspecies, view, sex, hybrid, num_images, cross_filter = None):
     '''
-    Retrieves the user-selected number of images adhering to their chosen parameters when the 'Display Images' button is pressed.
+    Starts a new gallery of images adhering to the user's chosen parameters when the 'Display Images' button is pressed.
+    The matching images are shuffled (with a new seed) once, then shown a page at a time (see `update_gallery`).
     
     Parameters:
     -----------
     n_clicks - Number of times the 'Display Images' button has been pressed.
-    jsonified_data - Saved dictionary of DataFrame, species options, and mapping (boolean on lat/lon availability).
+    jsonified_data - Saved dictionary of DataFrame key, species options, and mapping (boolean on lat/lon availability).
     subspecies - String. Subspecies of specimen selected by the user.
     view - String. View of specimen selected by the user.
     sex - String. Sex of specimen selected by the user.
     hybrid - String. Hybrid status of specimen selected by the user.
-    num_images - Integer. Number of images requested by the user. Default value is 1 (in get_filename).
+    num_images - Integer. Number of images per page requested by the user. Default value is 1.
+    cross_filter - Dictionary of the values clicked in the histogram or pie chart, which the images are also filtered to.
     
     Returns:
     --------
-    Imgs - (Return of function call) List of html image elements with `src` element pointing to paths for the requested number of images matching given parameters.
-           Returns html header4 "No Such Images. Please make another selection." if no images matching parameters exist.
-           Returns html header4 "Please make a selection." If number of images isn't specified.
+    gallery - Dictionary of the gallery's 'selection', 'filters' (cross-filter), 'seed', 'cursor' (first image of the page shown),
+              'page_size', and 'total' number of images.
+              Has only a 'message' "No Such Images. Please make another selection." if no images matching parameters exist,
+              or "Please make a selection." if number of images isn't specified.
     '''
     if n_clicks > 0 and (view != [] and sex != [] and hybrid != []):
-        # Unpack json for saved dataframe
-        data = json.loads(jsonified_data)
-        dff = pd.read_json(io.StringIO(data['processed_df']), orient = 'split')
-        return get_images(dff, subspecies, view, sex, hybrid, num_images)
+        data, dff = load_dataset(jsonified_data)
+        selection = [subspecies, view, sex, hybrid]
+        seed = random.getrandbits(32)
+        filters = cross_filter or {}
+        try:
+            rows = load_gallery_rows(data, selection, seed, filters)
+        except ValueError as e:
+            return {'message': str(e) + " Please make another selection."}
+        return {'selection': selection, 'filters': filters, 'seed': seed, 'cursor': 0, 'page_size': num_images or 1, 'total': len(rows)}
     elif n_clicks == 0:
         return dash.no_update
     else:
-        return html.H4("Please make a selection.", 
-                    style = {'color': 'MidnightBlue'})
+        return {'message': "Please make a selection."}
+
+# Move the gallery's cursor to the previous or next page
+app.clientside_callback(
+    ClientsideFunction(namespace = 'dashboard', function_name = 'change_image_page'),
+    Output('image-gallery', 'data', allow_duplicate = True),
+    Input('prev-images', 'n_clicks'),
+    Input('next-images', 'n_clicks'),
+    State('image-gallery', 'data'),
+    prevent_initial_call = True
+)
+
+@app.callback(
+    Output('image-1', 'children'),
+    Output('image-pager', 'style'),
+    Output('image-page-info', 'children'),
+    Input('image-gallery', 'data'),
+    State('memory', 'data'),
+    prevent_initial_call = True
+)
+@instrument_callback
+
+# Display a page of the gallery
+def update_gallery(gallery, jsonified_data):
+    '''
+    Displays the current page of images of the gallery (or its message), read from the gallery's saved order of images.
+
+    Parameters:
+    -----------
+    gallery - Dictionary of the gallery returned by `update_display`.
+    jsonified_data - Saved dictionary of DataFrame key, species options, and mapping (boolean on lat/lon availability).
+
+    Returns:
+    --------
+    Imgs - List of (lazily loaded) html image elements of the page's images, or html header4 of the gallery's message.
+    pager_style - Style of the previous/next page buttons, hidden when there is only one page.
+    page_info - Range of images shown (eg., "Images 21-40 of 345").
+    '''
+    if 'message' in gallery:
+        return html.H4(gallery['message'], style = {'color': 'MidnightBlue'}), {'display': 'none'}, ''
+    data, dff = load_dataset(jsonified_data)
+    try:
+        rows = load_gallery_rows(data, gallery['selection'], gallery['seed'], gallery.get('filters'))
+    except ValueError:
+        raise PreventUpdate
+    cursor, page_size, total = gallery['cursor'], gallery['page_size'], gallery['total']
+    Imgs = get_gallery_page(dff, rows, cursor, page_size)
+    pager_style = {'display': 'block' if total > page_size else 'none', 'textAlign': 'center'}
+    return Imgs, pager_style, f"Images {cursor + 1}-{min(cursor + page_size, total)} of {total}"
+
+def get_cache_gauges():
+    '''
+    Returns cache counters of this server process as gauges for the metrics endpoint.
+    '''
+    stats = get_cache_stats()
+    return {f'dashboard_cache_{counter}': [({'cache': cache}, cache_stats[counter]) for cache, cache_stats in stats.items()]
+            for counter in ['hits', 'misses', 'evictions', 'entries', 'size']}
+
+init_metrics(server, gauges = get_cache_gauges)
+
+def get_upload_file(total_content_length, content_type, filename, content_length = None):
+    '''
+    Returns the temporary file a file in uploaded form data is written to (stream factory of werkzeug's form parser).
+    '''
+    return UploadFile(UPLOAD_DIR, filename or '')
+
+@server.route('/upload', methods = ['POST'])
+def upload_file():
+    '''
+    Receives a file uploaded as multipart form data ('file' field). The form parser writes the file straight to a temporary
+    file, hashed as it is written (see `UploadFile`). Returns the dataset key and available options in JSON, as saved in the
+    dashboard's memory, if the file was processed before; otherwise the file is kept, to be processed in a background job
+    when the dashboard loads it (`?upload=<name>`), and its name is returned ({'upload': name}, status 202).
+    '''
+    remove_stale_uploads(UPLOAD_DIR)
+    _, _, files = parse_form_data(request.environ, stream_factory = get_upload_file)
+    uploads = [file.stream for _, file in files.items(multi = True)]
+    for upload in uploads:
+        upload.close()
+    try:
+        file = files.get('file')
+        if file is None or not file.filename:
+            return Response(json.dumps({'error': {'other': 'No file uploaded.'}}), status = 400, mimetype = 'application/json')
+        dataset_key = file.stream.hexdigest()
+        saved = get_saved_options(dataset_key)
+        if saved is not None:
+            return Response(saved, mimetype = 'application/json')
+        name = store_upload(file.stream.path, dataset_key)
+        uploads.remove(file.stream)
+        return Response(json.dumps({'upload': name}), status = 202, mimetype = 'application/json')
+    finally:
+        for upload in uploads:
+            os.remove(upload.path)
+
+@server.route('/thumbnail/<int:width>/<path:file_url>')
+def thumbnail(width, file_url):
+    '''
+    Serves thumbnail (resized to one of THUMBNAIL_WIDTHS) of a local image, from the thumbnail cache.
+    '''
+    path = get_image_path(file_url)
+    if path is None or width not in THUMBNAIL_WIDTHS:
+        abort(404)
+    thumbnail_path, etag = get_thumbnail(path, width)
+    return send_file(thumbnail_path, etag = etag, max_age = IMAGE_MAX_AGE, conditional = True)
+
+@server.route('/image/<path:file_url>')
+def image(file_url):
+    '''
+    Serves full size local image.
+    '''
+    path = get_image_path(file_url)
+    if path is None:
+        abort(404)
+    return send_file(path, etag = get_image_etag(path), max_age = IMAGE_MAX_AGE, conditional = True)
+
+@server.route('/cache-stats')
+def cache_stats():
+    '''
+    Reports hit, miss, and eviction counts and sizes of this server process's dataset, derived data, and figure caches.
+    '''
+    return get_cache_stats()
 
 if __name__ == '__main__':
+    if load_data_files():
+        sys.exit('Some files in the data directory could not be loaded, see above.')
     app.run()
@@ -1,2 +1,8 @@
 #!/bin/bash
+# Process the data directory (DASHBOARD_DATA_DIR) once, before the workers start.
+# Files that cannot be loaded are listed and stop the server from starting, rather than silently missing from the dropdown.
+python -c 'import sys; from dashboard import load_data_files; sys.exit(bool(load_data_files()))' || {
+    echo 'Could not load all files in the data directory (DASHBOARD_DATA_DIR), see above; not starting the server.' >&2
+    exit 1
+}
 gunicorn -w ${BACKEND_WORKERS:=4} -b :5000 -t 360 dashboard:server
@@ -0,0 +1,95 @@
+import pandas as pd
+import numpy as np
+from pandas.api.types import union_categoricals
+from components.aggregate import get_counts, get_cube, append_cube, get_cube_counts, sort_counts, get_locality_counts, bin_locality_counts, rasterize_locality_counts
+
+df = pd.DataFrame({'Subspecies': ['nanna', 'erato', 'nanna', 'guarica', 'erato', 'nanna'],
+                   'View': ['dorsal', 'dorsal', 'ventral', 'dorsal', 'dorsal', 'dorsal']}).astype('category')
+
+def test_get_counts():
+    counts = get_counts(df, ['Subspecies', 'View'])
+    # One row per observed pair, in order of first appearance
+    assert counts['Subspecies'].tolist() == ['nanna', 'erato', 'nanna', 'guarica']
+    assert counts['View'].tolist() == ['dorsal', 'dorsal', 'ventral', 'dorsal']
+    assert counts['count'].tolist() == [2, 2, 1, 1]
+
+    # Repeated columns are counted once
+    assert get_counts(df, ['View', 'View'])['count'].tolist() == [5, 1]
+
+def test_get_cube_counts():
+    cube = get_cube(df)
+    assert cube['count'].sum() == len(df)
+    # Same as counting the (filtered) rows
+    for columns in [['Subspecies'], ['View', 'Subspecies']]:
+        assert get_cube_counts(cube, columns).equals(get_counts(df, columns))
+    counts = get_cube_counts(cube, ['Subspecies'], {'View': 'dorsal'})
+    assert counts['Subspecies'].tolist() == ['nanna', 'erato', 'guarica']
+    assert counts['count'].tolist() == [2, 2, 1]
+    assert get_cube_counts(cube, ['View'], {'View': 'lateral'})['count'].tolist() == []
+
+def test_append_cube():
+    batch = pd.DataFrame({'Subspecies': ['nanna', 'plesseni', 'erato'],
+                          'View': ['ventral', 'dorsal', 'lateral']}).astype('category')
+    # Categories of `df` come first (as in `append_data`)
+    appended = pd.DataFrame({col: union_categoricals([df[col], batch[col]]) for col in df.columns})
+    cube = append_cube(get_cube(df), appended, len(df))
+    # Same as counting all the rows
+    pd.testing.assert_frame_equal(cube, get_cube(appended))
+
+def test_sort_counts():
+    counts = get_counts(df, ['Subspecies', 'View'])
+    sorted_counts, x_order = sort_counts(counts, 'Subspecies', 'alpha')
+    assert x_order == ['erato', 'guarica', 'nanna']
+    assert sorted_counts['Subspecies'].tolist() == ['erato', 'guarica', 'nanna', 'nanna']
+
+    sorted_counts, x_order = sort_counts(counts, 'Subspecies', 'sum ascending')
+    assert x_order == ['guarica', 'erato', 'nanna']
+
+    sorted_counts, x_order = sort_counts(counts, 'Subspecies', 'sum descending')
+    assert x_order == ['nanna', 'erato', 'guarica']
+
+locality_df = pd.DataFrame({'Species': ['erato', 'erato', 'melpomene', 'erato', 'melpomene'],
+                            'Lat': [1.0, 1.0, 1.0, 1.5, 'unknown'],
+                            'Lon': [2.0, 2.0, 2.0, 2.5, 3.0]})
+locality_df['lat-lon'] = (locality_df['Lat'].astype(str) + '|' + locality_df['Lon'].astype(str)).astype('category')
+locality_df['Samples_at_locality'] = [3, 3, 3, 1, 1]
+locality_df['Species_at_locality'] = ['erato, melpomene', 'erato, melpomene', 'erato, melpomene', 'erato', 'melpomene']
+locality_df['Subspecies_at_locality'] = 'unknown'
+
+def test_get_locality_counts():
+    counts = get_locality_counts(locality_df, 'Species')
+    # One row per (lat-lon, Species) pair, without unknown lat/lon
+    assert counts['lat-lon'].tolist() == ['1.0|2.0', '1.0|2.0', '1.5|2.5']
+    assert counts['Species'].tolist() == ['erato', 'melpomene', 'erato']
+    assert counts['count'].tolist() == [2, 1, 1]
+    assert counts['Samples_at_locality'].tolist() == [3, 3, 1]
+    assert counts['Lat'].dtype == float
+
+def test_bin_locality_counts():
+    counts = get_locality_counts(locality_df, 'Species')
+    binned = bin_locality_counts(counts, 'Species', 10)
+    # Both localities fall in the same cell
+    erato = binned.loc[binned['Species'] == 'erato'].iloc[0]
+    assert erato['count'] == 3
+    assert erato['Localities'] == 2
+    assert erato['Samples_in_area'] == 4
+    # Position is the count-weighted mean
+    assert erato['Lat'] == (1.0 * 2 + 1.5) / 3
+    assert binned['count'].sum() == counts['count'].sum()
+
+    # Small cells keep localities apart
+    assert len(bin_locality_counts(counts, 'Species', 0.1)) == len(counts)
+
+def test_rasterize_locality_counts():
+    counts = get_locality_counts(locality_df, 'Species')
+    raster = rasterize_locality_counts(counts, 'Species', 4)
+    assert raster['totals'].sum() == counts['count'].sum()
+    assert raster['categories'] == ['erato', 'melpomene']
+    west, south, east, north = raster['bounds']
+    assert (west, east) == (2.0, 2.5)
+    assert abs(south - 1.0) < 1e-9 and abs(north - 1.5) < 1e-9
+    # Southwest locality (2 erato, 1 melpomene) in the bottom left pixel, northeast (1 erato) in the top right
+    assert raster['totals'][-1, 0] == 3 and raster['dominant'][-1, 0] == 0
+    assert raster['totals'][0, -1] == 1 and raster['dominant'][0, -1] == 0
+    assert (raster['dominant'] == -1).sum() == raster['totals'].size - 2
+    assert np.all(raster['totals'][raster['dominant'] == -1] == 0)
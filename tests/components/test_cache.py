@@ -0,0 +1,163 @@
+import hashlib
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+import plotly.express as px
+import components.cache
+from components.cache import (LRUCache, get_dataset, get_meta, get_dataset_path, get_derived, get_figure,
+                              get_cache_stats, put_dataset, pin_dataset, set_pinned_datasets, dataset_lock, get_lock_path)
+
+# Datasets are saved under hashes of their uploads
+TEST_DATASET_CACHE, TEST_ROUNDTRIP, TEST_APPENDED, TEST_PRUNE, TEST_PINNED, TEST_GET_DERIVED, TEST_GET_FIGURE = (
+    hashlib.sha256(name.encode()).hexdigest()
+    for name in ['test_dataset_cache', 'test_roundtrip', 'test_appended', 'test_prune', 'test_pinned', 'test_get_derived', 'test_get_figure'])
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(max_size = 3, sizeof = len)
+    cache.put('a', 'x')
+    cache.put('b', 'xx')
+    # Access 'a' so 'b' is least recently used
+    assert cache.get('a') == 'x'
+    cache.put('c', 'xx')
+    assert 'b' not in cache
+    assert cache.get('a') == 'x'
+    assert cache.get('c') == 'xx'
+    assert cache.get('b') is None
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1, 'entries': 2, 'size': 3}
+
+    # Values larger than the cache are not saved
+    cache.put('d', 'xxxx')
+    assert 'd' not in cache
+    assert cache.size == 3
+
+
+def test_dataset_cache():
+    df = pd.DataFrame({'Species': ['melpomene', 'erato']})
+    meta = {'all_species': {}, 'mapping': False, 'images': False}
+    put_dataset(TEST_DATASET_CACHE, df, meta)
+    cached_df, cached_meta = get_dataset(TEST_DATASET_CACHE)
+    # The saved dataset is kept (not a private copy of `df`)
+    assert cached_df is not df
+    assert cached_df['Species'].tolist() == df['Species'].tolist()
+    assert cached_meta == meta
+    assert get_dataset(TEST_DATASET_CACHE)[0] is cached_df
+
+    with pytest.raises(KeyError):
+        get_dataset('missing')
+
+
+def test_dataset_file_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setattr('components.cache.DATASET_CACHE_DIR', str(tmp_path))
+    df = pd.DataFrame({'Species': ['melpomene', 'erato', 'erato'],
+                       'Lat': [10.75, 'unknown', -1.5],
+                       'Samples_at_locality': [1, 2, 2]})
+    meta = {'all_species': {'erato': ['Any-erato']}, 'mapping': True, 'images': False}
+    put_dataset(TEST_ROUNDTRIP, df, meta)
+    assert os.path.exists(get_dataset_path(TEST_ROUNDTRIP))
+
+    # Load as another worker would (nothing in memory)
+    monkeypatch.setattr('components.cache.dataset_cache', LRUCache(max_size = 2**20))
+    # Metadata is read without loading the rows
+    assert get_meta(TEST_ROUNDTRIP) == meta
+    assert TEST_ROUNDTRIP not in components.cache.dataset_cache
+    loaded_df, loaded_meta = get_dataset(TEST_ROUNDTRIP)
+    # Loaded without copying: strings stay Arrow-backed, and numbers mixed with 'unknown' are saved as numbers (NaN if unknown)
+    expected_df = df.assign(Species = df['Species'].astype(pd.ArrowDtype(pa.string())), Lat = [10.75, np.nan, -1.5])
+    pd.testing.assert_frame_equal(loaded_df, expected_df)
+    assert loaded_meta == meta
+    # Also when unknown entries are NaN (eg., a saved dataset followed by appended rows)
+    put_dataset(TEST_APPENDED, pd.concat([loaded_df, df], ignore_index = True), meta)
+    appended_lat = get_dataset(TEST_APPENDED)[0]['Lat']
+    assert appended_lat.dtype == float
+    assert appended_lat.isna().tolist() == [False, True, False] * 2
+    with pytest.raises(KeyError):
+        get_meta('missing')
+
+
+def test_dataset_key_traversal(tmp_path, monkeypatch):
+    monkeypatch.setattr('components.cache.DATASET_CACHE_DIR', str(tmp_path / 'cache'))
+    # A file outside the cache directory, named like a saved dataset
+    put_dataset(TEST_ROUNDTRIP, pd.DataFrame({'Species': ['erato']}), {'mapping': False})
+    os.rename(get_dataset_path(TEST_ROUNDTRIP), tmp_path / f'outside.v{components.cache.CACHE_VERSION}.arrow')
+    monkeypatch.setattr('components.cache.dataset_cache', LRUCache(max_size = 2**20))
+    # Keys that are not hashes (eg., from the URL) are rejected before building a path
+    for key in ['../outside', str(tmp_path / 'outside'), TEST_ROUNDTRIP.upper(), TEST_ROUNDTRIP + '/..', None]:
+        with pytest.raises(KeyError):
+            get_meta(key)
+        with pytest.raises(KeyError):
+            get_dataset(key)
+
+
+def test_prune_disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr('components.cache.DATASET_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr('components.cache.DATASET_DISK_CACHE_MB', 0)
+    put_dataset(TEST_PRUNE, pd.DataFrame({'Species': ['erato']}), {})
+    assert not os.path.exists(get_dataset_path(TEST_PRUNE))
+
+    # Pinned datasets are kept, until unpinned
+    pin_dataset(TEST_PINNED)
+    put_dataset(TEST_PINNED, pd.DataFrame({'Species': ['erato']}), {})
+    assert os.path.exists(get_dataset_path(TEST_PINNED))
+    set_pinned_datasets([])
+    put_dataset(TEST_PRUNE, pd.DataFrame({'Species': ['erato']}), {})
+    assert not os.path.exists(get_dataset_path(TEST_PINNED))
+
+
+def test_dataset_lock():
+    events = []
+    def wait_for_lock():
+        with dataset_lock('test_dataset_lock'):
+            events.append('second')
+    with dataset_lock('test_dataset_lock'):
+        assert os.path.exists(get_lock_path('test_dataset_lock'))
+        thread = threading.Thread(target = wait_for_lock)
+        thread.start()
+        time.sleep(0.1)
+        events.append('first')
+    thread.join()
+    # Second holder waits for the first to release the lock
+    assert events == ['first', 'second']
+
+def test_get_derived():
+    df = pd.DataFrame({'Species': ['melpomene', 'erato', 'erato']})
+    put_dataset(TEST_GET_DERIVED, df, {})
+    calls = []
+    def build(df):
+        calls.append(1)
+        return df.Species.value_counts()
+    first = get_derived(TEST_GET_DERIVED, 'species_counts', build)
+    second = get_derived(TEST_GET_DERIVED, 'species_counts', build)
+    assert first is second
+    assert first['erato'] == 2
+    # Built once per dataset
+    assert len(calls) == 1
+
+    with pytest.raises(KeyError):
+        get_derived('missing', 'species_counts', build)
+
+def test_get_figure():
+    df = pd.DataFrame({'Species': ['melpomene', 'erato', 'erato']})
+    put_dataset(TEST_GET_FIGURE, df, {})
+    calls = []
+    def build(df):
+        calls.append(1)
+        return px.histogram(df, x = 'Species')
+    stats = get_cache_stats()['figures']
+    first = get_figure(TEST_GET_FIGURE, ('hist', 'Species'), build)
+    second = get_figure(TEST_GET_FIGURE, ('hist', 'Species'), build)
+    # Parsed once, sized by its serialized length
+    assert second is first
+    assert first['data'][0]['type'] == 'histogram'
+    # Built once per dataset and options, then served from the cache
+    assert len(calls) == 1
+    assert get_cache_stats()['figures']['hits'] == stats['hits'] + 1
+    assert get_cache_stats()['figures']['misses'] == stats['misses'] + 1
+    assert components.cache.figure_cache.get((TEST_GET_FIGURE, ('hist', 'Species')))[1] == len(build(df).to_json())
+
+    with pytest.raises(KeyError):
+        get_figure('missing', ('hist', 'Species'), build)
@@ -1,7 +1,8 @@
 import json
 import plotly
 import pandas as pd
-from components.divs import get_hist_div, get_map_div, get_img_div
+from components.profile import get_profile
+from components.divs import get_hist_div, get_map_div, get_img_div, get_main_div
 
 def test_get_hist_div():
     # Test for "Show Map View" button
@@ -34,14 +35,22 @@ def test_get_img_div():
     df = pd.DataFrame(data = data)
 
     # Check for format/contents
-    output = get_img_div(df, {'species1': ['subspecies1'], 'species2': ['subspecies2', 'subspecies4']}, True)
+    output = get_img_div(get_profile(df, False), True)
     j_img_div = json.dumps(output, cls = plotly.utils.PlotlyJSONEncoder)
     assert "Display Images" in j_img_div
-    assert '["species1", "species2"]' in j_img_div
+    assert '["species1", "species2", "Any"]' in j_img_div
     assert '["ventral", "dorsal"]' in j_img_div
     assert '["male", "female"]' in j_img_div
     assert '["subspecies synonym", "valid subspecies"]' in j_img_div
 
     # Test for no img_urls (img_url = False)
-    output2 = get_img_div(df, None, False)
+    output2 = get_img_div(None, False)
     assert output2 == []
+
+def test_get_main_div():
+    output = get_main_div(get_hist_div(True), [])
+    j_main_div = json.loads(json.dumps(output, cls = plotly.utils.PlotlyJSONEncoder))
+    # Histogram and map options layouts are saved for switching in the browser
+    layouts = [child for child in j_main_div['props']['children'] if child['props'].get('id') == 'dist-layouts'][0]
+    assert "Show Map View" in json.dumps(layouts['props']['data']['hist'])
+    assert "Show Histogram" in json.dumps(layouts['props']['data']['map'])
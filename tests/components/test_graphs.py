@@ -1,6 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from components.query import get_data
-from components.graphs import make_hist_plot, make_map, make_pie_plot
+import components.graphs
+from components.graphs import make_hist_plot, make_map, make_pie_plot, get_grid_size, get_template
 
 # Define test data
 df = pd.read_csv("test_data/HCGSD_full_testNA.csv")
@@ -23,6 +25,13 @@ def test_make_hist_plot():
     output2_layout = output2['layout', 'xaxis']
     assert output2_layout['categoryorder'] == 'sum ascending'
 
+    # Bars are drawn from counts: one value per (x_var, color_by) pair, totaling the number of specimens
+    output_data = output['data']
+    assert sum(sum(trace.y) for trace in output_data) == len(processed_df)
+    assert all(len(trace.x) == len(set(trace.x)) for trace in output_data)
+    # Alphabetical order is set on the server
+    assert list(output_layout['categoryarray']) == sorted(processed_df.Species.unique())
+
 def test_make_map():
     # Map plot output
     output = make_map(processed_df, "Species")
@@ -30,6 +39,36 @@ def test_make_map():
     assert output_data.type == "scattermapbox"
     #test for uknowns in data and check it's proper type
     assert 'unknown' not in output_data['customdata']
+    # One marker per (locality, color) pair, totaling the number of specimens with known lat/lon
+    mapped = ~processed_df['lat-lon'].astype(str).str.contains('unknown')
+    assert sum(len(trace.lat) for trace in output['data']) == processed_df.loc[mapped, ['lat-lon', 'Species']].drop_duplicates().shape[0]
+    assert sum(trace.customdata[:, 3].sum() for trace in output['data']) == mapped.sum()
+
+def test_make_map_grid(monkeypatch):
+    # Localities are combined into grid cells above MAX_MAP_SITES
+    monkeypatch.setattr(components.graphs, 'MAX_MAP_SITES', 5)
+    mapped = ~processed_df['lat-lon'].astype(str).str.contains('unknown')
+    output = make_map(processed_df, "Sex", zoom = 0)
+    assert sum(len(trace.lat) for trace in output['data']) < processed_df.loc[mapped, ['lat-lon', 'Sex']].drop_duplicates().shape[0]
+    assert sum(trace.customdata[:, 2].sum() for trace in output['data']) == mapped.sum()
+    # Finer grid when zoomed in
+    assert get_grid_size(20, 4) < get_grid_size(20, 1)
+    assert get_grid_size(5, 1) is None
+
+def test_make_map_density(monkeypatch):
+    # Density image above DENSITY_MAP_SITES localities
+    monkeypatch.setattr(components.graphs, 'MAX_MAP_SITES', 2)
+    monkeypatch.setattr(components.graphs, 'DENSITY_MAP_SITES', 5)
+    monkeypatch.setattr(components.graphs, 'DENSITY_IMAGE_PIXELS', 64)
+    output = make_map(processed_df, "Species")
+    image_layer = output.layout.mapbox.layers[1]
+    assert image_layer.sourcetype == "image"
+    assert image_layer.source.startswith("data:image/png;base64,")
+    # No markers, one legend entry per species
+    assert sorted(trace.name for trace in output['data']) == ['erato', 'melpomene', 'unknown']
+    assert all(pd.isna(trace.lat).all() for trace in output['data'])
+    # No grid when drawn as a density image
+    assert get_grid_size(20, 1) is None
 
 def test_make_pie():
     # Pie plot output 
@@ -38,6 +77,7 @@ def test_make_pie():
     assert output_data.type == "pie"
     # Not color by 'Subspecies' has 'percent+label' in 'textinfo'
     assert output_data['textinfo'] == 'percent+label'
+    assert sum(output_data['values']) == len(processed_df)
     
     # Pie plot output (color by 'Subspecies')
     output2 = make_pie_plot(processed_df, "Subspecies")
@@ -45,3 +85,14 @@ def test_make_pie():
     assert output2_data.type == "pie"
     # Color by 'Subspecies' has 'Species' added to 'hovertemplate'
     assert output2_data['hovertemplate'] == 'Subspecies=%{label}<br>Species=%{customdata[0]}<extra></extra>'
+
+def test_get_template():
+    # Each thread builds figures from its own copy of the default template (reused by the thread)
+    assert get_template() is get_template()
+    with ThreadPoolExecutor(1) as executor:
+        assert executor.submit(get_template).result() is not get_template()
+    # and figures built by threads at once match
+    expected = make_hist_plot(processed_df, 'Species', 'View', 'alpha').to_json()
+    with ThreadPoolExecutor(4) as executor:
+        figures = list(executor.map(lambda _: make_hist_plot(processed_df, 'Species', 'View', 'alpha').to_json(), range(8)))
+    assert all(figure == expected for figure in figures)
@@ -0,0 +1,51 @@
+import random
+import numpy as np
+import pandas as pd
+from components.index import (get_image_index, get_selection_bitset, get_column_selection, count_bits,
+                              sample_bits, pack_bits)
+from components.query import get_selection
+
+rng = np.random.default_rng(0)
+num_rows = 1003
+df = pd.DataFrame({'Species': rng.choice(['erato', 'melpomene'], num_rows),
+                   # mostly rare values, indexed by their rows
+                   'Subspecies': rng.choice([f'subspecies{i}' for i in range(100)], num_rows),
+                   'View': rng.choice(['dorsal', 'ventral'], num_rows),
+                   'Sex': rng.choice(['male', 'female', 'unknown'], num_rows),
+                   'Hybrid_stat': rng.choice(['valid subspecies', 'subspecies synonym'], num_rows),
+                   'File_url': rng.choice(['image.jpg', 'unknown'], num_rows)}).astype('category')
+index = get_image_index(df)
+
+def to_bools(bitset):
+    return np.unpackbits(bitset)[:num_rows].astype(bool)
+
+def test_get_image_index():
+    assert index['num_rows'] == num_rows
+    assert (to_bools(index['has_file']) == (df.File_url != 'unknown')).all()
+    # Common values are bitsets, rare values are sparse
+    assert set(index['columns']['View']['dense']) == {0, 1}
+    subspecies = index['columns']['Subspecies']
+    assert len(subspecies['dense']) + len(subspecies['sparse']) == 100
+    assert len(subspecies['sparse']) > len(subspecies['dense'])
+
+def test_get_selection_bitset():
+    selections = [('Subspecies', ['subspecies1', 'subspecies7', 'missing']), ('View', ['dorsal']),
+                  ('Sex', ['male', 'female']), ('Hybrid_stat', ['valid subspecies'])]
+    expected = np.ones(num_rows, dtype = bool)
+    for column, values in selections:
+        expected &= get_selection(df[column], values)
+    selected = get_selection_bitset(index, selections)
+    assert (to_bools(selected) == expected).all()
+    assert count_bits(selected) == expected.sum()
+
+    # Selecting every value of a column does not filter
+    assert get_column_selection(index, 'Sex', ['male', 'female', 'unknown']) is None
+    assert count_bits(get_selection_bitset(index, [('View', ['dorsal', 'ventral'])])) == num_rows
+
+def test_sample_bits():
+    selected = pack_bits(np.arange(num_rows) % 3 == 0)
+    rows = sample_bits(selected, 50, rng = random.Random(0))
+    assert len(set(rows)) == 50
+    assert (rows % 3 == 0).all()
+    # All set bits
+    assert sorted(sample_bits(selected, count_bits(selected))) == list(range(0, num_rows, 3))
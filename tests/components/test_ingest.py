@@ -0,0 +1,75 @@
+import base64
+import os
+import pandas as pd
+import pytest
+import components.ingest
+from components.ingest import sniff_upload, read_upload, get_upload_hash, remove_stale_uploads, UploadFile, UploadError
+
+def to_contents(df):
+    return 'data:text/csv;base64,' + base64.b64encode(df.to_csv(index = False).encode('utf-8')).decode('utf-8')
+
+df = pd.read_csv("test_data/HCGSD_full_filepath.csv")
+
+def test_sniff_upload():
+    header = sniff_upload(to_contents(df), 'test.csv')
+    assert header['included_features'] == ['Species', 'Subspecies', 'View', 'Sex', 'Hybrid_stat', 'Lat', 'Lon', 'File_url']
+    assert header['mapping'] and header['img_urls']
+    # Uploaded names of the needed columns only
+    assert header['usecols'] == ['View', 'Species', 'Subspecies', 'Sex', 'hybrid_stat', 'locality', 'lat', 'lon', 'file_url']
+
+    # Missing feature
+    with pytest.raises(UploadError) as e:
+        sniff_upload(to_contents(df.drop(columns = 'Sex')), 'test.csv')
+    assert e.value.error == {'feature': 'Sex'}
+
+    # Non-numeric lat in the first rows
+    bad_lat = df.astype({'lat': object})
+    bad_lat.loc[0, 'lat'] = 'north'
+    with pytest.raises(UploadError) as e:
+        sniff_upload(to_contents(bad_lat), 'test.csv')
+    assert 'mapping' in e.value.error
+
+    with pytest.raises(UploadError):
+        sniff_upload(to_contents(df), 'test.txt')
+
+def test_read_upload(monkeypatch):
+    monkeypatch.setattr(components.ingest, 'CHUNK_ROWS', 100)
+    # Extra columns are not read
+    wide = df.assign(**{f'extra_{i}': 'x' for i in range(60)})
+    uploaded, features, mapping, img_urls = read_upload(to_contents(wide), 'test.csv')
+    assert list(uploaded.columns) == features + ['Locality']
+    assert len(uploaded) == len(df)
+
+    # Non-numeric lat after the sampled rows is still rejected in the full read
+    bad_lat = df.astype({'lat': object})
+    bad_lat.loc[len(df) - 1, 'lat'] = 'north'
+    monkeypatch.setattr(components.ingest, 'SNIFF_ROWS', 10)
+    header = sniff_upload(to_contents(bad_lat), 'test.csv')
+    with pytest.raises(UploadError):
+        read_upload(to_contents(bad_lat), 'test.csv', header)
+
+def test_get_upload_hash(tmp_path, monkeypatch):
+    monkeypatch.setattr(components.ingest, 'READ_BUFFER_SIZE', 1000)
+    contents = to_contents(df)
+    path = tmp_path / 'test.csv'
+    path.write_bytes(df.to_csv(index = False).encode('utf-8'))
+    # Same key for the contents, the saved file, and the file uploaded to the server
+    assert get_upload_hash(contents, 'test.csv') == get_upload_hash(path, 'test.csv')
+    upload = UploadFile(str(tmp_path / 'uploads'), 'test.csv')
+    with upload, open(path, 'rb') as file:
+        while block := file.read(999):
+            upload.write(block)
+    assert upload.hexdigest() == get_upload_hash(path, 'test.csv')
+    assert upload.path.read_bytes() == path.read_bytes()
+    assert upload.path.suffix == '.csv'
+
+    assert get_upload_hash(contents, 'other.csv') != get_upload_hash(contents, 'test.csv')
+    assert get_upload_hash(contents, 'test.csv', prefix = 'key') != get_upload_hash(contents, 'test.csv')
+
+def test_remove_stale_uploads(tmp_path):
+    stale = tmp_path / 'stale.csv'
+    stale.write_text('x')
+    os.utime(stale, (0, 0))
+    (tmp_path / 'new.csv').write_text('x')
+    remove_stale_uploads(str(tmp_path))
+    assert [path.name for path in tmp_path.iterdir()] == ['new.csv']
@@ -0,0 +1,63 @@
+import pytest
+from flask import Flask
+from dash.exceptions import PreventUpdate
+import components.metrics
+from components.metrics import metrics, stage
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(components.metrics, 'METRICS_ENABLED', True)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+def test_disabled():
+    def callback():
+        return 1
+    # Callbacks are not wrapped unless metrics are enabled
+    assert components.metrics.instrument_callback(callback) is callback
+
+def test_instrument_callback(enabled):
+    @components.metrics.instrument_callback
+    def callback(value):
+        with stage('load'):
+            pass
+        with stage('load'):
+            pass
+        if value is None:
+            raise PreventUpdate
+        return value
+
+    assert callback(1) == 1
+    with pytest.raises(PreventUpdate):
+        callback(None)
+    assert metrics.callback_seconds['callback'].count == 2
+    assert metrics.stage_seconds[('callback', 'load')][1] == 2
+    assert metrics.calls == {('callback', 'ok'): 1, ('callback', 'prevented'): 1}
+
+    text = metrics.render({'dashboard_cache_hits': [({'cache': 'figures'}, 3)]})
+    assert 'dashboard_callback_seconds_count{callback="callback"} 2' in text
+    assert 'dashboard_callback_seconds_bucket{callback="callback",le="+Inf"} 2' in text
+    assert 'dashboard_callback_calls_total{callback="callback",outcome="prevented"} 1' in text
+    assert 'dashboard_cache_hits{cache="figures"} 3' in text
+
+def test_metrics_endpoint(enabled):
+    server = Flask(__name__)
+
+    @components.metrics.instrument_callback
+    def callback():
+        return 'figure'
+
+    @server.route(components.metrics.CALLBACK_PATH, methods = ['POST'])
+    def update():
+        return callback()
+
+    components.metrics.init_metrics(server)
+    client = server.test_client()
+    client.post(components.metrics.CALLBACK_PATH, data = 'inputs')
+    assert metrics.request_seconds['callback'].count == 1
+    assert metrics.payload_bytes == {('callback', 'request'): len('inputs'), ('callback', 'response'): len('figure')}
+
+    text = client.get('/metrics').get_data(as_text = True)
+    assert 'dashboard_request_seconds_count{callback="callback"} 1' in text
+    assert 'dashboard_callback_payload_bytes_total{callback="callback",direction="response"} 6' in text
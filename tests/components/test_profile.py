@@ -0,0 +1,38 @@
+import pandas as pd
+from components.profile import get_profile, get_species_map, merge_profiles
+
+df = pd.DataFrame({'Species': ['erato', 'melpomene', None, 'erato', 'melpomene'],
+                   'Subspecies': ['notabilis', None, 'plesseni', 'guarica', 'unknown'],
+                   'View': ['dorsal', 'ventral', 'dorsal', None, 'unknown'],
+                   'Sex': ['male', 'female', 'male', 'male', 'female'],
+                   'Hybrid_stat': ['valid subspecies'] * 5,
+                   'Lat': [1.5, None, -2.0, 4.0, 3.0],
+                   'Lon': [10.0, 5.0, -20.0, None, 7.5]})
+
+def test_get_profile():
+    for data in [df, df.astype({col: 'category' for col in ['Species', 'Subspecies', 'View']})]:
+        profile = get_profile(data, True)
+        assert profile['num_rows'] == 5
+        # Missing values counted as 'unknown' (with values that are 'unknown'), in order of first appearance
+        assert profile['vocabularies']['View'] == ['dorsal', 'ventral', 'unknown']
+        assert profile['counts']['View'] == [2, 1, 2]
+        assert profile['vocabularies']['Species'] == ['erato', 'melpomene', 'unknown']
+        assert profile['counts']['Sex'] == [3, 2]
+        assert profile['species'] == get_species_map(data)
+        # Bounds of rows with known lat and lon
+        assert profile['bounds'] == {'lat': [-2.0, 3.0], 'lon': [-20.0, 10.0]}
+    assert get_profile(df, False)['bounds'] is None
+
+def test_get_species_map():
+    all_species = get_species_map(df)
+    # Missing species and subspecies are left out, 'unknown' values are kept
+    assert all_species == {'erato': ['Any-erato', 'notabilis', 'guarica'],
+                           'melpomene': ['Any-melpomene', 'unknown'],
+                           'Any': ['Any', 'notabilis', 'plesseni', 'guarica', 'unknown']}
+
+def test_merge_profiles():
+    # Same as the profile of all the rows
+    for cut in range(1, 5):
+        first, added = df.iloc[:cut], df.iloc[cut:]
+        assert merge_profiles(get_profile(first, True), get_profile(added, True)) == get_profile(df, True)
+        assert merge_profiles(get_profile(first, False), get_profile(added, False)) == get_profile(df, False)
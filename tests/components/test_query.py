@@ -1,7 +1,7 @@
 import unittest
 from unittest.mock import patch
 import pandas as pd
-from components.query import get_species_options, get_data, get_filenames, get_images
+from components.query import get_species_options, get_data, append_data, get_filenames, get_images, get_selection, to_categoricals, get_gallery_rows, get_gallery_page
 
 
 class TestQuery(unittest.TestCase):
@@ -44,6 +44,9 @@ class TestQuery(unittest.TestCase):
         self.assertEqual(result_df["Species_at_locality"].tolist(), ['melpomene', 'melpomene, erato', 'melpomene, erato', 'melpomene', 'melpomene, erato', 'species3'])
         self.assertEqual(result_df["Subspecies_at_locality"].tolist(), ['schunkei', 'nanna, erato, guarica', 'nanna, erato, guarica', 'rosina_N', 'nanna, erato, guarica', 'unknown'])
         self.assertEqual(result_list, cat_list)
+        # Repeated labels stored as categoricals
+        for col in ['Species', 'Subspecies', 'Locality', 'lat-lon', 'Species_at_locality', 'Subspecies_at_locality']:
+            self.assertEqual(result_df[col].dtype, 'category')
 
         # Test with mapping = False (no location data)
         df2 = pd.DataFrame(data = {key: data[key] for key in ['Species', 'Subspecies']})
@@ -53,6 +56,45 @@ class TestQuery(unittest.TestCase):
         self.assertEqual(result_df2["Subspecies"].tolist(), ['schunkei', 'nanna', 'erato', 'rosina_N', 'guarica', 'unknown'])
         self.assertEqual(result2_list, cat_list)
 
+    def test_append_data(self):
+        data = {
+            'Species': ['melpomene', 'melpomene', 'erato', 'melpomene', 'erato', 'species3', 'erato', 'melpomene'],
+            'Subspecies': ['schunkei', 'nanna', 'erato', 'rosina_N', 'guarica', None, 'phyllis', 'nanna'],
+            'Lat': [-13.43, 5.25, 5.25, 9.9, 5.25, 9.9, -13.43, 1.0],
+            'Lon': [-70.38,  -55.25, -55.25, -83.73, -55.25, -55.25, -70.38, None]
+        }
+        features = ['Species', 'Subspecies', 'Lat', 'Lon']
+        df = to_categoricals(pd.DataFrame(data = data))
+        for mapping in [True, False]:
+            columns = features if mapping else features[:2]
+            expected, expected_list = get_data(df[columns], mapping, list(columns))
+            # Per-locality values of categorical data match the species at each locality
+            if mapping:
+                self.assertEqual(expected["Species_at_locality"].tolist()[:3], ['melpomene, erato', 'melpomene, erato', 'melpomene, erato'])
+            for cut in range(1, len(df)):
+                processed, _ = get_data(df[columns].iloc[:cut].reset_index(drop = True), mapping, list(columns))
+                result_df, result_list = append_data(processed, df[columns].iloc[cut:].reset_index(drop = True), mapping, columns)
+                # Same as processing all rows together
+                self.assertEqual(list(result_df.columns), list(expected.columns))
+                for col in expected.columns:
+                    self.assertEqual(result_df[col].tolist(), expected[col].tolist())
+                    self.assertEqual(result_df[col].dtype == 'category', expected[col].dtype == 'category')
+                self.assertEqual(result_list, expected_list)
+
+    def test_get_data_single_value_localities(self):
+        # One species (and subspecies) per locality: the per-locality values of the categorical columns are then all
+        # categories of them, and must not be kept categorical (broadcast to the rows by category order, not by locality)
+        data = {
+            'Species': ['melpomene', 'erato', 'species3', 'melpomene'],
+            'Subspecies': ['nanna', 'phyllis', 'guarica', 'nanna'],
+            'Lat': [2.0, 1.0, 3.0, 2.0],
+            'Lon': [2.0, 1.0, 3.0, 2.0]
+        }
+        df = to_categoricals(pd.DataFrame(data = data))
+        result_df, _ = get_data(df, True, ['Species', 'Subspecies', 'Lat', 'Lon'])
+        self.assertEqual(result_df["Species_at_locality"].tolist(), data['Species'])
+        self.assertEqual(result_df["Subspecies_at_locality"].tolist(), data['Subspecies'])
+
     def test_get_filenames(self):
         BASE_URL_V = "https://github.com/Imageomics/dashboard-prototype/raw/main/test_data/images/ventral_images/"
         BASE_URL_D = "https://github.com/Imageomics/dashboard-prototype/raw/main/test_data/images/dorsal_images/"
@@ -116,10 +158,62 @@ class TestQuery(unittest.TestCase):
         #check lists have same elements
         self.assertCountEqual(paths, test_paths[4])
 
+        # Test same selections with categorical columns (filtered by codes)
+        df_cat = to_categoricals(df.copy())
+        for i in range(0, 4):
+            paths = get_filenames(df_cat, test_subspecies[i], test_view[i], test_sex[i], test_hybrid[i], test_nums[i])
+            self.assertEqual(paths, [test_paths[i]])
+        paths = get_filenames(df_cat, test_subspecies[4], test_view[4], test_sex[4], test_hybrid[4], test_nums[4])
+        self.assertCountEqual(paths, test_paths[4])
+
+        # Test no matching images, and matching records without filepaths
+        with self.assertRaisesRegex(ValueError, "No Such Images."):
+            get_filenames(df_cat, ['guarica'], ['ventral'], ['female'], ['valid subspecies'], 1)
+        with self.assertRaisesRegex(ValueError, "1 record"):
+            get_filenames(df_cat, ['subspecies6'], ['ventral'], ['male'], ['subspecies synonym'], 1)
+
+        # Gallery of the same selections: rows with images in a stable order for each seed
+        rows = get_gallery_rows(df_cat, test_subspecies[4], test_view[4], test_sex[4], test_hybrid[4], seed = 1)
+        self.assertCountEqual(rows.tolist(), [0, 1, 3])
+        self.assertEqual(get_gallery_rows(df_cat, test_subspecies[4], test_view[4], test_sex[4], test_hybrid[4], seed = 1).tolist(),
+                         rows.tolist())
+        page = get_gallery_page(df_cat, rows, 2, 2)
+        self.assertEqual([getattr(img, 'data-src') for img in page], [df.File_url[rows[2]]])
+        with self.assertRaisesRegex(ValueError, "1 record"):
+            get_gallery_rows(df_cat, ['subspecies6'], ['ventral'], ['male'], ['subspecies synonym'], seed = 1)
+
+        # Cross-filtered galleries keep only rows with the filtered values (of indexed and other columns)
+        rows = get_gallery_rows(df_cat, test_subspecies[4], test_view[4], test_sex[4], test_hybrid[4], seed = 1,
+                                filters = {'Sex': 'male'})
+        self.assertCountEqual(rows.tolist(), [0, 3])
+        df_cat['Locality'] = pd.Categorical(['Peru', 'Panama', 'Panama', 'Peru', 'Peru', 'Panama'])
+        rows = get_gallery_rows(df_cat, test_subspecies[4], test_view[4], test_sex[4], test_hybrid[4], seed = 1,
+                                filters = {'Sex': 'male', 'Locality': 'Peru'})
+        self.assertCountEqual(rows.tolist(), [0, 3])
+        with self.assertRaisesRegex(ValueError, "No Such Images."):
+            get_gallery_rows(df_cat, test_subspecies[4], test_view[4], test_sex[4], test_hybrid[4], seed = 1,
+                             filters = {'Locality': 'Ecuador'})
+
+    def test_get_selection(self):
+        values = pd.Series(['dorsal', 'ventral', None, 'dorsal'])
+        expected = [True, False, False, True]
+        self.assertEqual(get_selection(values, ['dorsal', 'lateral']).tolist(), expected)
+        self.assertEqual(get_selection(values.astype('category'), ['dorsal', 'lateral']).tolist(), expected)
+
     @patch('components.query.get_filenames')
     def test_get_images(self, mock_filenames):
         filepaths = ['filepath' + str(i) for i in range(5)]
         mock_filenames.return_value = filepaths
         result = get_images(df = None, subspecies = None, view = None, sex = None, hybrid = None, num_images = 5)
         self.assertEqual(len(result), 5)
-        self.assertEqual([result[i].src for i in range(5)], [filepaths[i] for i in range(5)])
+        self.assertEqual([getattr(result[i], 'data-src') for i in range(5)], [filepaths[i] for i in range(5)])
+
+    @patch('components.query.get_filenames')
+    def test_get_local_images(self, mock_filenames):
+        filepath = 'test_data/images/dorsal_images/10427965_D_lowres.png'
+        mock_filenames.return_value = [filepath]
+        result = get_images(df = None, subspecies = None, view = None, sex = None, hybrid = None, num_images = 1)
+        # Thumbnail linked to full size image
+        self.assertEqual(result[0].href, '/image/' + filepath)
+        self.assertTrue(getattr(result[0].children, 'data-src').startswith('/thumbnail/'))
+        self.assertTrue(getattr(result[0].children, 'data-src').endswith(filepath))
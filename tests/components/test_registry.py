@@ -0,0 +1,52 @@
+import os
+import shutil
+import pytest
+import components.cache
+import components.registry
+from components.registry import list_data_files, get_data_file, get_data_file_key, read_manifest
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(components.registry, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(components.cache, 'DATASET_CACHE_DIR', str(tmp_path / 'cache'))
+    shutil.copy("test_data/HCGSD_testNA.csv", tmp_path / "specimens.csv")
+    (tmp_path / "notes.txt").write_text("not data")
+    return tmp_path
+
+def test_list_data_files(data_dir, monkeypatch):
+    assert list_data_files() == ['specimens.csv']
+    monkeypatch.setattr(components.registry, 'DATA_DIR', None)
+    assert list_data_files() == []
+
+def test_get_data_file(data_dir):
+    path, key = get_data_file('specimens.csv')
+    assert path == data_dir / 'specimens.csv'
+    # Unchanged file keeps its key
+    assert get_data_file('specimens.csv')[1] == key
+
+    # Changed file is rehashed
+    with open(path, 'a') as file:
+        file.write('\n')
+    os.utime(path, ns = (0, 0))
+    assert get_data_file('specimens.csv')[1] != key
+
+    with pytest.raises(KeyError):
+        get_data_file('notes.txt')
+
+def test_get_data_file_key(data_dir, monkeypatch):
+    # Not hashed yet
+    assert get_data_file_key('specimens.csv') is None
+    path, key = get_data_file('specimens.csv')
+    # Saved in the manifest shared by server processes, so it is not hashed again
+    stat = os.stat(path)
+    assert read_manifest() == {'specimens.csv': [stat.st_mtime_ns, stat.st_size, key]}
+    monkeypatch.setattr(components.registry, 'get_upload_hash', None)
+    assert get_data_file_key('specimens.csv') == key
+    assert get_data_file('specimens.csv')[1] == key
+
+    # Changed or removed files are not looked up
+    os.utime(path, ns = (0, 0))
+    assert get_data_file_key('specimens.csv') is None
+    path.unlink()
+    assert get_data_file_key('specimens.csv') is None
+    assert get_data_file_key('notes.txt') is None
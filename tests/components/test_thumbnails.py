@@ -0,0 +1,42 @@
+import os
+from PIL import Image
+from components.thumbnails import get_image_path, get_thumbnail_url, get_image_url, get_thumbnail, prefetch_thumbnails
+
+IMAGE = "test_data/images/dorsal_images/10427965_D_lowres.png"
+
+def test_get_image_path():
+    assert get_image_path(IMAGE) == os.path.realpath(IMAGE)
+    # Remote, missing, non-image, and outside the image root
+    assert get_image_path("https://github.com/Imageomics/dashboard-prototype/raw/main/" + IMAGE) is None
+    assert get_image_path("test_data/images/dorsal_images/missing.png") is None
+    assert get_image_path("test_data/HCGSD_testNA.csv") is None
+    assert get_image_path("../" + os.path.basename(os.getcwd()) + "/" + IMAGE) == os.path.realpath(IMAGE)
+    assert get_image_path("../../etc/passwd") is None
+    assert get_image_path("/etc/hostname") is None
+
+def test_get_thumbnail_url():
+    assert get_thumbnail_url(IMAGE, 200) == "/thumbnail/200/" + IMAGE
+    assert get_image_url(IMAGE) == "/image/" + IMAGE
+    assert get_thumbnail_url("filepath0") is None
+    assert get_image_url("filepath0") is None
+
+def test_get_thumbnail():
+    with Image.open(IMAGE) as image:
+        width, height = image.size
+    thumbnail_path, etag = get_thumbnail(os.path.realpath(IMAGE), width // 2)
+    with Image.open(thumbnail_path) as thumbnail:
+        assert thumbnail.width == width // 2
+        assert abs(thumbnail.height - height / 2) <= 1
+    # Cached
+    mtime = os.stat(thumbnail_path).st_mtime_ns
+    assert get_thumbnail(os.path.realpath(IMAGE), width // 2) == (thumbnail_path, etag)
+    assert os.stat(thumbnail_path).st_mtime_ns == mtime
+    # Not enlarged
+    thumbnail_path, _ = get_thumbnail(os.path.realpath(IMAGE), width * 2)
+    with Image.open(thumbnail_path) as thumbnail:
+        assert thumbnail.size == (width, height)
+
+def test_prefetch_thumbnails():
+    prefetch_thumbnails([IMAGE, "https://example.com/image.png"], 100)
+    thumbnail_path, _ = get_thumbnail(os.path.realpath(IMAGE), 100)
+    assert os.path.exists(thumbnail_path)
@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# Keep processed test datasets, thumbnails, and background jobs out of the shared cache directories
+os.environ['DATASET_CACHE_DIR'] = tempfile.mkdtemp(prefix = 'dashboard-test-cache-')
+os.environ['THUMBNAIL_CACHE_DIR'] = tempfile.mkdtemp(prefix = 'dashboard-test-thumbnails-')
+os.environ['DASHBOARD_JOBS_DIR'] = tempfile.mkdtemp(prefix = 'dashboard-test-jobs-')
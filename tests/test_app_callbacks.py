@@ -1,61 +1,319 @@
+import functools
+import hashlib
 import json
+import os
+import shutil
+import subprocess
 import plotly
-from dashboard import update_dist_view, update_dist_plot, update_pie_plot, set_subspecies_options, update_display
+import pytest
+import pandas as pd
+from io import StringIO
+from components.cache import put_dataset, get_cache_stats
+from components.profile import get_profile
+from dashboard import app, server, update_dist_plot, update_pie_plot, update_image_options, update_display, update_gallery
 
 # Define test data
-data = {'processed_df': '{"columns":["Species","Subspecies","View","Sex","Hybrid_stat","Lat","Lon","lat-lon","Samples_at_locality","Species_at_locality","Subspecies_at_locality"],"index":[0,1,2,3,4,5,6,7,8,9],"data":[["erato","notabilis","unknown","unknown","subspecies synonym",-1.583333333,-77.75,"-1.583333333|-77.75",1,"erato","notabilis"],["erato","petiverana","ventral","male","valid subspecies",18.66666667,-96.98333333,"18.66666667|-96.98333333",1,"erato","petiverana"],["unknown","petiverana","ventral","male","valid subspecies","unknown",-84.68333333,"unknown|-84.68333333",1,"unknown","petiverana"],["erato","phyllis","dorsal","male","subspecies synonym",-27.45,-58.98333333,"-27.45|-58.98333333",1,"erato","phyllis"],["unknown","plesseni","ventral","male","valid subspecies",-1.4,"unknown","-1.4|unknown",1,"unknown","plesseni"],["melpomene","unknown","ventral","male","subspecies synonym",-13.36666667,-70.95,"-13.36666667|-70.95",1,"melpomene","unknown"],["melpomene","rosina_S","dorsal","male","valid subspecies",9.883333333,-83.63333333,"9.883333333|-83.63333333",1,"melpomene","rosina_S"],["erato","guarica","dorsal","female","valid subspecies",4.35,-74.36666667,"4.35|-74.36666667",1,"erato","guarica"],["melpomene","plesseni","ventral","male","subspecies synonym",-1.583333333,"unknown","-1.583333333|unknown",1,"melpomene","plesseni"],["melpomene","nanna","unknown","male","valid subspecies",-20.33333333,-40.28333333,"-20.33333333|-40.28333333",1,"melpomene","nanna"]]}',
+processed_df = pd.read_json(StringIO('{"columns":["Species","Subspecies","View","Sex","Hybrid_stat","Lat","Lon","lat-lon","Samples_at_locality","Species_at_locality","Subspecies_at_locality"],"index":[0,1,2,3,4,5,6,7,8,9],"data":[["erato","notabilis","unknown","unknown","subspecies synonym",-1.583333333,-77.75,"-1.583333333|-77.75",1,"erato","notabilis"],["erato","petiverana","ventral","male","valid subspecies",18.66666667,-96.98333333,"18.66666667|-96.98333333",1,"erato","petiverana"],["unknown","petiverana","ventral","male","valid subspecies","unknown",-84.68333333,"unknown|-84.68333333",1,"unknown","petiverana"],["erato","phyllis","dorsal","male","subspecies synonym",-27.45,-58.98333333,"-27.45|-58.98333333",1,"erato","phyllis"],["unknown","plesseni","ventral","male","valid subspecies",-1.4,"unknown","-1.4|unknown",1,"unknown","plesseni"],["melpomene","unknown","ventral","male","subspecies synonym",-13.36666667,-70.95,"-13.36666667|-70.95",1,"melpomene","unknown"],["melpomene","rosina_S","dorsal","male","valid subspecies",9.883333333,-83.63333333,"9.883333333|-83.63333333",1,"melpomene","rosina_S"],["erato","guarica","dorsal","female","valid subspecies",4.35,-74.36666667,"4.35|-74.36666667",1,"erato","guarica"],["melpomene","plesseni","ventral","male","subspecies synonym",-1.583333333,"unknown","-1.583333333|unknown",1,"melpomene","plesseni"],["melpomene","nanna","unknown","male","valid subspecies",-20.33333333,-40.28333333,"-20.33333333|-40.28333333",1,"melpomene","nanna"]]}'), orient = 'split')
+data = {'dataset_key': hashlib.sha256(b'test_app_callbacks').hexdigest(),
         'all_species': {'Erato': ['Any-Erato', 'notabilis', 'petiverana', 'phyllis', 'guarica'], 'Unknown': ['Any-Unknown', 'petiverana', 'plesseni'], 'Melpomene': ['Any-Melpomene', 'unknown', 'rosina_S', 'plesseni', 'nanna'], 'Any': ['Any', 'notabilis', 'petiverana', 'phyllis', 'plesseni', 'unknown', 'rosina_S', 'guarica', 'nanna']}, 
         'mapping': True, 
         'images': True}
 jsonified_data = json.dumps(data)
+meta = {'mapping': True, 'images': True, 'profile': get_profile(processed_df, True)}
+put_dataset(data['dataset_key'], processed_df, meta)
+# Same data with image urls
+image_data = {**data, 'dataset_key': hashlib.sha256(b'test_app_callbacks_images').hexdigest()}
+jsonified_image_data = json.dumps(image_data)
+put_dataset(image_data['dataset_key'], processed_df.assign(File_url = ['image' + str(i) for i in range(10)]), meta)
 
 
-def test_update_dist_view_call():
-    # Test hist div callback (no clicks or button)
-    output = update_dist_view(0, [], jsonified_data)
-    j_output = json.dumps(output, cls = plotly.utils.PlotlyJSONEncoder)
-    assert "Show Map View" in j_output
-    
-    # Test map div callback (1 click and "Show Map View")
-    output2 = update_dist_view(1, ["Show Map View"], jsonified_data)
-    j_output2 = json.dumps(output2, cls = plotly.utils.PlotlyJSONEncoder)
-    assert "Show Histogram" in j_output2
+CLIENTSIDE_JS = os.path.abspath('assets/clientside.js')
+# Runs a clientside function (as the browser would, with the callback context), printing its outputs in JSON
+# (multiple outputs as a list), with dash_clientside.no_update as null
+RUN_CLIENTSIDE = """
+const [file, namespace, name, args, triggered_id, multi] = JSON.parse(process.argv[1]);
+const no_update = {};
+global.window = {dash_clientside: {no_update: no_update, callback_context: {triggered_id: triggered_id}}};
+require(file);
+const result = window.dash_clientside[namespace][name](...args);
+const outputs = multi && result !== no_update ? result : [result];
+process.stdout.write(JSON.stringify(outputs.map(value => value === no_update ? null : {value: value})));
+"""
 
-    # Test hist div callback (clicks and "Show Histogram")
-    output3 = update_dist_view(2, children = "Show Histogram", jsonified_data = jsonified_data)
-    j_output3 = json.dumps(output3, cls = plotly.utils.PlotlyJSONEncoder)
-    assert "Show Map View" in j_output3
+def get_prop_ids(items):
+    return [item['id'] + '.' + item['property'] for item in items]
 
+def get_output_ids(output):
+    # Multiple outputs are listed as '..id.prop...id.prop..', duplicate outputs end in '@<hash>'
+    return [item.split('@')[0] for item in output.strip('.').split('...')]
+
+def get_component_id(prop_id):
+    return prop_id.rsplit('.', 1)[0]
+
+def add_layout_values(layout, values):
+    '''
+    Adds the properties of the components with ids in a layout (in JSON) to `values` ('id.prop' -> value), and returns the ids.
+    '''
+    ids = set()
+    if isinstance(layout, list):
+        for item in layout:
+            ids |= add_layout_values(item, values)
+    elif isinstance(layout, dict) and 'props' in layout:
+        props = layout['props']
+        if 'id' in props:
+            ids.add(props['id'])
+            values.update({f"{props['id']}.{prop}": value for prop, value in props.items() if prop != 'id'})
+        for value in props.values():
+            ids |= add_layout_values(value, values)
+    return ids
+
+class Page:
+    '''
+    The dashboard's page in a browser: keeps the properties of its components, and runs the callbacks a change of them
+    triggers, as the Dash renderer does. Clientside callbacks run in node, server callbacks are requested from the server
+    (through the Flask test client), and the server callbacks run are recorded (`dispatched`).
+    '''
+    def __init__(self, monkeypatch):
+        self.client = server.test_client()
+        self.dependencies = self.client.get('/_dash-dependencies').get_json()
+        self.values = {}
+        self.ids = add_layout_values(json.loads(json.dumps(app.layout, cls = plotly.utils.PlotlyJSONEncoder)), self.values)
+        self.dispatched = []
+        for output, callback in app.callback_map.items():
+            if 'callback' in callback:
+                monkeypatch.setitem(callback, 'callback', self.record(callback['callback']))
+
+    def record(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.dispatched.append(func.__name__)
+            return func(*args, **kwargs)
+        return wrapper
+
+    def run(self, dependency, triggered):
+        '''
+        Runs a callback, returning its outputs that were updated ('id.prop' -> value).
+        '''
+        output_ids = get_output_ids(dependency['output'])
+        args = [self.values.get(prop_id) for prop_id in get_prop_ids(dependency['inputs'] + dependency['state'])]
+        clientside = dependency.get('clientside_function')
+        if clientside is not None:
+            triggered_id = get_component_id(triggered[0]) if triggered else None
+            result = subprocess.run(['node', '-e', RUN_CLIENTSIDE, json.dumps([CLIENTSIDE_JS, clientside['namespace'],
+                                     clientside['function_name'], args, triggered_id, dependency['output'].startswith('..')])],
+                                    capture_output = True, text = True, check = True)
+            return {prop_id: output['value'] for prop_id, output in zip(output_ids, json.loads(result.stdout)) if output is not None}
+        outputs = [{'id': get_component_id(prop_id), 'property': prop_id.rsplit('.', 1)[1]} for prop_id in output_ids]
+        body = {'output': dependency['output'],
+                'outputs': outputs if len(outputs) > 1 else outputs[0],
+                'inputs': [{**item, 'value': self.values.get(prop_id)}
+                           for item, prop_id in zip(dependency['inputs'], get_prop_ids(dependency['inputs']))],
+                'state': [{**item, 'value': self.values.get(prop_id)}
+                          for item, prop_id in zip(dependency['state'], get_prop_ids(dependency['state']))],
+                'changedPropIds': triggered}
+        response = self.client.post('/_dash-update-component', json = body)
+        assert response.status_code in (200, 204)
+        if response.status_code == 204:
+            return {}
+        return {f'{component_id}.{prop}': value
+                for component_id, props in response.get_json()['response'].items() for prop, value in props.items()}
+
+    def get_triggered(self, changed, inserted, predecessors):
+        '''
+        Returns the callbacks triggered by changed properties, or by components inserted by a `children` output: those with
+        an output in the inserted components (unless they prevent initial calls), or an input (unless they have an output
+        in them), and an input on the page. Callbacks that triggered the change (`predecessors`) are not triggered again.
+        '''
+        triggered = {}
+        for dependency in self.dependencies:
+            output = dependency['output']
+            inputs = get_prop_ids(dependency['inputs'])
+            if output in predecessors or not any(get_component_id(prop_id) in self.ids for prop_id in inputs):
+                continue
+            output_components = {get_component_id(prop_id) for prop_id in get_output_ids(output)}
+            input_components = {get_component_id(prop_id) for prop_id in inputs}
+            if output_components & inserted:
+                layout_call = not dependency['prevent_initial_call']
+            else:
+                layout_call = bool(input_components & inserted)
+            changed_inputs = [prop_id for prop_id in inputs if prop_id in changed]
+            if changed_inputs or layout_call:
+                triggered[output] = (dependency, changed_inputs)
+        return triggered
+
+    def change(self, changed):
+        '''
+        Changes properties of the page ('id.prop' -> value), running the callbacks it triggers and those their outputs
+        trigger in turn. As in the renderer, a callback waits while another pending one has its inputs as outputs, callbacks
+        triggered again while pending run once, and callbacks are not triggered by their own outputs (or those of the
+        callbacks they triggered). Returns the names of the server callbacks run.
+        '''
+        self.dispatched = []
+        self.values.update(changed)
+        # output -> (dependency, changed inputs, predecessors)
+        pending = {output: (dependency, triggered, {output})
+                   for output, (dependency, triggered) in self.get_triggered(set(changed), set(), set()).items()}
+        while pending:
+            pending_outputs = {output: set(get_output_ids(output)) for output in pending}
+            output = next((output for output, (dependency, _, _) in pending.items()
+                           if not any(set(get_prop_ids(dependency['inputs'])) & outputs
+                                      for other, outputs in pending_outputs.items() if other != output)),
+                          next(iter(pending)))
+            dependency, triggered, predecessors = pending.pop(output)
+            updated = self.run(dependency, triggered)
+            self.values.update(updated)
+            inserted = set()
+            for prop_id, value in updated.items():
+                if prop_id.endswith('.children'):
+                    inserted |= add_layout_values(value, self.values)
+            self.ids |= inserted
+            for other, (other_dependency, other_triggered) in self.get_triggered(set(updated), inserted, predecessors).items():
+                if other in pending:
+                    pending[other][1].extend(other_triggered)
+                else:
+                    pending[other] = (other_dependency, other_triggered, predecessors | {other})
+        return self.dispatched
+
+@pytest.mark.skipif(shutil.which('node') is None, reason = 'runs clientside callbacks with node')
+def test_server_callbacks_per_interaction(monkeypatch):
+    page = Page(monkeypatch)
+    # Loading a dataset builds the page
+    page.change({'memory.data': jsonified_image_data})
+    assert 'dist-plot.figure' in page.values and page.values['dist-view-btn.children'] == 'Show Map View'
+
+    # Only interactions that need the dataset reach the server
+    assert page.change({'species-show.value': 'Melpomene'}) == []
+    assert page.values['subspecies-show.value'] == 'Any-Melpomene'
+    assert page.change({'species-show.value': 'Any'}) == []
+    assert page.change({'sort-by.value': 'sum descending'}) == ['update_dist_plot']
+    # Switching to the map view swaps the options in the browser, then the map is built
+    assert page.change({'dist-view-btn.n_clicks': 1}) == ['update_dist_plot']
+    assert page.values['dist-view-btn.children'] == 'Show Histogram'
+    assert page.values['dist-plot.figure']['data'][0]['type'] == 'scattermapbox'
+    assert page.change({'num-images.value': 1, 'which-sex.value': ['male', 'female', 'unknown']}) == []
+    assert page.change({'display-img.n_clicks': 1}) == ['update_display', 'update_gallery']
+    assert page.values['image-gallery.data']['total'] > 1
+    assert page.change({'next-images.n_clicks': 1}) == ['update_gallery']
+    assert page.values['image-gallery.data']['cursor'] == 1
+    # Clicking a chart updates the cross-filter (in the browser), then the filtered charts and image options
+    assert sorted(page.change({'pie-plot.clickData': {'points': [{'label': 'male'}]}})) == \
+        ['update_dist_plot', 'update_image_options', 'update_pie_plot']
+    assert page.values['cross-filter.data'] == {page.values['prct-brkdwn.value']: 'male'}
 
 def test_update_dist_plot_call():
     # Check for proper type of fig (Histplot output)
     output = update_dist_plot('Species', 'View', 'alpha', "Show Map View", jsonified_data)
-    assert output['data', 0].type == "histogram"
+    assert output['data'][0]['type'] == "histogram"
    
     # Map plot output
     output2 = update_dist_plot('Species', 'Subspecies', 'alpha', "Show Histogram", jsonified_data)
-    assert output2['data', 0].type == "scattermapbox"
+    assert output2['data'][0]['type'] == "scattermapbox"
+
+    # Repeated selection is served from the figure cache
+    hits = get_cache_stats()['figures']['hits']
+    assert update_dist_plot('Species', 'View', 'alpha', "Show Map View", jsonified_data) == output
+    assert get_cache_stats()['figures']['hits'] == hits + 1
+
+
+def test_update_dist_plot_sort_patch():
+    client = server.test_client()
+    def post_dist_plot(sort_by, changed):
+        inputs = [('x-variable', 'value', 'Species'), ('color-by', 'value', 'View'), ('sort-by', 'value', sort_by),
+                  ('dist-view-btn', 'children', "Show Map View"), ('memory', 'data', jsonified_data), ('map-zoom', 'data', 1),
+                  ('cross-filter', 'data', {})]
+        response = client.post('/_dash-update-component',
+                               json = {'output': 'dist-plot.figure',
+                                       'outputs': {'id': 'dist-plot', 'property': 'figure'},
+                                       'inputs': [{'id': id, 'property': prop, 'value': value} for id, prop, value in inputs],
+                                       'changedPropIds': changed,
+                                       'state': []})
+        return response.get_json()['response']['dist-plot']['figure'], len(response.data)
+
+    # Changing only the sort order sends the new x-axis order
+    patch, size = post_dist_plot('alpha', ['sort-by.value'])
+    assert size < 500
+    assert patch['operations'] == [{'operation': 'Assign', 'location': ['layout', 'xaxis', 'categoryorder'], 'params': {'value': None}},
+                                   {'operation': 'Assign', 'location': ['layout', 'xaxis', 'categoryarray'],
+                                    'params': {'value': ['erato', 'melpomene', 'unknown']}}]
+    patch, size = post_dist_plot('sum descending', ['sort-by.value'])
+    assert patch['operations'] == [{'operation': 'Assign', 'location': ['layout', 'xaxis', 'categoryorder'],
+                                    'params': {'value': 'sum descending'}}]
+    # Other changes send the whole figure
+    figure, size = post_dist_plot('sum descending', ['x-variable.value'])
+    assert figure['data'][0]['type'] == "histogram"
+    assert figure['layout']['xaxis']['categoryorder'] == 'sum descending'
+
+
+def test_update_dist_plot_cross_filter():
+    # Histogram of rows with the values clicked in other charts
+    output = update_dist_plot('Species', 'View', 'alpha', "Show Map View", jsonified_data, cross_filter = {'Sex': 'male'})
+    assert sum(sum(trace['y']) for trace in output['data']) == 8
+    output = update_dist_plot('Species', 'View', 'alpha', "Show Map View", jsonified_data,
+                              cross_filter = {'Sex': 'male', 'Hybrid_stat': 'valid subspecies'})
+    assert sum(sum(trace['y']) for trace in output['data']) == 5
+    # but not by clicks on its own variable
+    output = update_dist_plot('Species', 'View', 'alpha', "Show Map View", jsonified_data, cross_filter = {'Species': 'erato'})
+    assert output == update_dist_plot('Species', 'View', 'alpha', "Show Map View", jsonified_data)
 
 
 def test_update_pie_plot():
     output = update_pie_plot('Subspecies', jsonified_data)
     # Pie plot
-    assert output['data', 0].type == "pie"
+    assert output['data'][0]['type'] == "pie"
+
+    # Filtered to the values clicked in other charts
+    output = update_pie_plot('Species', jsonified_data, {'Sex': 'female'})
+    assert list(output['data'][0]['labels']) == ['erato']
+    assert list(output['data'][0]['values']) == [1]
+
+
+def test_update_image_options():
+    sex, view, hybrid = update_image_options({}, jsonified_image_data)
+    assert sex == [{'label': 'unknown (1)', 'value': 'unknown', 'disabled': False},
+                   {'label': 'male (8)', 'value': 'male', 'disabled': False},
+                   {'label': 'female (1)', 'value': 'female', 'disabled': False}]
+    # Numbers of specimens matching the cross-filter, disabling values with none
+    sex, view, hybrid = update_image_options({'Species': 'melpomene'}, jsonified_image_data)
+    assert sex == [{'label': 'unknown (0)', 'value': 'unknown', 'disabled': True},
+                   {'label': 'male (4)', 'value': 'male', 'disabled': False},
+                   {'label': 'female (0)', 'value': 'female', 'disabled': True}]
+    assert [option['label'] for option in view] == ['unknown (1)', 'ventral (2)', 'dorsal (1)']
+
 
+def test_update_display():
+        selection = [['Any'], ['dorsal', 'ventral', 'unknown'], ['male', 'female', 'unknown'],
+                     ['valid subspecies', 'subspecies synonym']]
+        gallery = update_display(1, jsonified_image_data, *selection, 4)
+        assert gallery['cursor'] == 0 and gallery['page_size'] == 4 and gallery['total'] == 10
 
-def test_subspecies_options():
-    output = set_subspecies_options('Melpomene', jsonified_data)
-    assert output == [{'label': i, 'value': i} for i in ['Any-Melpomene', 'unknown', 'rosina_S', 'plesseni', 'nanna']]
+        # Pages are slices of one random order of the matching images
+        srcs = []
+        while True:
+            Imgs, pager_style, page_info = update_gallery(gallery, jsonified_image_data)
+            assert len(Imgs) == min(4, 10 - gallery['cursor'])
+            assert page_info == f"Images {gallery['cursor'] + 1}-{gallery['cursor'] + len(Imgs)} of 10"
+            assert pager_style['display'] == 'block'
+            srcs += [getattr(img, 'data-src') for img in Imgs]
+            if gallery['cursor'] + 4 >= 10:
+                break
+            # Next page (cursor moved in the browser)
+            gallery = {**gallery, 'cursor': gallery['cursor'] + 4}
+        assert sorted(srcs) == sorted('image' + str(i) for i in range(10))
+        # Same seed, same order
+        Imgs, _, _ = update_gallery({**gallery, 'cursor': 0}, jsonified_image_data)
+        assert [getattr(img, 'data-src') for img in Imgs] == srcs[:4]
 
+        # Images matching the cross-filter
+        gallery = update_display(1, jsonified_image_data, *selection, 4, {'Species': 'melpomene'})
+        Imgs, _, page_info = update_gallery(gallery, jsonified_image_data)
+        assert page_info == "Images 1-4 of 4"
+        assert sorted(getattr(img, 'data-src') for img in Imgs) == ['image5', 'image6', 'image8', 'image9']
 
-def test_update_display(mocker):
-        mocker.patch('dashboard.get_images', return_value = ['image' + str(i) for i in range(5)])
-        output = update_display(1, 
-                                jsonified_data, 
-                                ['notabilis', 'phyllis', 'guarica'],
-                                ['dorsal', 'ventral'],
-                                ['male', 'female'],
-                                ['valid subspecies', 'subspecies synonym'],
-                                5)
-        assert len(output) == 5
-        assert all([output[i] == ('image' + str(i)) for i in range(5)])
+        # No images
+        gallery = update_display(1, jsonified_data, *selection, 4)
+        assert gallery == {'message': "No Such Images to display; 10 record(s) with unknown filepath(s) match this selection. "
+                                      "Please make another selection."}
+        Imgs, pager_style, _ = update_gallery(gallery, jsonified_data)
+        assert pager_style == {'display': 'none'}
+        assert update_display(1, jsonified_image_data, ['Any'], [], ['male'], ['valid subspecies'], 4) == \
+            {'message': "Please make a selection."}
@@ -1,8 +1,19 @@
 import base64
+import contextvars
+import io
 import json
-import pandas as pd
-from io import StringIO
-from dashboard import parse_contents
+import pytest
+import dash
+from dash._callback_context import context_value
+from dash._utils import AttributeDict
+from dash.exceptions import PreventUpdate
+from concurrent.futures import ThreadPoolExecutor
+import dashboard
+from components.aggregate import get_cube
+from components.cache import get_dataset
+from dashboard import app, server, parse_contents, append_contents, load_from_search, load_upload, load_data_file
+import components.cache
+import components.registry
 
 
 # Generate test data
@@ -81,12 +92,197 @@ def test_parse_contents():
         contents = generate_mock_upload(case['filepath'])
         output = parse_contents(contents, case['filename'])
         output = json.loads(output)
-        dff = pd.read_json(StringIO(output['processed_df']), orient = 'split')
+        dff, meta = get_dataset(output['dataset_key'])
 
         assert list(dff.columns) == case['expected_columns']
         assert output['mapping'] == case['expected_mapping']
         assert output['images'] == case['expected_images']
 
         if case['filename'] == "HCGSD_test_latLonOOB.csv":
-            assert len(dff.loc[dff.Lat == 'unknown']) == 1
-            assert len(dff.loc[dff.Lon == 'unknown']) == 2
+            # Unknown lat/lon are saved as NaN
+            assert dff.Lat.isna().sum() == 1
+            assert dff.Lon.isna().sum() == 2
+
+def test_parse_contents_once(mocker):
+    # Only one callback processes uploads, of every kind (so a new one cancels the job of any other)
+    upload_inputs = ['upload-data.contents', 'append-data.contents', 'pending-file.data']
+    upload_callbacks = [callback for callback in app.callback_map.values()
+                        if set(upload_inputs) & {item['id'] + '.' + item['property'] for item in callback['inputs']}]
+    assert len(upload_callbacks) == 1
+    assert [item['id'] + '.' + item['property'] for item in upload_callbacks[0]['inputs']] == upload_inputs
+    # and in a background job, reporting its progress
+    assert upload_callbacks[0]['long']['progress'][0].component_id == 'upload-progress'
+    # with its own job key, even for the same upload (so concurrent sessions each get the result)
+    key_args = (parse_contents, ["contents", "same_name.csv"], [])
+    assert dashboard.background_manager.build_cache_key(*key_args) != dashboard.background_manager.build_cache_key(*key_args)
+
+    # Concurrent requests with the same upload are processed once
+    contents = generate_mock_upload("test_data/HCGSD_full_filepath.csv")
+    process_upload = mocker.spy(dashboard, 'process_upload')
+    with ThreadPoolExecutor(4) as executor:
+        outputs = list(executor.map(lambda _: parse_contents(contents, "test_parse_contents_once.csv"), range(4)))
+    assert process_upload.call_count == 1
+    assert len(set(outputs)) == 1
+
+def test_parse_contents_progress():
+    # Each step of processing is reported as it starts
+    contents = generate_mock_upload("test_data/HCGSD_testNA.csv")
+    messages = []
+    parse_contents(contents, "test_parse_contents_progress.csv", progress = messages.append)
+    assert messages == [dashboard.UPLOAD_STEPS[step] for step in ['validating', 'parsing', 'aggregating', 'done']]
+
+    # Rejected uploads stop at the failing step
+    contents = "data:text/csv;base64," + base64.b64encode(b"Species,Subspecies\nerato,notabilis\n").decode('utf-8')
+    messages = []
+    parse_contents(contents, "test_parse_contents_progress_missing.csv", progress = messages.append)
+    assert messages == [dashboard.UPLOAD_STEPS['validating']]
+
+def get_csv_upload(text):
+    # dcc.Upload output of a CSV with the given text
+    return "data:text/csv;base64," + base64.b64encode(text.encode('utf-8')).decode('utf-8')
+
+def test_append_contents():
+    with open("test_data/HCGSD_full_filepath.csv") as file:
+        lines = file.readlines()
+    header, rows = lines[0], lines[1:]
+    whole = json.loads(parse_contents(get_csv_upload(header + "".join(rows)), "test_append_contents_whole.csv"))
+    first = json.loads(parse_contents(get_csv_upload(header + "".join(rows[:500])), "test_append_contents_first.csv"))
+    messages = []
+    output = json.loads(append_contents(get_csv_upload(header + "".join(rows[500:])), "test_append_contents_batch.csv",
+                                        first['dataset_key'], progress = messages.append))
+    assert messages == [dashboard.UPLOAD_STEPS[step] for step in ['validating', 'parsing', 'aggregating', 'done']]
+    # Saved as a new dataset, the same as uploading all the rows together
+    assert output['dataset_key'] not in [first['dataset_key'], whole['dataset_key']]
+    assert output['all_species'] == whole['all_species']
+    dff, meta = get_dataset(output['dataset_key'])
+    expected_df, expected_meta = get_dataset(whole['dataset_key'])
+    assert meta == expected_meta
+    assert list(dff.columns) == list(expected_df.columns)
+    for col in dff.columns:
+        assert dff[col].tolist() == expected_df[col].tolist()
+    assert len(get_dataset(first['dataset_key'])[0]) == 500
+    # The cube of the first rows is extended with the appended rows, the same as counting all the rows
+    cube = components.cache.get_derived(output['dataset_key'], ('cube',), None)
+    expected_cube = get_cube(expected_df)
+    for col in expected_cube.columns:
+        assert cube[col].tolist() == expected_cube[col].tolist()
+
+    # Rows with other columns are rejected
+    output = json.loads(append_contents(get_csv_upload("Species,Subspecies,View,Sex,Hybrid_stat\nerato,notabilis,dorsal,male,valid subspecies\n"),
+                                        "test_append_contents_columns.csv", first['dataset_key']))
+    assert output['error']['columns']['found'] == ['Species', 'Subspecies', 'View', 'Sex', 'Hybrid_stat']
+
+    # Without a saved dataset, rows are uploaded as they are
+    output = json.loads(append_contents(get_csv_upload(header + "".join(rows[:500])), "test_append_contents_first.csv", 'missing'))
+    assert output == first
+
+def test_upload_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(dashboard, 'UPLOAD_DIR', str(tmp_path))
+    client = server.test_client()
+    with open("test_data/HCGSD_full_filepath.csv", "rb") as file:
+        response = client.post('/upload', data = {'file': (file, "HCGSD_full_filepath.csv")})
+    # Kept to be processed in a background job when the dashboard loads it
+    assert response.status_code == 202
+    name = response.get_json()['upload']
+    assert (tmp_path / name).is_file()
+    memory, pending = load_from_search('?upload=' + name)
+    assert pending == {'upload': name}
+    output = json.loads(load_upload(name))
+    dff, meta = get_dataset(output['dataset_key'])
+    assert output['mapping'] and output['images']
+    assert len(dff) == 772
+    assert list(tmp_path.iterdir()) == []
+    # Dashboard loads it by key, or by the upload's name once processed
+    assert json.loads(load_from_search('?dataset=' + output['dataset_key'])[0]) == output
+    assert json.loads(load_from_search('?upload=' + name)[0]) == output
+    assert json.loads(load_upload(name)) == output
+    # with the same key as the file uploaded with the "Upload Data" button
+    contents = generate_mock_upload("test_data/HCGSD_full_filepath.csv")
+    assert json.loads(parse_contents(contents, "HCGSD_full_filepath.csv"))['dataset_key'] == output['dataset_key']
+    # Processed files are returned without keeping them
+    with open("test_data/HCGSD_full_filepath.csv", "rb") as file:
+        response = client.post('/upload', data = {'file': (file, "HCGSD_full_filepath.csv")})
+    assert response.status_code == 200
+    assert response.get_json() == output
+    assert list(tmp_path.iterdir()) == []
+
+    # Missing required column, reported by the job
+    response = client.post('/upload', data = {'file': (io.BytesIO(b"Species,Subspecies\nerato,notabilis\n"), "missing.csv")})
+    assert json.loads(load_upload(response.get_json()['upload'])) == {'error': {'feature': 'View'}}
+    assert list(tmp_path.iterdir()) == []
+    response = client.post('/upload', data = {})
+    assert response.status_code == 400
+
+    # Names not of a stored upload (from the URL)
+    assert 'expired' in json.loads(load_upload('../' + output['dataset_key']))['error']
+
+def test_load_from_search():
+    assert json.loads(load_from_search('?dataset=missing')[0]) == {'error': {'expired': 'missing'}}
+    assert json.loads(load_from_search('?upload_error=%7B%22feature%22%3A%20%22Sex%22%7D')[0]) == {'error': {'feature': 'Sex'}}
+    # Malformed or unknown errors (the URL can be edited) are reported as a failed upload
+    for value in ['oops', '1', '%7B%22feature%22%3A%201%7D', '%7B%22columns%22%3A%20%22Sex%22%7D']:
+        assert json.loads(load_from_search('?upload_error=' + value)[0]) == {'error': {'other': 'The upload failed.'}}
+    with pytest.raises(PreventUpdate):
+        load_from_search('')
+
+def test_load_data_file(tmp_path, monkeypatch, mocker):
+    monkeypatch.setattr(components.registry, 'DATA_DIR', str(tmp_path))
+    with open("test_data/HCGSD_full_filepath.csv", "rb") as file:
+        (tmp_path / "specimens.csv").write_bytes(file.read())
+    output = json.loads(load_data_file('specimens.csv'))
+    dff, meta = get_dataset(output['dataset_key'])
+    assert len(dff) == 772
+    # Loaded without processing after the first time
+    process_upload = mocker.spy(dashboard, 'process_upload')
+    assert json.loads(load_data_file('specimens.csv')) == output
+    assert process_upload.call_count == 0
+
+    assert 'error' in json.loads(load_data_file('missing.csv'))
+
+    # Picked from the manifest in the request, with no background job, nor hashing in this process
+    with monkeypatch.context() as patch:
+        patch.setattr(components.registry, 'get_upload_hash', mocker.Mock(side_effect = AssertionError('hashed')))
+        assert pick_data_file('specimens.csv') == (json.dumps(output), dash.no_update)
+        # Changed files are hashed and processed in a background job
+        with open(tmp_path / "specimens.csv", "a") as file:
+            file.write('\n')
+        assert pick_data_file('specimens.csv') == (dash.no_update, {'data_file': 'specimens.csv'})
+
+    # Kept in the dataset cache directory, until the file is removed and the data directory processed again
+    assert output['dataset_key'] in components.cache.get_pinned_datasets()
+    (tmp_path / "specimens.csv").unlink()
+    assert dashboard.load_data_files() == {}
+    assert output['dataset_key'] not in components.cache.get_pinned_datasets()
+
+    # Files that cannot be loaded are returned, so startup fails (see run.sh)
+    (tmp_path / "broken.csv").write_text("Species,Sex\nerato,male\n")
+    assert list(dashboard.load_data_files()) == ['broken.csv']
+
+def pick_data_file(name):
+    # Runs `update_output` as when a file is chosen in the dataset picker
+    context = AttributeDict(triggered_inputs = [{'prop_id': 'dataset-picker.value', 'value': name}])
+    def run():
+        context_value.set(context)
+        return dashboard.update_output(None, name)
+    return contextvars.copy_context().run(run)
+
+def test_thumbnail():
+    client = server.test_client()
+    image = "test_data/images/dorsal_images/10427965_D_lowres.png"
+    response = client.get(f'/thumbnail/{dashboard.THUMBNAIL_WIDTHS[0]}/{image}')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert 'max-age' in response.headers['Cache-Control']
+    etag = response.headers['ETag']
+    # Unchanged thumbnail is not resent
+    response = client.get(f'/thumbnail/{dashboard.THUMBNAIL_WIDTHS[0]}/{image}', headers = {'If-None-Match': etag})
+    assert response.status_code == 304
+    # Full size image
+    response = client.get(f'/image/{image}')
+    assert response.status_code == 200
+    with open(image, 'rb') as file:
+        assert response.data == file.read()
+    # Unsupported width, not an image, or outside the image root
+    assert client.get(f'/thumbnail/123/{image}').status_code == 404
+    assert client.get('/image/test_data/HCGSD_testNA.csv').status_code == 404
+    assert client.get('/image/../../etc/hostname').status_code == 404